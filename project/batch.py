@@ -0,0 +1,267 @@
+import os
+import tracemalloc
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Deque, Iterable, Iterator, List, Tuple
+
+import profiling
+from cache import PatternCache, pattern_key, storable
+from compressor import CompressorSettings, compress_anytime, compress_ticks
+from ingest import iter_note_tracks
+from note import pitch_token
+from quantize import fill_rests, quantize, track_end
+from timing import decimal_step
+from track import NoteTrack
+from voices import split_voices
+
+
+# Batch conversion over a process pool
+#
+# Compression is CPU-bound and independent per voice, so every monophonic voice of every track
+# of every file is one job. Files are streamed in the parent and each voice is shipped as the raw
+# bytes of the two columns the compressor reads (pitch and length), which pickle as flat buffers
+# instead of an object per note. Results come back in input order whatever order the workers
+# finish in, the voices of a track stacked as "voice, voice", and a job that fails is reported in
+# its result instead of stopping the batch.
+
+class ConversionResult:
+    """Outcome of converting one track, or of reading a file that could not be read to the end"""
+    __slots__ = ('path', 'track_index', 'pattern', 'error')
+
+    def __init__(self, path: str, track_index: int, pattern: str | None = None, error: str | None = None):
+        self.path = path
+        self.track_index = track_index
+        self.pattern = pattern
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        outcome = f'error={self.error!r}' if self.error else f'pattern={self.pattern!r}'
+        return f'ConversionResult({self.path!r}, {self.track_index}, {outcome})'
+
+
+class _Job:
+    __slots__ = ('path', 'track_index', 'voice_index', 'voice_count', 'payload', 'future', 'attempts', 'key')
+
+    def __init__(self, path: str, track_index: int, payload: Tuple | None, voice_index: int = 0,
+                 voice_count: int = 1):
+        self.path = path
+        self.track_index = track_index
+        self.voice_index = voice_index
+        self.voice_count = voice_count
+        # None once the outcome is known (a cache hit or a file that failed to read), future
+        # then already holds it
+        self.payload = payload
+        self.future: Future | None = None
+        self.attempts = 0
+        # Cache key of a voice that has to be compressed, its pattern is stored once done (unless
+        # the search had a time budget)
+        self.key: str | None = None
+
+
+def pack_track(track: NoteTrack) -> Tuple[bytes, bytes, int]:
+    """The columns the compressor needs, as flat buffers"""
+    return track.pitch.tobytes(), track.length.tobytes(), track.resolution
+
+
+def convert_packed(pitch: bytes, length: bytes, resolution: int,
+                   settings: CompressorSettings | None = None) -> str:
+    """Compress a packed track into its pattern text, the function run by the workers"""
+    pitches = array('h')
+    pitches.frombytes(pitch)
+    lengths = array('q')
+    lengths.frombytes(length)
+    tokens = [pitch_token(p) for p in pitches]
+    if settings is not None and (settings.time_budget is not None or settings.max_candidates is not None):
+        # Within a budget, the shortest pattern found in time
+        expression = compress_anytime(tokens, lengths, resolution, settings)
+    else:
+        expression = compress_ticks(tokens, lengths, resolution, settings)
+    with profiling.stage('render'):
+        return str(expression)
+
+
+def _convert_profiled(origin: int, memory: bool, pitch: bytes, length: bytes, resolution: int,
+                      settings: CompressorSettings | None = None) -> Tuple[str, dict]:
+    """convert_packed in a worker while the parent is profiling, returns what was recorded too"""
+    profiling.enable(memory, origin)
+    try:
+        return convert_packed(pitch, length, resolution, settings), profiling.recorder().drain()
+    finally:
+        profiling.disable()
+
+
+def track_voices(track: NoteTrack, split: bool = True, grid: int | None = None) -> List[NoteTrack]:
+    """What is compressed of a track: optionally snapped to `grid` steps per beat, then split
+    into voices padded with rests up to the end of the track"""
+    with profiling.stage('voices'):
+        if grid:
+            track = quantize(track, grid)
+        if not split:
+            return [track]
+        # Up to where the time has a decimal, or the last item can't be written exactly
+        end = track_end(track)
+        end += -end % decimal_step(track.resolution)
+        return [fill_rests(voice, end) for voice in split_voices(track)]
+
+
+def _iter_jobs(paths: Iterable[str], settings: CompressorSettings | None,
+               cache: PatternCache | None, split: bool, grid: int | None) -> Iterator[_Job]:
+    for path in paths:
+        track_index = 0
+        try:
+            for track in iter_note_tracks(path):
+                voices = track_voices(track, split, grid)
+                for voice_index, voice in enumerate(voices):
+                    job = _Job(path, track_index, pack_track(voice), voice_index, len(voices))
+                    if cache is not None:
+                        key = pattern_key(voice.pitch, voice.length, voice.resolution, settings)
+                        pattern = cache.get(key)
+                        if pattern is None:
+                            if storable(settings):
+                                job.key = key
+                        else:
+                            # Already converted, nothing is left to compute
+                            job.payload = None
+                            job.future = Future()
+                            job.future.set_result(pattern)
+                    yield job
+                track_index += 1
+        except Exception as error:
+            job = _Job(path, track_index, None)
+            job.future = Future()
+            job.future.set_exception(error)
+            yield job
+
+
+def _finished(future: Future) -> bool:
+    """Whether a future already holds its result, which a broken pool does not take away"""
+    return future.done() and not future.cancelled() and not isinstance(future.exception(), BrokenProcessPool)
+
+
+def _describe(error: BaseException) -> str:
+    return f'{type(error).__name__}: {error}'
+
+
+def _finished_result(job: _Job, cache: PatternCache | None) -> ConversionResult:
+    error = job.future.exception()
+    if error is not None:
+        return ConversionResult(job.path, job.track_index, error=_describe(error))
+    pattern = job.future.result()
+    if isinstance(pattern, tuple):
+        # A profiled worker sends what it recorded along
+        pattern, recorded = pattern
+        profiling.recorder().merge(recorded)
+    if cache is not None and job.key is not None:
+        cache.put(job.key, pattern)
+    return ConversionResult(job.path, job.track_index, pattern)
+
+
+def convert_files(paths: Iterable[str], jobs: int | None = None, settings: CompressorSettings | None = None,
+                  cache: PatternCache | None = None, split: bool = True,
+                  grid: int | None = None) -> Iterator[ConversionResult]:
+    """Convert every track of every file, yielding results in file and track order.
+
+    jobs is the number of worker processes, os.cpu_count() by default; with 1 everything runs in
+    this process. Only a bounded window of voices is in flight, so archives of any size stream
+    through in constant memory. Voices found in the cache skip compression, the others are
+    stored in it. With split off, tracks are compressed as one sequence whatever overlaps and
+    without rests. grid snaps notes to that many steps per beat first."""
+    parts: List[ConversionResult] = []
+    for job, result in _run_jobs(paths, jobs or os.cpu_count() or 1, settings, cache, split, grid):
+        parts.append(result)
+        if job.voice_index < job.voice_count - 1:
+            continue
+
+        errors = [part.error for part in parts if not part.ok]
+        if errors:
+            yield ConversionResult(job.path, job.track_index, error='; '.join(errors))
+        else:
+            yield ConversionResult(job.path, job.track_index, ', '.join(part.pattern for part in parts))
+        parts = []
+
+
+def _run_jobs(paths: Iterable[str], jobs: int, settings: CompressorSettings | None,
+              cache: PatternCache | None, split: bool,
+              grid: int | None) -> Iterator[Tuple[_Job, ConversionResult]]:
+    """(job, result) of every voice, in order"""
+    if jobs == 1:
+        for job in _iter_jobs(paths, settings, cache, split, grid):
+            if job.payload is None:
+                yield job, _finished_result(job, cache)
+                continue
+            job.future = Future()
+            try:
+                job.future.set_result(convert_packed(*job.payload, settings))
+            except Exception as error:
+                job.future.set_exception(error)
+            yield job, _finished_result(job, cache)
+        return
+
+    window = jobs * 4
+    pending: Deque[_Job] = deque()
+    executor = ProcessPoolExecutor(jobs)
+
+    def submit(job: _Job):
+        job.attempts += 1
+        if profiling.enabled:
+            job.future = executor.submit(_convert_profiled, profiling.recorder().origin,
+                                         tracemalloc.is_tracing(), *job.payload, settings)
+        else:
+            job.future = executor.submit(convert_packed, *job.payload, settings)
+
+    try:
+        job_stream = _iter_jobs(paths, settings, cache, split, grid)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < window:
+                job = next(job_stream, None)
+                if job is None:
+                    exhausted = True
+                    break
+                if job.payload is not None:
+                    submit(job)
+                pending.append(job)
+            if not pending:
+                return
+
+            job = pending.popleft()
+            try:
+                job.future.result()
+            except BrokenProcessPool as error:
+                # A worker died (crash, out of memory) and took the pool with it. Unfinished jobs
+                # get a second try on a fresh pool, jobs that already had one are reported failed
+                executor.shutdown(cancel_futures=True)
+                executor = ProcessPoolExecutor(jobs)
+                if job.attempts < 2:
+                    pending.appendleft(job)
+                    submit(job)
+                else:
+                    yield job, ConversionResult(job.path, job.track_index, error=_describe(error))
+                for other in pending:
+                    if other.payload is None or other is job or _finished(other.future):
+                        continue
+                    if other.attempts < 2:
+                        submit(other)
+                    else:
+                        other.future = Future()
+                        other.future.set_exception(error)
+                continue
+            except Exception:
+                # Reported from the future by _finished_result
+                pass
+            yield job, _finished_result(job, cache)
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def convert_file(path: str, jobs: int | None = None, settings: CompressorSettings | None = None,
+                 cache: PatternCache | None = None, split: bool = True,
+                 grid: int | None = None) -> List[ConversionResult]:
+    """Convert the tracks of one file in parallel"""
+    return list(convert_files([path], jobs, settings, cache, split, grid))
@@ -0,0 +1,57 @@
+"""Benchmark note_on/note_off pairing on synthetic dense tracks.
+
+Every track keeps `held` notes sounding at once (a sustained piano or a drum roll), which made the
+old linear scan over the held notes quadratic. The time per event should stay flat as the
+track grows.
+
+Usage: python bench/note_pairing.py [held]
+"""
+import os
+import random
+import sys
+import time
+
+import mido
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ingest import pair_notes
+
+
+def dense_track(event_count: int, held: int, seed: int = 0):
+    """Synthetic track with `held` overlapping notes, retriggers and velocity 0 note-offs"""
+    rng = random.Random(seed)
+    messages = []
+    sounding = []
+
+    while len(messages) < event_count:
+        if len(sounding) < held:
+            key = (rng.randrange(16), rng.randrange(128))
+            sounding.append(key)
+            messages.append(mido.Message('note_on', channel=key[0], note=key[1], velocity=100, time=rng.randrange(4)))
+        else:
+            channel, note = sounding.pop(rng.randrange(len(sounding)))
+            if rng.random() < 0.5:
+                messages.append(mido.Message('note_on', channel=channel, note=note, velocity=0, time=rng.randrange(4)))
+            else:
+                messages.append(mido.Message('note_off', channel=channel, note=note, time=rng.randrange(4)))
+
+    return messages
+
+
+def main():
+    held = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+
+    print(f'{"events":>10} {"notes":>10} {"seconds":>10} {"ns/event":>10}')
+    for event_count in (100_000, 200_000, 400_000, 800_000):
+        messages = dense_track(event_count, held)
+
+        start = time.perf_counter()
+        note_count = sum(1 for _ in pair_notes(messages))
+        elapsed = time.perf_counter() - start
+
+        print(f'{event_count:>10} {note_count:>10} {elapsed:>10.3f} {elapsed / event_count * 1e9:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
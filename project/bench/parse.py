@@ -0,0 +1,62 @@
+"""Benchmark parse_pattern throughput on large generated patterns.
+
+Patterns are shaped like compressor output: a long alternation of leaves, groups and repeats with
+nested alternations and exact decimal lengths. Throughput in MB/s should stay flat as the
+pattern grows, and deeply nested patterns parse without hitting the recursion limit.
+
+Usage: python bench/parse.py [items]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from parser import parse_pattern
+
+
+def generated_pattern(item_count: int, seed: int = 0) -> str:
+    """Compressor-like pattern of `item_count` items"""
+    rng = random.Random(seed)
+    notes = [str(n) for n in range(36, 96)]
+    items = []
+    for _ in range(item_count):
+        kind = rng.random()
+        if kind < 0.4:
+            items.append(f'{rng.choice(notes)}@{rng.choice(["0.25", "0.5", "1.5", "2"])}')
+        elif kind < 0.7:
+            items.append('[' + ' '.join(rng.choice(notes) for _ in range(rng.randint(2, 8))) + ']@2')
+        else:
+            slots = []
+            for _ in range(rng.randint(2, 6)):
+                if rng.random() < 0.3:
+                    slots.append('<' + ' '.join(rng.choice(notes) for _ in range(3)) + '>@0.5')
+                else:
+                    slots.append(rng.choice(notes))
+            items.append('[' + ' '.join(slots) + f']@{rng.randint(2, 8)}*{rng.randint(2, 16)}')
+    return '<' + ' '.join(items) + '>'
+
+
+def measure(text: str, label: str):
+    start = time.perf_counter()
+    parse_pattern(text)
+    elapsed = time.perf_counter() - start
+    print(f'{label:>16} {len(text) / 1e6:>10.2f} {elapsed:>10.3f} {len(text) / 1e6 / elapsed:>10.2f}')
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+
+    print(f'{"pattern":>16} {"MB":>10} {"seconds":>10} {"MB/s":>10}')
+    items = largest // 8
+    while items <= largest:
+        measure(generated_pattern(items), f'{items} items')
+        items *= 2
+
+    depth = 100_000
+    measure('[' * depth + 'a' + ']' * depth, f'depth {depth}')
+
+
+if __name__ == '__main__':
+    main()
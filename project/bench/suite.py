@@ -0,0 +1,220 @@
+"""Benchmark suite: parsing, rendering, unwrapping, MIDI ingestion and compression.
+
+Every case is timed as the best of a few runs and the results are written as JSON. Given a
+baseline (by default bench/baseline.json, written with --save-baseline), each case is compared
+with the baseline of its mode, full or --quick, and cases missing from it are listed. Seconds only
+compare on the machine they were measured on: the run fails on a slowdown past the tolerance when
+the baseline was recorded on this machine, or with --strict, and only reports it otherwise.
+
+Usage: python bench/suite.py [--quick] [--only NAME] [--output results.json]
+                             [--baseline FILE] [--save-baseline] [--tolerance 1.25] [--strict]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+import mido
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from codec import dumps, loads
+from compiled import unwrap_compact
+from compressor import compress_ticks
+from ingest import read_note_tracks
+from note_pairing import dense_track
+from parse import generated_pattern
+from parser import parse_pattern
+from verify import random_sequences
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+class Case:
+    """One benchmark: setup() builds the input once, run(input) is what gets timed"""
+
+    def __init__(self, name: str, setup: Callable, run: Callable, units: int, unit: str,
+                 teardown: Callable | None = None):
+        self.name = name
+        self.setup = setup
+        self.run = run
+        self.teardown = teardown
+        # How much work one run does, for a throughput next to the time
+        self.units = units
+        self.unit = unit
+
+
+def parse_cases(scale: int) -> List[Case]:
+    items = 20_000 * scale
+    depth = 20_000 * scale
+    return [
+        Case(f'parse/long/{items}', lambda: generated_pattern(items), parse_pattern, items, 'items'),
+        Case(f'parse/nested/{depth}', lambda: '[' * depth + 'a' + ']' * depth, parse_pattern, depth, 'levels'),
+    ]
+
+
+def render_cases(scale: int) -> List[Case]:
+    items = 20_000 * scale
+    return [
+        Case(f'render/{items}', lambda: parse_pattern(generated_pattern(items)), str, items, 'items'),
+        Case(f'binary/dumps/{items}', lambda: parse_pattern(generated_pattern(items)), dumps, items, 'items'),
+        Case(f'binary/loads/{items}', lambda: dumps(parse_pattern(generated_pattern(items))), loads, items, 'items'),
+    ]
+
+
+def coprime_alternations(sizes: Tuple[int, ...]) -> str:
+    return '<' + ' '.join('<%s>' % ' '.join(str(i) for i in range(n)) for n in sizes) + '>'
+
+
+def unwrap_cases(scale: int) -> List[Case]:
+    cases = []
+    nestings = [(3, 5, 7, 11), (3, 5, 7, 11, 13)] + ([(4, 7, 9, 11, 13)] if scale > 1 else [])
+    for sizes in nestings:
+        text = coprime_alternations(sizes)
+        cycles = parse_pattern(text).get_cycle_length()
+        cases.append(Case(f'unwrap/coprime/{"x".join(map(str, sizes))}', lambda text=text: parse_pattern(text),
+                          lambda expr: expr.unwrap(), cycles, 'cycles'))
+        cases.append(Case(f'unwrap/compact/{"x".join(map(str, sizes))}', lambda text=text: parse_pattern(text),
+                          unwrap_compact, cycles, 'cycles'))
+    return cases
+
+
+def write_dense_midi(event_count: int, held: int) -> str:
+    mid = mido.MidiFile(ticks_per_beat=480)
+    for seed in range(4):
+        track = mido.MidiTrack()
+        track.extend(dense_track(event_count // 4, held, seed))
+        mid.tracks.append(track)
+    handle, path = tempfile.mkstemp(suffix='.mid')
+    os.close(handle)
+    mid.save(path)
+    return path
+
+
+def ingest_cases(scale: int) -> List[Case]:
+    events = 100_000 * scale
+    return [
+        Case(f'ingest/dense/{events}', lambda: write_dense_midi(events, 64), read_note_tracks, events, 'events',
+             teardown=os.remove),
+        Case(f'ingest/mido/{events}', lambda: write_dense_midi(events, 64),
+             lambda path: read_note_tracks(path, fast=False), events, 'events', teardown=os.remove),
+    ]
+
+
+def compress_cases(scale: int) -> List[Case]:
+    cases = []
+    for notes in (500, 2000, 8000 * scale):
+        def setup(notes=notes):
+            values, lengths = [], []
+            for sequence_values, sequence_lengths, _ in random_sequences(10_000, seed=notes, max_notes=200):
+                values += sequence_values
+                lengths += sequence_lengths
+                if len(values) >= notes:
+                    return values[:notes], lengths[:notes]
+
+        cases.append(Case(f'compress/{notes}', setup, lambda sequence: compress_ticks(*sequence, 4), notes, 'notes'))
+    return cases
+
+
+def measure(case: Case, repeats: int) -> Dict:
+    data = case.setup()
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        case.run(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if case.teardown is not None:
+        case.teardown(data)
+    return {'seconds': best, 'throughput': case.units / best, 'unit': f'{case.unit}/s'}
+
+
+def fingerprint() -> Dict[str, str]:
+    """What has to match for timings to be comparable"""
+    return {'node': platform.node(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'python': platform.python_version()}
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> Tuple[List[str], List[str]]:
+    """Cases slower than `tolerance` times their baseline, and cases the baseline doesn't have"""
+    regressions = []
+    missing = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            missing.append(name)
+            continue
+        ratio = result['seconds'] / reference['seconds']
+        result['vs_baseline'] = ratio
+        if ratio > tolerance:
+            regressions.append(f'{name}: {ratio:.2f}x the baseline time')
+    return regressions, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='smaller inputs')
+    parser.add_argument('--only', help='run the cases whose name starts with this')
+    parser.add_argument('--output', help='write the results here as JSON')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown factor counted as a regression')
+    parser.add_argument('--strict', action='store_true',
+                        help='fail on regressions even against a baseline from another machine')
+    args = parser.parse_args()
+
+    mode = 'quick' if args.quick else 'full'
+    scale = 1 if args.quick else 2
+    repeats = 3
+    cases = parse_cases(scale) + render_cases(scale) + unwrap_cases(scale) + ingest_cases(scale) + compress_cases(scale)
+    if args.only:
+        cases = [case for case in cases if case.name.startswith(args.only)]
+
+    results = {}
+    print(f'{"case":>28} {"seconds":>10} {"throughput":>22}')
+    for case in cases:
+        result = results[case.name] = measure(case, repeats)
+        print(f'{case.name:>28} {result["seconds"]:>10.4f} {result["throughput"]:>14,.0f} {result["unit"]:<7}')
+
+    # {mode: {'machine': fingerprint(), 'results': {case: result}}}
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as infile:
+            baselines = json.load(infile)
+
+    regressions = []
+    missing = []
+    gate = False
+    if args.save_baseline:
+        baselines[mode] = {'machine': fingerprint(), 'results': results}
+        with open(args.baseline, 'w') as outfile:
+            json.dump(baselines, outfile, indent=2, sort_keys=True)
+    elif mode in baselines:
+        baseline = baselines[mode]
+        regressions, missing = compare(results, baseline['results'], args.tolerance)
+        gate = args.strict or baseline['machine'] == fingerprint()
+        if not gate:
+            print(f'baseline recorded on {baseline["machine"]}, slowdowns are reported without failing the run')
+    else:
+        print(f'no {mode} baseline in {args.baseline}, record one with --save-baseline')
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': results, 'regressions': regressions, 'missing': missing}, outfile, indent=2,
+                      sort_keys=True)
+
+    for name in missing:
+        print(f'NOT IN BASELINE {name}')
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    sys.exit(1 if gate and regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import hashlib
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from typing import Sequence
+
+import profiling
+from codec import dumps, loads
+from compressor import CompressorSettings
+from expression import Expression
+from parser import parse_pattern
+
+
+# Content-addressed cache of compressed patterns
+#
+# The pattern of a track only depends on its pitches, its lengths as fractions of a beat and the
+# compressor settings, so that is what the key hashes: start times, channels and velocities are
+# left out and the tick grid is reduced to the coarsest one the lengths fit on. The same stem
+# found in another arrangement, or at another ticks-per-beat, hits the same entry.
+#
+# The time budget is left out of the key too. A search that ran out of budget returns a longer
+# pattern than the full search would, so only results of unbudgeted searches are stored
+# (see storable()); a budgeted run still reads the full result when one is there. A budget of
+# candidates (max_candidates) gives the same pattern on every machine, so it is part of the key
+# and its results are stored.
+#
+# Entries live in one SQLite file, which takes care of locking between concurrent processes.
+# The total size of the stored patterns is kept under max_bytes by evicting the least recently
+# used entries. A pattern stored from a tree keeps the tree's binary form (codec.py) next to
+# the text, so get_expression() loads it back without parsing.
+
+# Bump when the compressor output changes, so stale patterns are never served
+FORMAT_VERSION = 1
+
+
+def pattern_key(pitches: Sequence[int], lengths: Sequence[int], resolution: int,
+                settings: CompressorSettings | None = None) -> str:
+    """Hash of everything the compressed pattern of a track depends on"""
+    settings = settings or CompressorSettings()
+    divisor = math.gcd(resolution, *lengths)
+    if divisor > 1:
+        lengths = [length // divisor for length in lengths]
+        resolution //= divisor
+
+    digest = hashlib.blake2b(digest_size=20)
+    options = sorted((name, value) for name, value in vars(settings).items() if name != 'time_budget')
+    digest.update(repr((FORMAT_VERSION, sys.byteorder, options, resolution, len(pitches))).encode())
+    digest.update(array('h', pitches).tobytes())
+    digest.update(array('q', lengths).tobytes())
+    return digest.hexdigest()
+
+
+def storable(settings: CompressorSettings | None) -> bool:
+    """Whether patterns compressed with settings may be cached: not if the search had a budget"""
+    return settings is None or settings.time_budget is None
+
+
+def track_key(track, settings: CompressorSettings | None = None) -> str:
+    """pattern_key of a NoteTrack"""
+    return pattern_key(track.pitch, track.length, track.resolution, settings)
+
+
+class PatternCache:
+    """Size-bounded LRU cache of patterns in a single SQLite file.
+
+    Any number of processes can share the file. Connections are opened per process and thread,
+    so a cache object can be handed to forked workers or used from an executor thread."""
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._connection: sqlite3.Connection | None = None
+        # (process, thread) the connection was opened in, SQLite connections stay in their thread
+        self._owner = None
+
+    def _connect(self) -> sqlite3.Connection:
+        owner = (os.getpid(), threading.get_ident())
+        if self._connection is None or self._owner != owner:
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS patterns '
+                               '(key TEXT PRIMARY KEY, pattern TEXT NOT NULL, size INTEGER NOT NULL, '
+                               'last_used INTEGER NOT NULL, tree BLOB)')
+            if 'tree' not in {row[1] for row in connection.execute('PRAGMA table_info(patterns)')}:
+                # A file written before trees were stored
+                connection.execute('ALTER TABLE patterns ADD COLUMN tree BLOB')
+            connection.execute('CREATE INDEX IF NOT EXISTS patterns_last_used ON patterns (last_used)')
+            connection.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                               'size INTEGER NOT NULL)')
+            connection.execute('INSERT OR IGNORE INTO totals VALUES (0, 0)')
+            self._connection = connection
+            self._owner = owner
+        return self._connection
+
+    def _lookup(self, key: str, columns: str) -> tuple | None:
+        connection = self._connect()
+        row = connection.execute(f'SELECT {columns} FROM patterns WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            profiling.count('cache.misses')
+            return None
+        self.hits += 1
+        profiling.count('cache.hits')
+        connection.execute('UPDATE patterns SET last_used = ? WHERE key = ?', (time.time_ns(), key))
+        return row
+
+    def get(self, key: str) -> str | None:
+        """The stored pattern, marked as just used, or None"""
+        row = self._lookup(key, 'pattern')
+        return None if row is None else row[0]
+
+    def get_expression(self, key: str) -> Expression | None:
+        """The stored pattern as a tree, loaded from its binary form unless it was stored as text"""
+        row = self._lookup(key, 'pattern, tree')
+        if row is None:
+            return None
+        pattern, tree = row
+        return parse_pattern(pattern) if tree is None else loads(tree)
+
+    def put_expression(self, key: str, expression: Expression):
+        """Store a pattern with its tree"""
+        self.put(key, str(expression), dumps(expression))
+
+    def put(self, key: str, pattern: str, tree: bytes | None = None):
+        """Store a pattern, evicting the least recently used ones beyond max_bytes"""
+        size = len(pattern.encode()) + (len(tree) if tree is not None else 0)
+        if size > self.max_bytes:
+            return
+
+        connection = self._connect()
+        # IMMEDIATE takes the write lock up front, so the running total can't race another writer
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT size FROM patterns WHERE key = ?', (key,)).fetchone()
+            connection.execute('INSERT OR REPLACE INTO patterns VALUES (?, ?, ?, ?, ?)',
+                               (key, pattern, size, time.time_ns(), tree))
+            total = connection.execute('UPDATE totals SET size = size + ? WHERE id = 0 RETURNING size',
+                                       (size - (row[0] if row else 0),)).fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(connection, total - self.max_bytes)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _evict(connection: sqlite3.Connection, excess: int):
+        freed = 0
+        evicted = []
+        for key, size in connection.execute('SELECT key, size FROM patterns ORDER BY last_used'):
+            evicted.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        connection.executemany('DELETE FROM patterns WHERE key = ?', evicted)
+        connection.execute('UPDATE totals SET size = size - ? WHERE id = 0', (freed,))
+
+    def size(self) -> int:
+        """Bytes of pattern text and trees stored"""
+        return self._connect().execute('SELECT size FROM totals WHERE id = 0').fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._connect().execute('SELECT COUNT(*) FROM patterns').fetchone()[0]
+
+    def close(self):
+        if self._connection is not None and self._owner == (os.getpid(), threading.get_ident()):
+            self._connection.close()
+        self._connection = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        return state
@@ -0,0 +1,186 @@
+import gc
+import struct
+import sys
+from array import array
+from fractions import Fraction
+from typing import Dict, List
+
+from expression import AngleExpression, BracketExpression, Expression, MultiplierExpression
+from timing import Time, to_time
+
+
+# Binary form of expression trees
+#
+# Pattern text has to be parsed back into a tree, which makes text a slow way to store or hand
+# over a tree. This format is the tree itself, flattened: every node in preorder as a few ints,
+# after tables of the distinct values and lengths it uses. Almost all of the ints are small, so
+# each is written as one signed byte, and the few that don't fit (long child lists, big tables)
+# are moved to an array of 64-bit ints with a marker byte left in their place. Loading is a
+# single pass over the ints with no tokenizing, no number conversion and no recursion.
+#
+# A node is its code (kind in the low two bits, whether the value is a list, how the length is
+# stored), the multiplier of a MultiplierExpression, then its value (an index into the value
+# table or a child count), then its length (nothing when 1, an index into the length table, or
+# a child count). Children follow their parent, value children before length children.
+
+MAGIC = b'STRX'
+VERSION = 1
+
+# Magic, version, bytes of value text, ints of the tables, wide ints
+_HEADER = struct.Struct('<4sBIII')
+_KINDS = (Expression, AngleExpression, BracketExpression, MultiplierExpression)
+_KIND_CODES = {kind: code for code, kind in enumerate(_KINDS)}
+
+_MULTIPLIER = 3
+_VALUE_LIST = 4
+_LENGTH_TABLE = 8
+_LENGTH_LIST = 16
+_LENGTH_FORMS = _LENGTH_TABLE | _LENGTH_LIST
+
+# Stands for the next wide int, no small int is written as this
+_WIDE = -128
+
+
+def dumps(expr: Expression) -> bytes:
+    """The binary form of an expression tree"""
+    ints: List[int] = []
+    emit = ints.append
+    values: Dict[str, int] = {}
+    lengths: Dict[Time, int] = {}
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        value = node.value
+        length = node.length
+        code = _KIND_CODES[type(node)]
+        if isinstance(value, list):
+            code |= _VALUE_LIST
+        if isinstance(length, list):
+            code |= _LENGTH_LIST
+        elif length != 1:
+            code |= _LENGTH_TABLE
+
+        emit(code)
+        if code & _MULTIPLIER == _MULTIPLIER:
+            emit(node.multiplier)
+        if code & _VALUE_LIST:
+            emit(len(value))
+        else:
+            emit(values.setdefault(value, len(values)))
+        if code & _LENGTH_TABLE:
+            emit(lengths.setdefault(to_time(length), len(lengths)))
+        elif code & _LENGTH_LIST:
+            emit(len(length))
+            stack.extend(reversed(length))
+        if code & _VALUE_LIST:
+            stack.extend(reversed(value))
+
+    # The tables go in front: the size of every value, then every length as a fraction
+    table = [len(values)] + [len(value) for value in values] + [len(lengths)]
+    for length in lengths:
+        table += (length.numerator, length.denominator)
+    ints = table + ints
+
+    try:
+        wide = array('q', [value for value in ints if not -128 < value < 128])
+    except OverflowError:
+        raise ValueError('expression has numbers too large for the binary format') from None
+    if wide:
+        ints = [value if -128 < value < 128 else _WIDE for value in ints]
+    if sys.byteorder == 'big':
+        wide.byteswap()
+    text = ''.join(values).encode()
+    return (_HEADER.pack(MAGIC, VERSION, len(text), len(table), len(wide)) + text + wide.tobytes()
+            + array('b', ints).tobytes())
+
+
+def loads(data: bytes) -> Expression:
+    """The expression tree dumps() wrote, raises ValueError for anything else"""
+    try:
+        magic, version, text_size, table_size, wide_size = _HEADER.unpack_from(data)
+    except struct.error:
+        raise ValueError('not a binary expression') from None
+    if magic != MAGIC:
+        raise ValueError('not a binary expression')
+    if version != VERSION:
+        raise ValueError(f'binary expression version {version}, expected {VERSION}')
+
+    start = _HEADER.size + text_size
+    text = bytes(data[_HEADER.size:start]).decode()
+    wide = array('q')
+    wide.frombytes(data[start:start + 8 * wide_size])
+    ints = array('b')
+    ints.frombytes(data[start + 8 * wide_size:])
+    ints = ints.tolist()
+    if len(wide) != wide_size or ints.count(_WIDE) != wide_size:
+        raise ValueError('truncated binary expression')
+    if wide_size:
+        if sys.byteorder == 'big':
+            wide.byteswap()
+        wide = iter(wide)
+        ints = [value if value != _WIDE else next(wide) for value in ints]
+
+    # The tree is acyclic, collecting while it grows only rescans it over and over
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _load(ints, text, table_size)
+    except IndexError:
+        raise ValueError('truncated binary expression') from None
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def _load(ints: List[int], text: str, table_size: int) -> Expression:
+    values = []
+    offset = 0
+    value_count = ints[0]
+    for size in ints[1:1 + value_count]:
+        values.append(text[offset:offset + size])
+        offset += size
+    pos = 1 + value_count
+    lengths = [Fraction(ints[idx], ints[idx + 1]) for idx in range(pos + 1, pos + 1 + 2 * ints[pos], 2)]
+    # Whole lengths load as ints, as the parser reads them
+    lengths = [length.numerator if length.denominator == 1 else length for length in lengths]
+
+    kinds = _KINDS
+    new = object.__new__
+    root = []
+    # [list being filled, children still to read] per open list, innermost last
+    stack = [[root, 1]]
+    pos = table_size
+    while stack:
+        code = ints[pos]
+        expr = new(kinds[code & _MULTIPLIER])
+        if code & _MULTIPLIER == _MULTIPLIER:
+            pos += 1
+            expr.__dict__['multiplier'] = ints[pos]
+        value = ints[pos + 1]
+        pos += 2
+
+        # Built directly, a fresh node has nothing cached to invalidate
+        if code & _LENGTH_FORMS == 0:
+            length = 1
+        elif code & _LENGTH_TABLE:
+            length = lengths[ints[pos]]
+            pos += 1
+        else:
+            length_count = ints[pos]
+            pos += 1
+            length = []
+        if code & _VALUE_LIST:
+            expr.__dict__.update(value=[], length=length, cycle_idx=0)
+        else:
+            expr.__dict__.update(value=values[value], length=length, cycle_idx=0)
+
+        frame = stack[-1]
+        frame[0].append(expr)
+        frame[1] -= 1
+        while stack and not stack[-1][1]:
+            stack.pop()
+        if code & _LENGTH_LIST and length_count:
+            stack.append([length, length_count])
+        if code & _VALUE_LIST and value:
+            stack.append([expr.value, value])
+    return root[0]
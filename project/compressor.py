@@ -0,0 +1,483 @@
+import bisect
+import math
+import time
+from fractions import Fraction
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import profiling
+from expression import AngleExpression, BracketExpression, Expression, MultiplierExpression
+from note import pitch_token
+from timing import Time, decimal_step, format_time, is_decimal, to_ticks, to_time
+
+
+# Compression of a monophonic sequence into the shortest pattern
+#
+# The output is always an angle expression with one item per cycle, which is the shape
+# Expression.unwrap() produces, so the compressed pattern unwraps back to the input sequence.
+# An item is one of:
+#   leaf        value@length
+#   group       [v v v]@total                 a run of notes sharing one length
+#   repeat      [slot slot ...]@total*r       a body played r times, where a slot is a value or
+#                                             an alternation <v w ...> that advances every repeat
+#   span        [v@w v@w ...]@total           notes in a bracket, each weighted by its length
+#
+# The search is a shortest path over the positions of the sequence (dynamic programming), every
+# edge being one item. Repeats are found with run-length tables: runs[P][i] counts how many
+# tokens after i still match the token P positions further, so "is there a repeat of period P
+# at i, and for how long" is an O(1) lookup and the whole search is O(n * max_period).
+#
+# Lengths are moved onto a common integer tick grid first, so the search compares plain ints and
+# the lengths written out are exact. Mini-notation writes lengths as decimals, and a time like 1/3
+# has none, so only items taking a multiple of decimal_step() ticks are written on their own. A
+# note that doesn't starts a span, running to where the time has a decimal again, its notes
+# weighted relative to each other as repeat bodies are. A sequence whose total length has no
+# decimal can't be written exactly, its last item gets the nearest float.
+#
+# The search is exact within its limits (longest period, alternations per slot), and its cost
+# grows with them. compress_progressive() is the anytime form for long tracks: it hands out the
+# flat pattern at once, then runs the search again with ever wider limits, yielding each pattern
+# that is shorter than the last, until the time budget runs out or the consumer stops asking.
+# A time budget makes the result depend on the machine and its load; max_candidates bounds the
+# work instead, so the same input and settings always give the same pattern.
+
+LEAF = 0
+GROUP = 1
+REPEAT = 2
+SPAN = 3
+
+
+class CompressorSettings:
+    """Search space and budget of the compressor"""
+
+    def __init__(self, max_period: int = 16, max_alternatives: int = 4, max_repeat: int = 16,
+                 max_group: int = 32, time_budget: float | None = None, max_candidates: int | None = None):
+        # Longest repeated body (in notes, alternations included) that is looked for
+        self.max_period = max_period
+        # Most values a single <...> slot may alternate between
+        self.max_alternatives = max_alternatives
+        # Repeat counts above this are only tried when they run to the end of the repetition
+        self.max_repeat = max_repeat
+        # Longest [...] group of notes sharing one length
+        self.max_group = max_group
+        # Seconds the search may take. compress() encodes what is left note by note once it runs
+        # out, compress_progressive() stops refining and keeps the shortest pattern found by then
+        self.time_budget = time_budget
+        # Candidate items one search may weigh before it stops the same way. Unlike the time
+        # budget this is reproducible; compress_progressive() gives each of its searches as many
+        self.max_candidates = max_candidates
+
+
+_at_costs: Dict[Time, int] = {}
+
+
+def at_cost(length: Time) -> int:
+    """Characters used by the @length suffix"""
+    cost = _at_costs.get(length)
+    if cost is None:
+        cost = _at_costs[length] = 0 if length == 1 else 1 + len(format_time(length))
+    return cost
+
+
+def period_runs(values: Sequence, lengths: Sequence[int], period: int) -> List[int]:
+    """runs[i] = how many consecutive tokens from i on are equal to the token `period` later"""
+    n = len(values)
+    runs = [0] * (n + 1)
+    for i in range(n - period - 1, -1, -1):
+        if values[i] == values[i + period] and lengths[i] == lengths[i + period]:
+            runs[i] = runs[i + 1] + 1
+    return runs
+
+
+def length_runs(lengths: Sequence[int], period: int) -> List[int]:
+    """Same as period_runs, comparing only the lengths"""
+    n = len(lengths)
+    runs = [0] * (n + 1)
+    for i in range(n - period - 1, -1, -1):
+        if lengths[i] == lengths[i + period]:
+            runs[i] = runs[i + 1] + 1
+    return runs
+
+
+def minimal_period(items: Sequence) -> int:
+    """Smallest p dividing len(items) such that items is its first p items repeated"""
+    n = len(items)
+    for p in range(1, n):
+        if n % p == 0 and all(items[i] == items[i - p] for i in range(p, n)):
+            return p
+    return n
+
+
+class _Body:
+    """Slots of a repeated body, with the unit that makes them cheapest to write"""
+
+    def __init__(self, slots: List[Tuple[List[str], int]], resolution: int):
+        # Each slot is (values it alternates between, length in ticks), a single value is a plain leaf
+        self.slots = slots
+        self.length = sum(length for _, length in slots)
+
+        text_costs = []
+        for slot_values, _ in slots:
+            if len(slot_values) == 1:
+                text_costs.append(len(slot_values[0]))
+            else:
+                text_costs.append(2 + sum(len(v) for v in slot_values) + len(slot_values) - 1)
+
+        # Slot lengths are weights relative to each other, so any of them can be the unit, as long
+        # as every weight is then written exactly. Their gcd always is, every weight is whole
+        self.cost = None
+        self.unit = resolution
+        units = {math.gcd(*(length for _, length in slots))}
+        for unit in {resolution, *(length for _, length in slots)}:
+            if all(is_decimal(Fraction(length, unit)) for _, length in slots):
+                units.add(unit)
+        for unit in units:
+            cost = 2 + len(slots) - 1 + sum(text_cost + at_cost(Fraction(length, unit))
+                                            for text_cost, (_, length) in zip(text_costs, slots))
+            if self.cost is None or cost < self.cost:
+                self.cost = cost
+                self.unit = unit
+
+
+def compress(values: Sequence[str], lengths: Sequence,
+             settings: CompressorSettings | None = None) -> AngleExpression:
+    """Find the shortest pattern that unwraps to the (value, length) sequence"""
+    resolution, ticks = to_ticks(lengths)
+    return compress_ticks(values, ticks, resolution, settings)
+
+
+def compress_ticks(values: Sequence[str], lengths: Sequence[int], resolution: int,
+                   settings: CompressorSettings | None = None) -> AngleExpression:
+    """Same as compress(), lengths given in ticks with `resolution` ticks per cycle"""
+    pattern = AngleExpression()
+    pattern.value = [item for _, _, item in compress_segments(values, lengths, resolution, settings)]
+    return pattern
+
+
+def flat_pattern(values: Sequence[str], lengths: Sequence[int], resolution: int) -> AngleExpression:
+    """The pattern with one note per cycle, as Expression.unwrap() writes it, lengths in ticks.
+
+    Notes whose time has no decimal are written in spans, as the compressor writes them."""
+    step = decimal_step(resolution)
+    ends = span_ends(lengths, step)
+    items = []
+    j = 0
+    while j < len(values):
+        if lengths[j] % step == 0:
+            items.append(Expression.leaf(values[j], Fraction(lengths[j], resolution)))
+            j += 1
+        else:
+            body = _Body([([values[i]], lengths[i]) for i in range(j, ends[j])], resolution)
+            items.append(_body_bracket(body, Fraction(body.length, resolution)))
+            j = ends[j]
+    pattern = AngleExpression()
+    pattern.value = items
+    return pattern
+
+
+def span_ends(lengths: Sequence[int], step: int) -> List[int]:
+    """ends[j] = first position after j where the time since j is a multiple of `step` ticks,
+    the end of the sequence when there is none"""
+    n = len(lengths)
+    ends = [n] * n
+    if step == 1:
+        return [j + 1 for j in range(n)]
+    residues = [0] * (n + 1)
+    for i, length in enumerate(lengths):
+        residues[i + 1] = (residues[i] + length) % step
+    later = {residues[n]: n}
+    for j in range(n - 1, -1, -1):
+        ends[j] = later.get(residues[j], n)
+        later[residues[j]] = j
+    return ends
+
+
+def _search_levels(settings: CompressorSettings) -> Iterator[CompressorSettings]:
+    """Ever wider search limits up to those of `settings`, each covering the previous ones"""
+    period = 2
+    alternatives = 1
+    while period < settings.max_period:
+        yield CompressorSettings(period, min(alternatives, settings.max_alternatives), settings.max_repeat,
+                                 settings.max_group, max_candidates=settings.max_candidates)
+        period *= 2
+        alternatives += 1
+    yield CompressorSettings(settings.max_period, settings.max_alternatives, settings.max_repeat, settings.max_group,
+                             max_candidates=settings.max_candidates)
+
+
+def compress_progressive(values: Sequence[str], lengths: Sequence[int], resolution: int,
+                         settings: CompressorSettings | None = None) -> Iterator[AngleExpression]:
+    """Yield ever shorter patterns of the sequence, lengths in ticks, the flat one first.
+
+    Every pattern yielded is complete and unwraps to the sequence. The last one is what
+    compress_ticks() finds, unless settings.time_budget or max_candidates ran out first."""
+    settings = settings or CompressorSettings()
+    deadline = None if settings.time_budget is None else time.perf_counter() + settings.time_budget
+
+    best = flat_pattern(values, lengths, resolution)
+    best_size = len(str(best))
+    yield best
+
+    for level in _search_levels(settings):
+        if deadline is not None:
+            level.time_budget = deadline - time.perf_counter()
+            if level.time_budget <= 0:
+                return
+        pattern = compress_ticks(values, lengths, resolution, level)
+        # Wider limits never find a longer pattern, unless the budget cut the search short
+        size = len(str(pattern))
+        if size < best_size:
+            best_size = size
+            yield pattern
+        if deadline is not None and time.perf_counter() > deadline:
+            return
+
+
+def compress_anytime(values: Sequence[str], lengths: Sequence[int], resolution: int,
+                     settings: CompressorSettings | None = None) -> AngleExpression:
+    """The shortest pattern compress_progressive() finds within the budgets of settings"""
+    for pattern in compress_progressive(values, lengths, resolution, settings):
+        best = pattern
+    return best
+
+
+def compress_segments(values: Sequence[str], lengths: Sequence[int], resolution: int,
+                      settings: CompressorSettings | None = None) -> List[Tuple[int, int, Expression]]:
+    """The items of the shortest pattern, each with the (start, end) span of tokens it plays"""
+    with profiling.stage('compress'):
+        return _compress_segments(values, lengths, resolution, settings or CompressorSettings())
+
+
+def _compress_segments(values: Sequence[str], lengths: Sequence[int], resolution: int,
+                       settings: CompressorSettings) -> List[Tuple[int, int, Expression]]:
+    n = len(values)
+    deadline = None if settings.time_budget is None else time.perf_counter() + settings.time_budget
+    max_candidates = settings.max_candidates
+    # Items are only written on their own when they take a multiple of `step` ticks
+    step = decimal_step(resolution)
+    ends = span_ends(lengths, step)
+
+    value_costs = [len(v) for v in values]
+    tick_costs: Dict[int, int] = {}
+
+    def tick_cost(ticks):
+        cost = tick_costs.get(ticks)
+        if cost is None:
+            cost = tick_costs[ticks] = at_cost(Fraction(ticks, resolution))
+        return cost
+    prefix_value_costs = [0]
+    for cost in value_costs:
+        prefix_value_costs.append(prefix_value_costs[-1] + cost)
+
+    max_period = min(settings.max_period, n)
+    token_runs = [None] + [period_runs(values, lengths, period) for period in range(1, max_period + 1)]
+    duration_runs = [None] + [length_runs(lengths, period) for period in range(1, max_period // 2 + 1)]
+    same_length_runs = length_runs(lengths, 1)
+
+    # best[i] = cost of the first i tokens, each item counted with its separating space
+    best = [0] + [math.inf] * n
+    # choice[i] = (start, kind, params) of the last item of best[i]
+    choice: List[Tuple | None] = [None] * (n + 1)
+    # Items weighed other than single notes, only reported when profiling
+    candidates = [0]
+    # Repetitive music keeps finding the same bodies at different positions
+    bodies: Dict[Tuple, _Body] = {}
+
+    def get_body(slots):
+        key = tuple((tuple(slot_values), length) for slot_values, length in slots)
+        body = bodies.get(key)
+        if body is None:
+            body = bodies[key] = _Body(slots, resolution)
+        return body
+
+    def relax_repeats(base, j, body, p, alternatives, max_blocks):
+        """Relax every repeat of `body` from j, in whole blocks of `alternatives` repeats"""
+        fixed_cost = base + body.cost + 1
+        body_length = body.length
+        small_blocks = min(max_blocks, max(1, settings.max_repeat // alternatives))
+        repeats = list(range(alternatives, small_blocks * alternatives + 1, alternatives))
+        if max_blocks > small_blocks:
+            repeats.append(max_blocks * alternatives)
+        candidates[0] += len(repeats)
+
+        for repeat in repeats:
+            if repeat < 2 or body_length * repeat % step:
+                continue
+            end = j + p * repeat
+            cost = fixed_cost + tick_cost(body_length * repeat) + len(str(repeat))
+            if cost < best[end]:
+                best[end] = cost
+                choice[end] = (j, REPEAT, (body, repeat))
+
+    exhausted = False
+    for j in range(n):
+        base = best[j] + 1
+        if lengths[j] % step == 0:
+            cost = base + value_costs[j] + tick_cost(lengths[j])
+            if cost < best[j + 1]:
+                best[j + 1] = cost
+                choice[j + 1] = (j, LEAF, None)
+        elif best[j] < math.inf:
+            # No decimal for the note's length, it starts a span
+            end = ends[j]
+            body = get_body([([values[i]], lengths[i]) for i in range(j, end)])
+            cost = base + body.cost + tick_cost(body.length)
+            if cost < best[end]:
+                best[end] = cost
+                choice[end] = (j, SPAN, body)
+
+        if not exhausted and deadline is not None and j % 256 == 0 and time.perf_counter() > deadline:
+            exhausted = True
+        if not exhausted and max_candidates is not None and candidates[0] > max_candidates:
+            exhausted = True
+        if exhausted:
+            continue
+
+        # Groups of notes sharing one length, written once for the whole group
+        group_length = lengths[j]
+        if group_length != resolution:
+            largest_group = min(same_length_runs[j] + 1, settings.max_group)
+            candidates[0] += max(0, largest_group - 1)
+            for size in range(2, largest_group + 1):
+                if group_length * size % step:
+                    continue
+                cost = base + 2 + prefix_value_costs[j + size] - prefix_value_costs[j] + size - 1 \
+                    + tick_cost(group_length * size)
+                if cost < best[j + size]:
+                    best[j + size] = cost
+                    choice[j + size] = (j, GROUP, size)
+
+        for period in range(1, max_period + 1):
+            runs = token_runs[period]
+            if j + period > n:
+                break
+
+            # Exact repeats of `period` tokens, skipping bodies that are themselves repeats since
+            # the shorter period covers the same span for less
+            if runs[j] >= period and not any(token_runs[d][j] >= period - d
+                                             for d in range(1, period // 2 + 1) if period % d == 0):
+                body = get_body([([values[i]], lengths[i]) for i in range(j, j + period)])
+                relax_repeats(base, j, body, period, 1, (runs[j] + period) // period)
+
+            # Repeats of `p` slots where some slots alternate over `alternatives` repeats
+            for alternatives in range(2, settings.max_alternatives + 1):
+                p, remainder = divmod(period, alternatives)
+                if remainder or p == 0:
+                    continue
+                if duration_runs[p][j] < period - p or token_runs[p][j] >= period - p:
+                    continue
+
+                slots = []
+                for s in range(j, j + p):
+                    slot_values = [values[s + p * t] for t in range(alternatives)]
+                    slots.append((slot_values[:minimal_period(slot_values)], lengths[s]))
+                relax_repeats(base, j, get_body(slots), p, alternatives, (runs[j] + period) // period)
+
+    profiling.count('compress.notes', n)
+    profiling.count('compress.candidates', candidates[0] + n)
+
+    segments = []
+    end = n
+    while end > 0:
+        start, kind, params = choice[end]
+        segments.append((start, end, _build_item(values, lengths, resolution, start, end, kind, params)))
+        end = start
+    segments.reverse()
+    return segments
+
+
+def _build_item(values, lengths, resolution, start, end, kind, params) -> Expression:
+    if kind == LEAF:
+        return Expression.leaf(values[start], Fraction(lengths[start], resolution))
+
+    if kind == GROUP:
+        group = BracketExpression()
+        group.value = [Expression.leaf(values[i], 1) for i in range(start, end)]
+        group.length = Fraction(lengths[start] * params, resolution)
+        return group
+
+    if kind == SPAN:
+        return _body_bracket(params, Fraction(params.length, resolution))
+
+    body, repeat = params
+    multiplier = MultiplierExpression()
+    multiplier.value = [_body_bracket(body, Fraction(body.length * repeat, resolution))]
+    multiplier.multiplier = repeat
+    return multiplier
+
+
+def _body_bracket(body: _Body, length: Time) -> BracketExpression:
+    """The slots of a body in a bracket taking `length` cycles"""
+    bracket = BracketExpression()
+    bracket.value = []
+    for slot_values, slot_length in body.slots:
+        if len(slot_values) == 1:
+            bracket.value.append(Expression.leaf(slot_values[0], Fraction(slot_length, body.unit)))
+        else:
+            alternation = AngleExpression()
+            alternation.value = [Expression.leaf(value, 1) for value in slot_values]
+            alternation.length = Fraction(slot_length, body.unit)
+            bracket.value.append(alternation)
+    bracket.length = length
+    return bracket
+
+
+def compress_track(track, settings: CompressorSettings | None = None) -> AngleExpression:
+    """Compress the notes of a NoteTrack, in stored order"""
+    return compress_ticks([pitch_token(pitch) for pitch in track.pitch], track.length, track.resolution, settings)
+
+
+class IncrementalCompressor:
+    """Compressed pattern of a sequence that is kept up to date through edits.
+
+    The pattern is a list of items, each playing a contiguous span of tokens, so an edit only has
+    to recompress the items it touches (and `margin` items on either side, so repeats can grow
+    over the edit) and splice them into the expression in place. Everything else, the expression
+    tree included, is kept. The result is not always the global optimum compress() would find,
+    call recompress() to get that back."""
+
+    def __init__(self, values: Sequence[str], lengths: Sequence, settings: CompressorSettings | None = None,
+                 margin: int = 1):
+        self.settings = settings
+        self.margin = margin
+        self.values: List[str] = []
+        self.lengths: List[Time] = []
+        # ends[i] is the token the i-th item stops before, items start where the previous one ends
+        self.ends: List[int] = []
+        self.expression = AngleExpression()
+        self.expression.value = []
+        self.replace(0, 0, values, lengths)
+
+    def _compress(self, start: int, end: int) -> List[Tuple[int, int, Expression]]:
+        resolution, ticks = to_ticks(self.lengths[start:end])
+        return [(start + item_start, start + item_end, item) for item_start, item_end, item
+                in compress_segments(self.values[start:end], ticks, resolution, self.settings)]
+
+    def replace(self, start: int, end: int, values: Sequence[str], lengths: Sequence) -> AngleExpression:
+        """Replace tokens start..end (exclusive) with new ones and update the pattern"""
+        values = list(values)
+        lengths = [to_time(length) for length in lengths]
+        ends = self.ends
+
+        # Items overlapping the edit, widened by the margin
+        first = max(0, bisect.bisect_right(ends, start) - self.margin)
+        last = min(len(ends) - 1, bisect.bisect_left(ends, end) + self.margin)
+        region_start = ends[first - 1] if first > 0 else 0
+        region_end = ends[last] if last >= first else region_start
+
+        self.values[start:end] = values
+        self.lengths[start:end] = lengths
+        shift = len(values) - (end - start)
+
+        segments = self._compress(region_start, region_end + shift)
+        self.ends = ends[:first] + [item_end for _, item_end, _ in segments] + [e + shift for e in ends[last + 1:]]
+        self.expression.value[first:last + 1] = [item for _, _, item in segments]
+        Expression.invalidate()
+        return self.expression
+
+    def recompress(self) -> AngleExpression:
+        """Compress the whole sequence again, for the optimal pattern after many edits"""
+        segments = self._compress(0, len(self.values))
+        self.ends = [end for _, end, _ in segments]
+        self.expression.value[:] = [item for _, _, item in segments]
+        Expression.invalidate()
+        return self.expression
@@ -0,0 +1 @@
+# Makes the flat project modules (expression, parser, ...) importable from test/
@@ -1,44 +1,258 @@
-from typing import List, Union, Tuple
+from fractions import Fraction
+from typing import Iterator, List, Union, Tuple
+import functools
 import math
+import weakref
+
+from timing import Time, format_time, to_time
+
+
+@functools.lru_cache(maxsize=4096)
+def _length_text(length: Time) -> str:
+    # Patterns use few distinct lengths, each is formatted once
+    return '@' + format_time(length)
+
+
+class ExpressionMetrics:
+    """Subtree metrics of an expression, computed once bottom-up and cached on the node"""
+    __slots__ = ('cycle_length', 'total_length', 'weight', 'node_count', 'generation', 'slot_lengths', 'span',
+                 'rates')
+
+    def __init__(self, cycle_length: int, total_length: Time, weight: Time, node_count: int, generation: int):
+        # Cycles needed for the subtree to return to its start
+        self.cycle_length = cycle_length
+        # Length of the expression itself (its @ value)
+        self.total_length = total_length
+        # Sum of the children's lengths, what a bracket divides its length by
+        self.weight = weight
+        # Expressions in the subtree, this one included
+        self.node_count = node_count
+        self.generation = generation
+        # Length each child gets inside a bracket, filled in on first use
+        self.slot_lengths: List[Time] | None = None
+        # Summed duration of the events of any one cycle, None when it differs between cycles
+        self.span: Time | None = None
+        # (Average events per cycle, most events of any one cycle), filled in on first use
+        self.rates: Tuple[Fraction, int] | None = None
+
+
+# Bounds on unwrapping
+#
+# A period is the LCM of every nested alternation's length, so a short pattern can take millions
+# of cycles to come back round, and unwrap() builds an object per event of all of them. The cost
+# is predicted from the tree before anything is built, from how many events every subtree plays
+# per cycle, and unwrapping is refused when it is over the limits. The prediction is checked as
+# unwrapping goes too, so the limits hold even where it is low. compiled.unwrap_compact() holds
+# a period in arrays instead, for periods too long to keep as objects.
+
+class UnwrapLimitError(ValueError):
+    """Unwrapping would take more cycles, events or memory than allowed"""
+
+    def __init__(self, message: str, cost: 'UnwrapCost'):
+        super().__init__(message)
+        self.cost = cost
+
+
+class UnwrapCost:
+    """What unwrapping some cycles of an expression takes, predicted from the tree alone.
+
+    events is exact unless an alternation is sampled unevenly, which a nested alternation whose
+    length shares a factor with its parent's is: it then only plays some of its elements.
+    max_events, from the busiest cycle, is never exceeded."""
+    __slots__ = ('cycles', 'events', 'max_events')
+
+    # Bytes an event takes as a leaf Expression with its duration, as unwrap() builds it
+    OBJECT_BYTES = 320
+    # Bytes an event takes as a value id and a tick count in arrays, spare capacity included
+    ARRAY_BYTES = 20
+
+    def __init__(self, cycles: int, events: int, max_events: int):
+        self.cycles = cycles
+        self.events = events
+        self.max_events = max_events
+
+    @property
+    def object_bytes(self) -> int:
+        return self.events * UnwrapCost.OBJECT_BYTES
+
+    @property
+    def array_bytes(self) -> int:
+        return self.events * UnwrapCost.ARRAY_BYTES
+
+    def __repr__(self):
+        return f'UnwrapCost(cycles={self.cycles}, events={self.events}, max_events={self.max_events})'
+
+
+class UnwrapLimits:
+    """How far unwrapping may go before it is refused, None for no limit"""
+
+    def __init__(self, max_cycles: int | None = 10_000_000, max_events: int | None = 10_000_000,
+                 max_bytes: int | None = 256 * 1024 * 1024):
+        self.max_cycles = max_cycles
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+
+    def check(self, cost: UnwrapCost, event_bytes: int):
+        """Raise UnwrapLimitError when the predicted cost is over a limit"""
+        if self.max_cycles is not None and cost.cycles > self.max_cycles:
+            raise UnwrapLimitError(f'unwrapping takes {cost.cycles} cycles, the limit is {self.max_cycles}', cost)
+        cap = self.event_cap(event_bytes)
+        if cap is not None and cost.events > cap:
+            raise UnwrapLimitError(f'unwrapping makes about {cost.events} events '
+                                   f'({cost.events * event_bytes / 2 ** 20:.1f}MB), the limit is {cap}', cost)
+
+    def event_cap(self, event_bytes: int) -> int | None:
+        """Most events within the limits, at event_bytes each"""
+        caps = [limit for limit in (self.max_events, None if self.max_bytes is None else self.max_bytes // event_bytes)
+                if limit is not None]
+        return min(caps) if caps else None
+
+
+# What unwrap() is held to when not given limits, replace it to change them everywhere
+DEFAULT_LIMITS = UnwrapLimits()
 
 
 class Expression:
     start_char = ""
-    end_char = " "
+    end_char = ""
+
+    # Bumped whenever the structure of a measured expression changes, which invalidates every
+    # cached metric. A node that was never measured cannot be part of a measured tree, so building
+    # trees costs nothing. Mutating a value list in place bypasses this, call invalidate() after.
+    _generation = 0
+    _metrics: ExpressionMetrics | None = None
+    _structural_attributes = frozenset(('value', 'length', 'multiplier'))
 
     def __init__(self):
         self.value: Union[List[Expression], str] = ""
-        self.length: Union[List[Expression], int] = 1
+        self.length: Union[List[Expression], Time, int] = 1
         self.cycle_idx: int = 0
 
-    def get_total_length(self) -> float:
-        """Calculate the total length/duration of this expression"""
+    @classmethod
+    def leaf(cls, value: str, length=1) -> 'Expression':
+        """A plain value, built directly since a fresh node has nothing cached to invalidate"""
+        leaf = cls.__new__(cls)
+        leaf.__dict__.update(value=value, length=length, cycle_idx=0)
+        return leaf
+
+    def __setattr__(self, name, value):
+        if self._metrics is not None and name in Expression._structural_attributes:
+            Expression._generation += 1
+        object.__setattr__(self, name, value)
+
+    @staticmethod
+    def invalidate():
+        """Drop all cached metrics, needed after editing a value list in place"""
+        Expression._generation += 1
+
+    def metrics(self) -> ExpressionMetrics:
+        """Cycle length, lengths and node count of this subtree, cached until an expression changes"""
+        cached = self._metrics
+        if cached is not None and cached.generation == Expression._generation:
+            return cached
+
+        children = [expr.metrics() for expr in self.value] if isinstance(self.value, List) else []
         if isinstance(self.length, List):
             # If length is an expression, evaluate it
-            return sum(expr.get_total_length() for expr in self.length)
-        return float(self.length)
+            total_length = sum(expr.metrics().total_length for expr in self.length)
+        else:
+            total_length = self.length if isinstance(self.length, (int, Fraction)) else to_time(self.length)
+
+        metrics = ExpressionMetrics(
+            self._cycle_length(children),
+            total_length,
+            sum(child.total_length for child in children),
+            1 + sum(child.node_count for child in children),
+            Expression._generation,
+        )
+        self._metrics = metrics
+        metrics.span = self._span(children)
+        return metrics
+
+    def get_total_length(self) -> Time:
+        """Calculate the total length/duration of this expression, exactly"""
+        if isinstance(self.length, (int, Fraction)):
+            return self.length
+        return self.metrics().total_length
 
     def get_cycle_length(self) -> int:
         """Get the number of cycles needed for this expression to return to start"""
-        if isinstance(self.value, List):
-            if not self.value:
-                return 1
-            # LCM of all sub-expression cycle lengths
-            cycles = [expr.get_cycle_length() for expr in self.value]
-            result = cycles[0]
-            for c in cycles[1:]:
-                result = (result * c) // math.gcd(result, c)
-            return result
-        return 1
+        return self.metrics().cycle_length
+
+    def _cycle_length(self, children: List[ExpressionMetrics]) -> int:
+        # LCM of all sub-expression cycle lengths
+        return math.lcm(*(child.cycle_length for child in children)) if children else 1
+
+    def _span(self, children: List[ExpressionMetrics]) -> Time | None:
+        return self.get_total_length() if isinstance(self.value, str) else 0
 
-    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, float]]:
+    def cycle_span(self, cycle: int) -> Time:
+        """Summed duration of the events of one cycle, O(depth) at most"""
+        span = self.metrics().span
+        return span if span is not None else self._varying_span(cycle)
+
+    def _varying_span(self, cycle: int) -> Time:
+        return sum(duration for _, duration in self.iter_cycle(cycle))
+
+    def iter_cycle(self, cycle: int) -> Iterator[Tuple[str, Time]]:
+        """Lazily yield the (value, duration) pairs evaluate_at_position returns for this cycle"""
+        if isinstance(self.value, str):
+            yield self.value, self.get_total_length()
+
+    def cycle_events(self, cycle: int) -> List[Tuple[str, Time]]:
+        """What plays at this cycle, walking only the branches selected for it"""
+        return list(self.iter_cycle(cycle))
+
+    def events(self, start_cycle: int = 0, end_cycle: int | None = None) -> Iterator[Tuple[str, Time, Time]]:
+        """Stream (value, onset, duration) for the cycles start_cycle..end_cycle (exclusive).
+
+        Nothing is materialised, so huge unwraps can be previewed in constant memory. Onsets count
+        from the start of start_cycle; end_cycle defaults to one full period of the pattern."""
+        if end_cycle is None:
+            end_cycle = start_cycle + self.get_cycle_length()
+
+        onset = 0
+        for cycle in range(start_cycle, end_cycle):
+            for value, duration in self.iter_cycle(cycle):
+                yield value, onset, duration
+                onset += duration
+
+    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, Time]]:
         """Evaluate expression at current cursor position, return list of (value, duration) pairs"""
         if isinstance(self.value, str):
             return [(self.value, self.get_total_length())]
         return []
 
-    def unwrap(self):
-        """Unwrap into the most unfolded version"""
+    def event_rates(self) -> Tuple[Fraction, int]:
+        """(Average events per cycle over a period, most events of any one cycle)"""
+        metrics = self.metrics()
+        if metrics.rates is None:
+            metrics.rates = self._event_rates()
+        return metrics.rates
+
+    def _event_rates(self) -> Tuple[Fraction, int]:
+        return (Fraction(1), 1) if isinstance(self.value, str) else (Fraction(0), 0)
+
+    def unwrap_cost(self, cycles: int | None = None) -> UnwrapCost:
+        """What unwrapping `cycles` cycles takes, one period by default, without unwrapping"""
+        if cycles is None:
+            cycles = self.get_cycle_length()
+        mean, peak = self.event_rates()
+        return UnwrapCost(cycles, math.ceil(mean * cycles), peak * cycles)
+
+    def unwrap(self, limits: UnwrapLimits | None = None):
+        """Unwrap into the most unfolded version, refused with UnwrapLimitError past the limits"""
+        return self._unwrap_period(limits)
+
+    def _unwrap_period(self, limits: UnwrapLimits | None) -> 'AngleExpression':
+        limits = limits or DEFAULT_LIMITS
+        cost = self.unwrap_cost()
+        limits.check(cost, UnwrapCost.OBJECT_BYTES)
+        cap = limits.event_cap(UnwrapCost.OBJECT_BYTES)
+        if cap is not None and cost.max_events <= cap:
+            # Can't go over, no need to count
+            cap = None
+
         cursor = ExpressionCursor()
         results = []
 
@@ -50,65 +264,105 @@ class Expression:
             cursor.cycle = cycle
             cycle_results = self.evaluate_at_position(cursor)
             results.extend(cycle_results)
+            if cap is not None and len(results) > cap:
+                # More than predicted, the prediction only averages uneven alternations
+                raise UnwrapLimitError(f'unwrapping made more than {cap} events by cycle {cycle}', cost)
 
         # Create the unwrapped angle expression
         unwrapped = AngleExpression()
-        unwrapped.value = []
-
-        for val, dur in results:
-            elem = Expression()
-            elem.value = val
-            elem.length = dur
-            unwrapped.value.append(elem)
+        unwrapped.value = [Expression.leaf(val, dur) for val, dur in results]
 
         return unwrapped
 
-    def _inner_value_repr(self, inner_value):
-        return inner_value
-
-    def __str__(self):
-        inner_value = ""
+    def freeze(self) -> 'Node':
+        """The interned, immutable form of this tree"""
         if isinstance(self.value, List):
-            for i, inner in enumerate(self.value):
-                if i > 0:
-                    inner_value += " "
-                inner_value += inner.__str__()
+            value = tuple(expr.freeze() for expr in self.value)
+        else:
+            value = self.value
+        if isinstance(self.length, List):
+            length = tuple(expr.freeze() for expr in self.length)
         else:
-            inner_value = self.value
-            if isinstance(self.length, List):
-                inner_value += "@" + self.length.__str__()
+            length = self.length
+        return Node.make(type(self), value, length, getattr(self, 'multiplier', 1))
+
+    def __reduce__(self):
+        # Pickled in the binary form, which is compact and loads without recursion
+        from codec import dumps, loads
+        return loads, (dumps(self),)
+
+    def _closing(self) -> str:
+        return self.end_char
+
+    def _suffix(self) -> str:
+        """What follows the contents: the closing bracket and the @ length"""
+        length = self.length
+        if isinstance(length, list):
+            return self._closing() + '@' + ' '.join(str(expr) for expr in length)
+        if length != 1:
+            return self._closing() + _length_text(length)
+        return self._closing()
+
+    def write(self, parts: List[str]):
+        """Append the text of this expression to `parts`, for one join at the end.
+
+        Every node is written once, so rendering is linear in the output size, and the tree is
+        walked with an explicit stack, so deep nesting can't exhaust the recursion limit."""
+        if isinstance(self.value, str):
+            parts.append(self.start_char + self.value + self._suffix())
+            return
+
+        append = parts.append
+        append(self.start_char)
+        # One open expression per level: the iterator over its children and the text closing it
+        stack = [(iter(self.value), self._suffix())]
+        separator = ''
+        while stack:
+            children, suffix = stack[-1]
+            for child in children:
+                value = child.value
+                length = child.length
+                # _suffix() inlined for the common cases, this loop is the whole cost of rendering
+                if child.__class__ is MultiplierExpression or length.__class__ is list:
+                    closing = child._suffix()
+                elif length == 1:
+                    closing = child.end_char
+                else:
+                    closing = child.end_char + _length_text(length)
+
+                if value.__class__ is str:
+                    append(separator + child.start_char + value + closing)
+                    separator = ' '
+                else:
+                    append(separator + child.start_char)
+                    stack.append((iter(value), closing))
+                    separator = ''
+                    break
             else:
-                if self.length != 1:
-                    inner_value += "@" + str(self.length)
+                stack.pop()
+                append(suffix)
+                separator = ' '
 
-        return self.__class__.start_char + self._inner_value_repr(inner_value) + self.__class__.end_char
+    def __str__(self):
+        parts = []
+        self.write(parts)
+        return ''.join(parts)
 
 
 class AngleExpression(Expression):
     start_char = "<"
     end_char = ">"
 
-    def get_cycle_length(self) -> int:
+    def _cycle_length(self, children: List[ExpressionMetrics]) -> int:
         """Angle expression cycles through all its elements"""
         if isinstance(self.value, List):
-            # The angle expression itself takes len(self.value) cycles to complete
-            # But we also need to consider nested expressions
+            # The angle expression itself takes len(self.value) cycles to complete, but nested
+            # cycling expressions need the LCM
             base_cycles = len(self.value) if self.value else 1
-
-            # If any element is also a cycling expression, we need LCM
-            nested_cycles = []
-            for expr in self.value:
-                nested_cycles.append(expr.get_cycle_length())
-
-            # LCM of base_cycles with all nested cycles
-            result = base_cycles
-            for c in nested_cycles:
-                result = (result * c) // math.gcd(result, c)
-
-            return result
+            return math.lcm(base_cycles, *(child.cycle_length for child in children))
         return 1
 
-    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, float]]:
+    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, Time]]:
         """Angle brackets alternate between elements on each cycle"""
         if isinstance(self.value, str):
             return [(self.value, self.get_total_length())]
@@ -127,7 +381,34 @@ class AngleExpression(Expression):
 
         return []
 
-    def unwrap(self):
+    def _span(self, children: List[ExpressionMetrics]) -> Time | None:
+        if isinstance(self.value, str):
+            return self.get_total_length()
+        spans = {child.span for child in children}
+        if not spans:
+            return 0
+        # Only fixed if whichever element is selected takes the same time
+        return spans.pop() if len(spans) == 1 else None
+
+    def _varying_span(self, cycle: int) -> Time:
+        return self.value[cycle % len(self.value)].cycle_span(cycle)
+
+    def iter_cycle(self, cycle: int) -> Iterator[Tuple[str, Time]]:
+        if isinstance(self.value, str):
+            yield self.value, self.get_total_length()
+        elif self.value:
+            yield from self.value[cycle % len(self.value)].iter_cycle(cycle)
+
+    def _event_rates(self) -> Tuple[Fraction, int]:
+        if isinstance(self.value, str):
+            return Fraction(1), 1
+        if not self.value:
+            return Fraction(0), 0
+        # Every element is selected as often over a period, unless nested lengths share factors
+        rates = [expr.event_rates() for expr in self.value]
+        return sum(mean for mean, _ in rates) / len(rates), max(peak for _, peak in rates)
+
+    def unwrap(self, limits: UnwrapLimits | None = None):
         """Unwrap angle expression by showing all values across cycles"""
         if isinstance(self.value, str):
             # Simple string value
@@ -135,52 +416,22 @@ class AngleExpression(Expression):
             unwrapped.value = self.value
             unwrapped.length = self.length
             return unwrapped
-
-        cursor = ExpressionCursor()
-        results = []
-
-        # Calculate how many cycles we need to complete
-        total_cycles = self.get_cycle_length()
-
-        # Evaluate for each cycle
-        for cycle in range(total_cycles):
-            cursor.cycle = cycle
-            cycle_results = self.evaluate_at_position(cursor)
-            results.extend(cycle_results)
-
-        # Create the unwrapped angle expression
-        unwrapped = AngleExpression()
-        unwrapped.value = []
-
-        for val, dur in results:
-            elem = Expression()
-            elem.value = val
-            elem.length = dur
-            unwrapped.value.append(elem)
-
-        return unwrapped
+        return self._unwrap_period(limits)
 
 
 class BracketExpression(Expression):
     start_char = "["
     end_char = "]"
 
-    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, float]]:
+    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, Time]]:
         """Bracket expressions play elements sequentially within a single cycle"""
         if isinstance(self.value, str):
             return [(self.value, self.get_total_length())]
 
         if isinstance(self.value, List) and self.value:
             results = []
-            total_len = self.get_total_length()
-
-            # Calculate total weight (considering lengths)
-            total_weight = sum(expr.get_total_length() for expr in self.value)
-
-            for expr in self.value:
-                expr_weight = expr.get_total_length()
-                expr_duration = (expr_weight / total_weight) * total_len
 
+            for expr, expr_duration in zip(self.value, self._slot_lengths()):
                 if isinstance(expr.value, str):
                     # Simple value
                     results.append((expr.value, expr_duration))
@@ -189,7 +440,9 @@ class BracketExpression(Expression):
                     nested_results = expr.evaluate_at_position(cursor)
                     # Scale nested results to fit in this slot
                     nested_total = sum(d for _, d in nested_results)
-                    if nested_total > 0:
+                    if nested_total == expr_duration:
+                        results.extend(nested_results)
+                    elif nested_total > 0:
                         scale_factor = expr_duration / nested_total
                         for val, dur in nested_results:
                             results.append((val, dur * scale_factor))
@@ -198,7 +451,9 @@ class BracketExpression(Expression):
                     nested_results = expr.evaluate_at_position(cursor)
                     # Scale nested results to fit in this slot
                     nested_total = sum(d for _, d in nested_results)
-                    if nested_total > 0:
+                    if nested_total == expr_duration:
+                        results.extend(nested_results)
+                    elif nested_total > 0:
                         scale_factor = expr_duration / nested_total
                         for val, dur in nested_results:
                             results.append((val, dur * scale_factor))
@@ -207,31 +462,68 @@ class BracketExpression(Expression):
 
         return []
 
-    def unwrap(self):
-        """Unwrap bracket expression into angle expression format"""
-        cursor = ExpressionCursor()
-        results = []
-
-        # Calculate how many cycles we need to complete
-        total_cycles = self.get_cycle_length()
-
-        # Evaluate for each cycle
-        for cycle in range(total_cycles):
-            cursor.cycle = cycle
-            cycle_results = self.evaluate_at_position(cursor)
-            results.extend(cycle_results)
-
-        # Create the unwrapped angle expression
-        unwrapped = AngleExpression()
-        unwrapped.value = []
-
-        for val, dur in results:
-            elem = Expression()
-            elem.value = val
-            elem.length = dur
-            unwrapped.value.append(elem)
+    def _slot_lengths(self) -> List[Time]:
+        """Length of every element's slot, which only depends on the lengths so it is computed once"""
+        metrics = self.metrics()
+        if metrics.slot_lengths is None:
+            total_len = metrics.total_length
+            total_weight = metrics.weight
+            metrics.slot_lengths = [Fraction(expr.get_total_length()) / total_weight * total_len
+                                    for expr in self.value]
+        return metrics.slot_lengths
+
+    def _span(self, children: List[ExpressionMetrics]) -> Time | None:
+        if isinstance(self.value, str):
+            return self.get_total_length()
+        if not self.value:
+            return 0
+
+        # Nested elements that play nothing leave their slot out
+        silent = []
+        for expr, child in zip(self.value, children):
+            if isinstance(expr.value, str):
+                continue
+            if child.span is None:
+                return None
+            if child.span <= 0:
+                silent.append(expr)
+        if not silent:
+            return self.get_total_length()
+        return sum(slot for expr, slot in zip(self.value, self._slot_lengths()) if expr not in silent)
+
+    def _varying_span(self, cycle: int) -> Time:
+        return sum(slot for expr, slot in zip(self.value, self._slot_lengths())
+                   if isinstance(expr.value, str) or expr.cycle_span(cycle) > 0)
+
+    def iter_cycle(self, cycle: int) -> Iterator[Tuple[str, Time]]:
+        if isinstance(self.value, str):
+            yield self.value, self.get_total_length()
+            return
+
+        for expr, expr_duration in zip(self.value, self._slot_lengths()):
+            if isinstance(expr.value, str):
+                yield expr.value, expr_duration
+                continue
+
+            # Scale nested events to fit in this slot
+            nested_total = expr.cycle_span(cycle)
+            if nested_total == expr_duration:
+                yield from expr.iter_cycle(cycle)
+            elif nested_total > 0:
+                scale_factor = expr_duration / nested_total
+                for val, dur in expr.iter_cycle(cycle):
+                    yield val, dur * scale_factor
+
+    def _event_rates(self) -> Tuple[Fraction, int]:
+        if isinstance(self.value, str):
+            return Fraction(1), 1
+        # Every element plays every cycle
+        rates = [expr.event_rates() for expr in self.value]
+        return sum(mean for mean, _ in rates), sum(peak for _, peak in rates)
 
-        return unwrapped
+    def unwrap(self, limits: UnwrapLimits | None = None):
+        """Unwrap bracket expression into angle expression format"""
+        return self._unwrap_period(limits)
 
 
 class MultiplierExpression(Expression):
@@ -242,16 +534,17 @@ class MultiplierExpression(Expression):
         super().__init__()
         self.multiplier = 1
 
-    def _inner_value_repr(self, inner_value):
-        return f"{inner_value}*{self.multiplier}"
+    def _closing(self) -> str:
+        return f"*{self.multiplier}"
 
-    def get_cycle_length(self) -> int:
-        """Multiplier doesn't affect cycle length of the pattern"""
-        if isinstance(self.value, List) and len(self.value) == 1:
-            return self.value[0].get_cycle_length()
+    def _cycle_length(self, children: List[ExpressionMetrics]) -> int:
+        """The pattern advances `multiplier` of its own cycles per outer cycle"""
+        if len(children) == 1:
+            base_cycles = children[0].cycle_length
+            return base_cycles // math.gcd(base_cycles, self.multiplier)
         return 1
 
-    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, float]]:
+    def evaluate_at_position(self, cursor: 'ExpressionCursor') -> List[Tuple[str, Time]]:
         """Multiplier repeats the pattern n times within the same duration"""
         if isinstance(self.value, List) and len(self.value) == 1:
             base_expr = self.value[0]
@@ -268,41 +561,143 @@ class MultiplierExpression(Expression):
 
                 for val, dur in base_results:
                     # Each repetition is 1/multiplier of the original duration
-                    all_results.append((val, dur / self.multiplier))
+                    all_results.append((val, Fraction(dur, self.multiplier)))
 
             return all_results
 
         return []
 
-    def unwrap(self):
+    def _span(self, children: List[ExpressionMetrics]) -> Time | None:
+        # r repetitions of 1/r of the pattern take as long as the pattern
+        return children[0].span if len(children) == 1 else 0
+
+    def _varying_span(self, cycle: int) -> Time:
+        base_expr = self.value[0]
+        return Fraction(sum(base_expr.cycle_span(cycle * self.multiplier + rep) for rep in range(self.multiplier)),
+                        self.multiplier)
+
+    def iter_cycle(self, cycle: int) -> Iterator[Tuple[str, Time]]:
+        if not (isinstance(self.value, List) and len(self.value) == 1):
+            return
+        base_expr = self.value[0]
+        for rep in range(self.multiplier):
+            # The sub-pattern cycles faster, each repetition is 1/multiplier of the duration
+            for val, dur in base_expr.iter_cycle(cycle * self.multiplier + rep):
+                yield val, Fraction(dur, self.multiplier)
+
+    def _event_rates(self) -> Tuple[Fraction, int]:
+        if not (isinstance(self.value, List) and len(self.value) == 1):
+            return Fraction(0), 0
+        # A cycle plays `multiplier` consecutive cycles of the pattern
+        mean, peak = self.value[0].event_rates()
+        return mean * self.multiplier, peak * self.multiplier
+
+    def unwrap(self, limits: UnwrapLimits | None = None):
         """Unwrap multiplier expression by repeating the pattern"""
         if isinstance(self.value, List) and len(self.value) == 1:
-            base_expr = self.value[0]
-            cursor = ExpressionCursor()
-            results = []
+            return self._unwrap_period(limits)
+        return Expression()
 
-            # Calculate total cycles needed
-            base_cycles = base_expr.get_cycle_length()
 
-            # We need to go through all cycles to get the complete pattern
-            for cycle in range(base_cycles):
-                cursor.cycle = cycle
-                cycle_results = self.evaluate_at_position(cursor)
-                results.extend(cycle_results)
+class Node:
+    """Immutable, hash-consed expression node
+
+    Nodes are interned: building a node equal to a live one returns that same object, so identical
+    subtrees are shared, equality is identity and the structural hash is computed once, from the
+    already computed hashes of the children. Nodes can key dicts directly, which is what memoizing
+    anything per subtree needs. thaw() gives back an editable Expression tree."""
+    __slots__ = ('kind', 'value', 'length', 'multiplier', '_hash', '_expression', '__weakref__')
+
+    _table: 'weakref.WeakValueDictionary[Tuple, Node]' = weakref.WeakValueDictionary()
+
+    def __init__(self, *args):
+        raise TypeError('Nodes are interned, build them with Node.make() or Expression.freeze()')
+
+    @classmethod
+    def make(cls, kind: type = Expression, value: Union[Tuple['Node', ...], str] = "",
+             length: Union[Tuple['Node', ...], Time, int] = 1, multiplier: int = 1) -> 'Node':
+        """The node for this structure, shared with every equal node still alive"""
+        if isinstance(value, List):
+            value = tuple(value)
+        if isinstance(length, List):
+            length = tuple(length)
+        elif not isinstance(length, (tuple, int, Fraction)):
+            length = to_time(length)
+        if kind is not MultiplierExpression:
+            multiplier = 1
+
+        key = (kind, value, length, multiplier)
+        node = cls._table.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            node.kind = kind
+            node.value = value
+            node.length = length
+            node.multiplier = multiplier
+            node._hash = hash(key)
+            node._expression = None
+            cls._table[key] = node
+        return node
+
+    @classmethod
+    def leaf(cls, value: str, length=1) -> 'Node':
+        return cls.make(Expression, value, length)
+
+    def __hash__(self):
+        return self._hash
+
+    # Interning makes equal structures the same object, the default identity __eq__ is exact
+
+    def __setattr__(self, name, value):
+        if name != '_expression' and hasattr(self, '_hash'):
+            raise AttributeError('Node is immutable, thaw() it to edit')
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        # Unpickling goes through make() so the copy is interned too
+        return Node.make, (self.kind, self.value, self.length, self.multiplier)
+
+    def thaw(self) -> Expression:
+        """A fresh, editable Expression tree with this structure"""
+        expr = self.kind.__new__(self.kind)
+        Expression.__init__(expr)
+        expr.value = [node.thaw() for node in self.value] if isinstance(self.value, tuple) else self.value
+        expr.length = [node.thaw() for node in self.length] if isinstance(self.length, tuple) else self.length
+        if self.kind is MultiplierExpression:
+            expr.multiplier = self.multiplier
+        return expr
+
+    def expression(self) -> Expression:
+        """A read-only Expression for evaluating this node, built once and kept with it.
+
+        The tree reuses the expressions of child nodes, so shared subtrees keep their cached
+        metrics, and must not be edited: use thaw() for a tree to change."""
+        if self._expression is None:
+            expr = self.kind.__new__(self.kind)
+            expr.__dict__.update(
+                value=[node.expression() for node in self.value] if isinstance(self.value, tuple) else self.value,
+                length=[node.expression() for node in self.length] if isinstance(self.length, tuple) else self.length,
+                cycle_idx=0,
+            )
+            if self.kind is MultiplierExpression:
+                expr.__dict__['multiplier'] = self.multiplier
+            self._expression = expr
+        return self._expression
+
+    def metrics(self) -> ExpressionMetrics:
+        return self.expression().metrics()
 
-            # Create the unwrapped angle expression
-            unwrapped = AngleExpression()
-            unwrapped.value = []
+    def get_cycle_length(self) -> int:
+        return self.expression().get_cycle_length()
 
-            for val, dur in results:
-                elem = Expression()
-                elem.value = val
-                elem.length = dur
-                unwrapped.value.append(elem)
+    def iter_cycle(self, cycle: int) -> Iterator[Tuple[str, Time]]:
+        return self.expression().iter_cycle(cycle)
 
-            return unwrapped
+    def __str__(self):
+        return str(self.expression())
 
-        return Expression()
+    def __repr__(self):
+        return f'Node({self})'
 
 
 class ExpressionCursor:
@@ -0,0 +1,295 @@
+import io
+import mmap
+from collections import deque
+from fractions import Fraction
+from typing import BinaryIO, Deque, Dict, Iterable, Iterator, List, Tuple
+
+import mido
+from mido.midifiles.midifiles import (
+    MAX_MESSAGE_LENGTH,
+    read_byte,
+    read_chunk_header,
+    read_file_header,
+    read_message,
+    read_meta_message,
+    read_sysex,
+    read_variable_int,
+)
+
+import profiling
+from note import ActiveNoteIndex, IncompleteNote, Note
+from track import NoteTrack
+
+
+# Streaming MIDI ingestion
+#
+# mido.MidiFile decodes every track of a file into memory before handing anything back.
+# Everything here is a generator instead: track chunks are read one at a time straight from
+# the file object, messages are decoded lazily and notes are yielded as soon as their note_off
+# arrives, so peak memory is bounded by the number of held notes and not by the file size.
+
+def read_ticks_per_beat(infile: BinaryIO) -> int:
+    """Read the MThd chunk and return the ticks per beat of the file"""
+    _format, _track_count, ticks_per_beat = read_file_header(infile)
+    return ticks_per_beat
+
+
+def iter_track_chunks(infile: BinaryIO) -> Iterator[int]:
+    """Seek through the file and yield the size of every MTrk chunk, positioned at its data.
+
+    Whatever the consumer leaves unread of a chunk is skipped before the next one is located."""
+    while True:
+        try:
+            name, size = read_chunk_header(infile)
+        except EOFError:
+            return
+
+        start = infile.tell()
+        if name == b'MTrk':
+            yield size
+        # Unknown chunks are allowed by the spec and are skipped
+        infile.seek(start + size)
+
+
+def iter_chunk_messages(infile: BinaryIO, size: int) -> Iterator[mido.Message]:
+    """Decode the messages of one track chunk of `size` bytes, one at a time"""
+    start = infile.tell()
+    last_status = None
+
+    while infile.tell() - start < size:
+        delta = read_variable_int(infile)
+        status_byte = read_byte(infile)
+
+        if status_byte < 0x80:
+            if last_status is None:
+                raise OSError('running status without last_status')
+            peek_data = [status_byte]
+            status_byte = last_status
+        else:
+            if status_byte != 0xff:
+                # Meta messages don't set running status
+                last_status = status_byte
+            peek_data = []
+
+        if status_byte == 0xff:
+            yield read_meta_message(infile, delta)
+        elif status_byte in (0xf0, 0xf7):
+            yield read_sysex(infile, delta)
+        else:
+            yield read_message(infile, status_byte, peek_data, delta)
+
+
+def pair_notes(messages: Iterable[mido.Message]) -> Iterator[Note]:
+    """Pair note_on/note_off messages of one track and yield each note once it is complete.
+
+    Times stay in integer ticks, converting to beats is left to the consumer."""
+    absolute_time = 0
+    active_notes = ActiveNoteIndex()
+
+    # Silence is not represented here, quantize.fill_rests adds it to monophonic voices
+
+    for msg in messages:
+        # Increment the time
+        absolute_time += msg.time
+
+        # Check events, a note_on with velocity 0 is a note_off in disguise (running status)
+        if msg.type == 'note_on' and msg.velocity > 0:
+            active_notes.start(IncompleteNote(msg.note, absolute_time, msg.channel, velocity=msg.velocity))
+        elif msg.type == 'note_off' or msg.type == 'note_on':
+            note = active_notes.stop(msg.note, msg.channel, absolute_time)
+            if note is not None:
+                yield note
+
+
+def iter_tracks(path: str) -> Iterator[Tuple[int, Iterator[Note]]]:
+    """Stream a MIDI file as (ticks per beat, note generator in ticks) per track.
+
+    Each generator reads from the shared file object, so it has to be consumed before the next
+    track is requested; whatever is left of it is skipped."""
+    with open(path, 'rb') as infile:
+        ticks_per_beat = read_ticks_per_beat(infile)
+
+        for size in iter_track_chunks(infile):
+            if profiling.enabled:
+                # Decoded up front so decoding and pairing are timed apart
+                with profiling.stage('ingest.parse'):
+                    messages = list(iter_chunk_messages(infile, size))
+                profiling.count('ingest.events', len(messages))
+                yield ticks_per_beat, pair_notes(messages)
+            else:
+                yield ticks_per_beat, pair_notes(iter_chunk_messages(infile, size))
+
+
+def iter_track_notes(path: str) -> Iterator[Tuple[int, Note]]:
+    """Stream (track index, note) pairs of a MIDI file in the order the notes complete, times in beats"""
+    for track_idx, (ticks_per_beat, notes) in enumerate(iter_tracks(path)):
+        for note in notes:
+            yield track_idx, Note(note.note, Fraction(note.length, ticks_per_beat), note.channel,
+                                  Fraction(note.start, ticks_per_beat), note.velocity)
+
+
+def _note_track(ticks_per_beat: int, notes: Iterable[Note]) -> NoteTrack:
+    track = NoteTrack(resolution=ticks_per_beat)
+    with profiling.stage('ingest.pair'):
+        for note in notes:
+            track.add_ticks(note.note, note.start, note.length, note.channel, note.velocity)
+    profiling.count('ingest.notes', len(track))
+    return track
+
+
+def iter_note_tracks(path: str, fast: bool = True) -> Iterator[NoteTrack]:
+    """Stream one NoteTrack per MIDI track, each yielded as soon as its chunk is parsed.
+
+    Lets a consumer start compressing the first track before the rest of the file is read. The
+    fast reader is used unless `fast` is off, mido only for what the fast reader can't take."""
+    if fast:
+        yield from _fast_note_tracks(path)
+        return
+    for ticks_per_beat, notes in iter_tracks(path):
+        yield _note_track(ticks_per_beat, notes)
+
+
+# Fast reader
+#
+# Only note events, delta times and the ticks per beat make it into a NoteTrack, yet mido builds
+# a Message object for every event and decodes every meta message. The reader below maps the
+# file into memory and decodes each track chunk in one pass, variable-length deltas and running
+# status included, pairing notes as it goes and appending them straight to the track's columns.
+# Meta and sysex events are skipped without being decoded, so a malformed meta message that mido
+# would reject is ignored. Anything else it does not expect (running status with no status yet,
+# system common messages, data bytes out of range, a chunk running past the end of the file)
+# hands that chunk to the mido path above, which reads it exactly as before, errors included.
+# Files with an unusual header (SMPTE timing) are read by mido entirely.
+
+class _Unusual(Exception):
+    """Raised for anything the fast reader leaves to mido"""
+
+
+def _fast_note_tracks(path: str) -> Iterator[NoteTrack]:
+    with open(path, 'rb') as infile:
+        try:
+            data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file, which mido reports
+            data = None
+        if data is None:
+            yield from iter_note_tracks(path, fast=False)
+            return
+
+        with data:
+            ticks_per_beat = int.from_bytes(data[12:14], 'big', signed=True)
+            if data[:4] != b'MThd' or int.from_bytes(data[4:8], 'big') < 6 or ticks_per_beat <= 0:
+                yield from iter_note_tracks(path, fast=False)
+                return
+
+            pos = 8 + int.from_bytes(data[4:8], 'big')
+            while pos + 8 <= len(data):
+                size = int.from_bytes(data[pos + 4:pos + 8], 'big')
+                start = pos + 8
+                if data[pos:pos + 4] == b'MTrk':
+                    track = NoteTrack(resolution=ticks_per_beat)
+                    try:
+                        with profiling.stage('ingest.read'):
+                            events = _read_chunk(data, start, start + size, track)
+                    except (_Unusual, IndexError):
+                        # mido reads what is left of the file the way it always did
+                        rest = io.BytesIO(data[start:])
+                        track = _note_track(ticks_per_beat, pair_notes(iter_chunk_messages(rest, size)))
+                    else:
+                        profiling.count('ingest.events', events)
+                        profiling.count('ingest.notes', len(track))
+                    yield track
+                pos = start + size
+
+
+def _read_chunk(data, pos: int, end: int, track: NoteTrack) -> int:
+    """Decode the notes of the chunk data[pos:end] into `track`, returns the number of events"""
+    add_pitch, add_start, add_length = track.pitch.append, track.start.append, track.length.append
+    add_channel, add_velocity = track.channel.append, track.velocity.append
+    # FIFO of (start, velocity) of the held notes per channel << 7 | pitch, as ActiveNoteIndex
+    held: Dict[int, Deque[Tuple[int, int]]] = {}
+    time = 0
+    status = 0
+    events = 0
+
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        delta = byte & 0x7f
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            delta = delta << 7 | byte & 0x7f
+        time += delta
+        events += 1
+
+        byte = data[pos]
+        if byte & 0x80:
+            pos += 1
+            if byte >= 0xf0:
+                sysex = byte != 0xff
+                if not sysex:
+                    # Meta event: type, length, data. It leaves running status alone
+                    pos += 1
+                elif byte != 0xf0 and byte != 0xf7:
+                    raise _Unusual
+                else:
+                    # mido would take the sysex as the status for running status
+                    status = 0
+                length = 0
+                while True:
+                    byte = data[pos]
+                    pos += 1
+                    length = length << 7 | byte & 0x7f
+                    if not byte & 0x80:
+                        break
+                if length > MAX_MESSAGE_LENGTH or pos + length > len(data):
+                    raise _Unusual
+                if sysex and length:
+                    payload = data[pos:pos + length]
+                    if payload[0] == 0xf0:
+                        payload = payload[1:]
+                    if payload and payload[-1] == 0xf7:
+                        payload = payload[:-1]
+                    if payload and max(payload) > 127:
+                        raise _Unusual
+                pos += length
+                continue
+            status = byte
+        elif not status:
+            raise _Unusual
+
+        kind = status & 0xf0
+        if kind == 0xc0 or kind == 0xd0:
+            if data[pos] & 0x80:
+                raise _Unusual
+            pos += 1
+            continue
+        note = data[pos]
+        velocity = data[pos + 1]
+        pos += 2
+        if (note | velocity) & 0x80:
+            raise _Unusual
+
+        if kind == 0x90 and velocity:
+            key = (status & 0x0f) << 7 | note
+            queue = held.get(key)
+            if queue is None:
+                queue = held[key] = deque()
+            queue.append((time, velocity))
+        elif kind == 0x80 or kind == 0x90:
+            # A note_on with velocity 0 is a note_off
+            queue = held.get((status & 0x0f) << 7 | note)
+            if queue:
+                start, note_velocity = queue.popleft()
+                add_pitch(note)
+                add_start(start)
+                add_length(time - start)
+                add_channel(status & 0x0f)
+                add_velocity(note_velocity)
+    return events
+
+
+def read_note_tracks(path: str, fast: bool = True) -> List[NoteTrack]:
+    """Read every track of a MIDI file into a NoteTrack"""
+    return list(iter_note_tracks(path, fast))
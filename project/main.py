@@ -1,44 +1,71 @@
-from typing import List
+import argparse
+import sys
 
-import mido
-from note import IncompleteNote, Note
-from track import NoteTrack
+import profiling
+from batch import convert_files
+from cache import PatternCache
+from compressor import CompressorSettings
+from motifs import convert_shared
+from service import serve
 
-mid = mido.MidiFile('test.mid')
 
-# Adjusted by the ticks multiplier
-absolute_time = 0
+def main():
+    parser = argparse.ArgumentParser(description='Convert MIDI files into Strudel patterns, one per track')
+    parser.add_argument('paths', nargs='*', default=['test.mid'], help='MIDI files to convert')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes, all cores by default, 1 converts in this process')
+    parser.add_argument('--no-split', action='store_true',
+                        help='compress every track as one sequence instead of splitting chords into voices')
+    parser.add_argument('--grid', type=int, default=None,
+                        help='snap notes to this many steps per beat, for played rather than sequenced MIDI')
+    parser.add_argument('--time-budget', type=float, default=None, metavar='SECONDS',
+                        help='search each voice for at most this long and keep the shortest pattern found')
+    parser.add_argument('--max-candidates', type=int, default=None, metavar='N',
+                        help='like --time-budget, but stop after weighing N candidate items: same output on any machine')
+    parser.add_argument('--shared-motifs', action='store_true',
+                        help='write riffs repeated across tracks and files once, as variables (prints Strudel code)')
+    parser.add_argument('--min-motif', type=int, default=16, help='fewest notes a shared motif has')
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help='run as a local service on this socket path, or localhost port, answering JSON requests')
+    parser.add_argument('--cache', help='file caching the patterns of tracks converted before')
+    parser.add_argument('--cache-size', type=int, default=256, help='cache size limit in MB')
+    parser.add_argument('--profile', metavar='TRACE_JSON',
+                        help='time the pipeline stages and write a trace viewable in chrome://tracing or Perfetto')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, trace Python allocations for an exact peak (slow)')
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable(memory=args.profile_memory)
+    cache = PatternCache(args.cache, args.cache_size * 1024 * 1024) if args.cache else None
+    settings = None
+    if args.time_budget is not None or args.max_candidates is not None:
+        settings = CompressorSettings(time_budget=args.time_budget, max_candidates=args.max_candidates)
 
-ticks_multiplier = 1.0 / mid.ticks_per_beat
+    if args.serve:
+        serve(args.serve, args.jobs, settings, cache)
+    elif args.shared_motifs:
+        print(convert_shared(args.paths, args.jobs, settings, cache, split=not args.no_split, grid=args.grid,
+                             min_notes=args.min_motif).script())
+    else:
+        convert(args, settings, cache)
 
-tracks: List[NoteTrack] = []
+    if args.profile:
+        profiling.export(args.profile)
+        print(profiling.format_summary(), file=sys.stderr)
 
-for track in mid.tracks:
-    active_notes = []
-    complete_notes = []
 
-    # TODO: Implement space in music by when there are no complete notes, represent emptyness with a note value of -1 and said duration
-
-    for msg in track:
-        # Increment the time
-        if msg.type == "track_name":
-            absolute_time = msg.time * ticks_multiplier
-        elif msg.type == "end_of_track":
-            absolute_time = 0
+def convert(args, settings: CompressorSettings | None, cache: PatternCache | None):
+    # Tracks of every file are compressed in parallel, results still come out in file and track order
+    for result in convert_files(args.paths, args.jobs, settings, cache, split=not args.no_split,
+                                grid=args.grid):
+        if len(args.paths) > 1 and result.track_index == 0:
+            print(f'# {result.path}')
+        if result.ok:
+            print(result.pattern)
         else:
-            absolute_time += msg.time * ticks_multiplier
-
-        # Check events
-        if msg.type == 'note_on':
-            active_notes.append(IncompleteNote(msg.note, absolute_time, msg.channel))
-        elif msg.type == 'note_off':
-            # Find the target note
-            for incomplete_note in active_notes:
-                if incomplete_note.channel == msg.channel:
-                    if incomplete_note.note == msg.note:
-                        incomplete_note.end = absolute_time
-                        complete_notes.append(incomplete_note.generate_complete_note())
-                        active_notes.remove(incomplete_note)
-
-    tracks.append(NoteTrack(complete_notes))
-    print([note.__str__() for note in complete_notes])
\ No newline at end of file
+            print(f'# track {result.track_index} failed: {result.error}')
+
+
+# Worker processes import this module too, only the parent converts
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+import bisect
+import heapq
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from typing import Dict, Iterable, List, Tuple
+
+import profiling
+from batch import convert_packed, track_voices
+from cache import PatternCache, pattern_key, storable
+from compressor import CompressorSettings
+from ingest import iter_note_tracks
+from repeats import RepeatIndex
+from timing import Time, decimal_step, format_time
+from track import NoteTrack
+
+
+# Motifs shared across tracks
+#
+# Arrangements repeat the same riffs in several tracks and sections, and converting track by
+# track compresses every copy again and writes it out again. Here all voices of all files go
+# into one RepeatIndex first, separated by tokens that occur nowhere else so no repeat spans two
+# voices. Its maximal repeats of at least min_notes notes are taken as motifs, longest coverage
+# first, each keeping the occurrences that don't overlap a motif taken before.
+#
+# A motif is compressed once and written once, as a Strudel variable. Each voice becomes the
+# sections between its motifs, compressed as usual, and references to the motifs, strung
+# together with arrange(): every section plays for its duration in cycles, one cycle per beat
+# as in every pattern here. Back to back occurrences become one section playing the motif for
+# as many periods. Only occurrences starting and ending at times with a decimal are used, so
+# every duration is written exactly.
+#
+# A tandem run, one unit played back to back (a hi-hat, an ostinato), holds a maximal repeat of
+# nearly every length, each occurring nearly everywhere in the run, which makes the search
+# quadratic in the run. Runs are collapsed before indexing into the unit and one token for the
+# rest of the run; a motif that is exactly such a unit still takes the copies that follow it.
+# Only the MAX_CANDIDATES repeats covering the most notes are weighed.
+
+# Longest unit, in tokens, that tandem runs are collapsed for
+MAX_TANDEM_PERIOD = 16
+# Repeats weighed as motifs
+MAX_CANDIDATES = 4096
+
+class Motif:
+    """A run of notes occurring in more than one place, written once as a named pattern"""
+
+    def __init__(self, name: str, notes: int, occurrences: List[Tuple[int, int]]):
+        self.name = name
+        self.notes = notes
+        # (voice, first note) of every place it is used, in order
+        self.occurrences = occurrences
+        self.duration: Time = 0
+        self.pattern: str | None = None
+
+
+class Section:
+    """What one voice plays for `duration` cycles: a motif, or notes of its own"""
+    __slots__ = ('duration', 'motif', 'pattern')
+
+    def __init__(self, duration: Time, motif: Motif | None = None, pattern: str | None = None):
+        self.duration = duration
+        self.motif = motif
+        self.pattern = pattern
+
+    def reference(self) -> str:
+        return self.motif.name if self.motif is not None else json.dumps(self.pattern)
+
+
+class SharedConversion:
+    """Patterns of every track of some files, with the motifs they share defined once"""
+
+    def __init__(self, motifs: List[Motif], tracks: List[Tuple[str, int, List[List[Section]]]]):
+        self.motifs = motifs
+        # (path, track index, sections of every voice)
+        self.tracks = tracks
+
+    @staticmethod
+    def voice_code(sections: List[Section]) -> str:
+        if len(sections) == 1:
+            return sections[0].reference()
+        return 'arrange(%s)' % ', '.join(f'[{format_time(section.duration)}, {section.reference()}]'
+                                         for section in sections)
+
+    def track_code(self, voices: List[List[Section]]) -> str:
+        """Strudel code playing one track"""
+        if len(voices) == 1:
+            return self.voice_code(voices[0])
+        return 'stack(%s)' % ', '.join(self.voice_code(sections) for sections in voices)
+
+    def script(self) -> str:
+        """Strudel code defining the motifs, then one line per track"""
+        lines = [f'const {motif.name} = {json.dumps(motif.pattern)}' for motif in self.motifs]
+        paths = {path for path, _, _ in self.tracks}
+        for path, track_index, voices in self.tracks:
+            if len(paths) > 1 and track_index == 0:
+                lines.append(f'// {path}')
+            lines.append(self.track_code(voices))
+        return '\n'.join(lines)
+
+
+def _collapse_runs(tokens: List, periods: range) -> Tuple[List, List[int]]:
+    """tokens with every tandem run of k >= 2 copies of a unit of `periods` tokens written as the
+    unit and ('*', unit, k), and where in tokens each of those starts, len(tokens) last"""
+    collapsed = []
+    origin = []
+    n = len(tokens)
+    i = 0
+    while i < n:
+        best_period = best_copies = 1
+        for period in periods:
+            if i + 2 * period > n:
+                break
+            extent = 0
+            while i + extent + period < n and tokens[i + extent] == tokens[i + extent + period]:
+                extent += 1
+            copies = (extent + period) // period
+            if copies >= 2 and period * copies > best_period * best_copies:
+                best_period, best_copies = period, copies
+        if best_copies == 1:
+            collapsed.append(tokens[i])
+            origin.append(i)
+            i += 1
+            continue
+        unit = tuple(tokens[i:i + best_period])
+        collapsed.extend(unit)
+        origin.extend(range(i, i + best_period))
+        collapsed.append(('*', unit, best_copies))
+        origin.append(i + best_period)
+        i += best_period * best_copies
+    origin.append(n)
+    return collapsed, origin
+
+
+def find_motifs(voices: List[NoteTrack], min_notes: int = 16) -> List[Motif]:
+    """Runs of at least min_notes notes that occur more than once across all voices"""
+    # Lengths compared on one grid, so equal durations are equal ticks whatever the file
+    grid = math.lcm(1, *(voice.resolution for voice in voices))
+    step = decimal_step(grid)
+    tokens: List = []
+    starts = []
+    # Whether the time a token starts at has a decimal, sections can only be cut there
+    decimal = bytearray()
+    for idx, voice in enumerate(voices):
+        starts.append(len(tokens))
+        scale = grid // voice.resolution
+        time = 0
+        for pitch, length in zip(voice.pitch, voice.length):
+            tokens.append((pitch, length * scale))
+            decimal.append(time % step == 0)
+            time += length * scale
+        tokens.append(('|', idx))
+        decimal.append(time % step == 0)
+
+    # Repeated notes first, so the units of longer runs are written the way the same notes are
+    # written outside a run
+    notes_collapsed, note_origin = _collapse_runs(tokens, range(1, 2))
+    collapsed, origin = _collapse_runs(notes_collapsed, range(2, MAX_TANDEM_PERIOD + 1))
+    origin = [note_origin[pos] for pos in origin]
+
+    def notes(repeat) -> int:
+        first = repeat.first
+        return origin[first + repeat.length] - origin[first]
+
+    # A collapsed token stands for one note or more, so the note count is checked apart
+    repeats = heapq.nlargest(MAX_CANDIDATES, (repeat for repeat in RepeatIndex(collapsed).maximal_repeats(2)
+                                              if notes(repeat) >= min_notes),
+                             key=lambda repeat: notes(repeat) * repeat.count)
+    # Notes taken by motifs so far, as sorted disjoint intervals
+    claimed_starts: List[int] = []
+    claimed_ends: List[int] = []
+
+    def free(start: int, end: int) -> bool:
+        idx = bisect.bisect_right(claimed_starts, start)
+        return (idx == 0 or claimed_ends[idx - 1] <= start) and (idx == len(claimed_starts)
+                                                                 or claimed_starts[idx] >= end)
+
+    motifs = []
+    for repeat in repeats:
+        length = repeat.length
+        size = notes(repeat)
+        taken = []
+        end = 0
+        for pos in repeat.positions:
+            candidates = [origin[pos]]
+            follower = collapsed[pos + length]
+            if follower[0] == '*' and len(follower[1]) == length and follower[1] == tuple(collapsed[pos:pos + length]):
+                # The motif is the unit of a run, the copies after it are occurrences too
+                candidates.extend(origin[pos] + size * copy for copy in range(1, follower[2]))
+            for start in candidates:
+                if start >= end and decimal[start] and decimal[start + size] and free(start, start + size):
+                    taken.append(start)
+                    end = start + size
+        if len(taken) < 2:
+            continue
+        occurrences = []
+        for pos in taken:
+            idx = bisect.bisect_left(claimed_starts, pos)
+            claimed_starts.insert(idx, pos)
+            claimed_ends.insert(idx, pos + size)
+            voice = bisect.bisect_right(starts, pos) - 1
+            occurrences.append((voice, pos - starts[voice]))
+        motifs.append(Motif(f'motif{len(motifs)}', size, occurrences))
+    return motifs
+
+
+def _duration(voice: NoteTrack, start: int, end: int) -> Time:
+    return Fraction(sum(voice.length[start:end]), voice.resolution)
+
+
+def _payload(voice: NoteTrack, start: int, end: int) -> Tuple[bytes, bytes, int]:
+    return voice.pitch[start:end].tobytes(), voice.length[start:end].tobytes(), voice.resolution
+
+
+def _compress(pieces: List[Tuple[NoteTrack, int, int]], jobs: int, settings: CompressorSettings | None,
+              cache: PatternCache | None) -> List[str]:
+    """Patterns of the note ranges in pieces, those found in the cache not compressed again"""
+    keys = [pattern_key(voice.pitch[start:end], voice.length[start:end], voice.resolution, settings)
+            if cache is not None else None for voice, start, end in pieces]
+    patterns = [cache.get(key) if cache is not None else None for key in keys]
+    missing = [idx for idx, pattern in enumerate(patterns) if pattern is None]
+    payloads = [_payload(*pieces[idx]) for idx in missing]
+    if jobs == 1 or len(payloads) < 2:
+        compressed = [convert_packed(*payload, settings) for payload in payloads]
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            compressed = list(executor.map(convert_packed, *zip(*payloads), [settings] * len(payloads)))
+
+    for idx, pattern in zip(missing, compressed):
+        patterns[idx] = pattern
+        if cache is not None and storable(settings):
+            cache.put(keys[idx], pattern)
+    return patterns
+
+
+def convert_shared(paths: Iterable[str], jobs: int | None = None, settings: CompressorSettings | None = None,
+                   cache: PatternCache | None = None, split: bool = True, grid: int | None = None,
+                   min_notes: int = 16) -> SharedConversion:
+    """Convert every track of every file, motifs shared between them written once.
+
+    Unlike convert_files() this reads everything before compressing anything, since a motif
+    can only be told apart once all its occurrences are seen. Motifs and the stretches between
+    them found in the cache are not compressed again."""
+    voices: List[NoteTrack] = []
+    tracks: List[Tuple[str, int, List[int]]] = []
+    for path in paths:
+        for track_index, track in enumerate(iter_note_tracks(path)):
+            split_track = track_voices(track, split, grid)
+            tracks.append((path, track_index, list(range(len(voices), len(voices) + len(split_track)))))
+            voices.extend(split_track)
+
+    with profiling.stage('motifs'):
+        motifs = find_motifs(voices, min_notes)
+
+    # Every motif is compressed from its first occurrence, every voice in the stretches between
+    pieces = []
+    for motif in motifs:
+        voice, start = motif.occurrences[0]
+        motif.duration = _duration(voices[voice], start, start + motif.notes)
+        pieces.append((voices[voice], start, start + motif.notes))
+
+    used: Dict[int, List[Tuple[int, Motif]]] = {}
+    for motif in motifs:
+        for voice, start in motif.occurrences:
+            used.setdefault(voice, []).append((start, motif))
+
+    plans: List[List[Tuple]] = []
+    for idx, voice in enumerate(voices):
+        plan = []
+        position = 0
+        for start, motif in sorted(used.get(idx, []), key=lambda use: use[0]):
+            if start > position:
+                plan.append((position, start, len(pieces)))
+                pieces.append((voice, position, start))
+            if plan and plan[-1][2] is motif and plan[-1][1] == start:
+                # Right after another occurrence, one section plays both
+                plan[-1] = (plan[-1][0], start + motif.notes, motif)
+            else:
+                plan.append((start, start + motif.notes, motif))
+            position = start + motif.notes
+        if position < len(voice) or not plan:
+            plan.append((position, len(voice), len(pieces)))
+            pieces.append((voice, position, len(voice)))
+        plans.append(plan)
+
+    patterns = _compress(pieces, jobs or os.cpu_count() or 1, settings, cache)
+
+    for motif, pattern in zip(motifs, patterns):
+        motif.pattern = pattern
+
+    def sections(idx: int) -> List[Section]:
+        voice = voices[idx]
+        return [Section(_duration(voice, start, end), job, None) if isinstance(job, Motif)
+                else Section(_duration(voice, start, end), None, patterns[job])
+                for start, end, job in plans[idx]]
+
+    return SharedConversion(motifs, [(path, track_index, [sections(idx) for idx in voice_indices])
+                                     for path, track_index, voice_indices in tracks])
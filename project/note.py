@@ -1,23 +1,77 @@
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+from timing import Time, format_time
+
+# Pitch of a rest, silence between the notes of a voice
+REST = -1
+
+
+def pitch_token(pitch: int) -> str:
+    """How a pitch is written in a pattern, rests are ~"""
+    return '~' if pitch == REST else str(pitch)
+
+
 class Note:
-    def __init__(self, note: int, length: float, channel: int):
+    __slots__ = ('note', 'length', 'channel', 'start', 'velocity')
+
+    def __init__(self, note: int, length: Time, channel: int, start: Time = 0, velocity: int = 64):
         self.note: int = note
-        self.length: float = length
+        self.length: Time = length
         self.channel: int = channel
+        self.start: Time = start
+        self.velocity: int = velocity
 
     def __str__(self) -> str:
-        return f'Note: {self.note}, {self.length}'
+        return f'Note: {self.note}, {format_time(self.length)}'
 
 class IncompleteNote:
-    def __init__(self, note: int, start: float, channel: int, end=None):
+    __slots__ = ('note', 'start', 'channel', 'end', 'velocity')
+
+    def __init__(self, note: int, start: Time, channel: int, end=None, velocity: int = 64):
         self.note: int = note
-        self.start: float = start
+        self.start: Time = start
         self.channel: int = channel
-        self.end: float | None = end
+        self.end: Time | None = end
+        self.velocity: int = velocity
 
     def generate_complete_note(self):
         if self.end == None:
             raise Exception("Incomplete note tried to generate")
-        return Note(self.note, self.end - self.start, self.channel)
+        return Note(self.note, self.end - self.start, self.channel, self.start, self.velocity)
 
     def __str__(self) -> str:
         return f'IncompleteNote: {self.note}, {self.start}, {self.end}'
+
+
+class ActiveNoteIndex:
+    """Held notes keyed by (channel, note), so a note_off finds its note_on in O(1).
+
+    Each key holds a FIFO of notes, so overlapping retriggers of the same pitch are closed in the
+    order they were started."""
+
+    def __init__(self):
+        self.held: Dict[Tuple[int, int], Deque[IncompleteNote]] = {}
+
+    def start(self, note: IncompleteNote):
+        key = (note.channel, note.note)
+        queue = self.held.get(key)
+        if queue is None:
+            queue = self.held[key] = deque()
+        queue.append(note)
+
+    def stop(self, note: int, channel: int, end: Time) -> 'Note | None':
+        """Close the oldest held note of this pitch and channel, None if nothing is held"""
+        key = (channel, note)
+        queue = self.held.get(key)
+        if not queue:
+            return None
+
+        incomplete_note = queue.popleft()
+        if not queue:
+            del self.held[key]
+        incomplete_note.end = end
+        return incomplete_note.generate_complete_note()
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.held.values())
@@ -1,137 +1,200 @@
-from expression import MultiplierExpression, AngleExpression, Expression, BracketExpression
-
-# Shitty parser that can only parse basic things
-# TODO:
-class BasicParser:
-    """Parse Strudel pattern strings into Expression objects."""
-
-    def __init__(self, text):
-        self.text = text
-        self.pos = 0
-
-    def peek(self):
-        """Look at current character without consuming it."""
-        if self.pos >= len(self.text):
-            return None
-        return self.text[self.pos]
-
-    def consume(self):
-        """Consume and return current character."""
-        if self.pos >= len(self.text):
-            return None
-        char = self.text[self.pos]
-        self.pos += 1
-        return char
-
-    def skip_whitespace(self):
-        """Skip whitespace characters."""
-        while self.peek() and self.peek() in ' \t\n':
-            self.consume()
-
-    def parse_number(self):
-        """Parse a number (integer or float)."""
-        num_str = ""
-        while self.peek() and (self.peek().isdigit() or self.peek() == '.'):
-            num_str += self.consume()
-
-        if '.' in num_str:
-            return float(num_str)
-        return int(num_str)
-
-    def parse_value(self):
-        """Parse a simple value (number, letter, word)."""
-        value_str = ""
-        while self.peek() and self.peek() not in ' \t\n[]<>*@':
-            value_str += self.consume()
-
-        expr = Expression()
-        expr.value = value_str
-        return expr
-
-    def parse_duration_modifier(self, expr):
-        """Parse @n duration modifier and apply it to expression."""
-        if self.peek() == '@':
-            self.consume()  # consume '@'
-            self.skip_whitespace()
-            duration = self.parse_number()
-            expr.length = duration
-        return expr
-
-    def parse_element(self):
-        """Parse a single element (value, bracket, or angle)."""
-        self.skip_whitespace()
+import gc
+import re
+from fractions import Fraction
+from typing import Dict, List, Tuple
 
-        if self.peek() == '[':
-            return self.parse_bracket()
-        elif self.peek() == '<':
-            return self.parse_angle()
-        else:
-            expr = self.parse_value()
-            return self.parse_duration_modifier(expr)
-
-    def parse_elements(self, end_char):
-        """Parse multiple elements until we hit end_char."""
-        elements = []
-        self.skip_whitespace()
-
-        while self.peek() and self.peek() != end_char:
-            elements.append(self.parse_element())
-            self.skip_whitespace()
-
-        return elements
-
-    def parse_bracket(self):
-        """Parse [...]."""
-        self.consume()  # consume '['
-        elements = self.parse_elements(']')
-        self.consume()  # consume ']'
+import profiling
+from expression import MultiplierExpression, AngleExpression, Expression, BracketExpression
 
-        bracket = BracketExpression()
-        bracket.value = elements if elements else ""
+# Mini-notation parser
+#
+# The text is split into tokens by a single regex, then an explicit stack of open brackets builds
+# the tree, so parsing is linear in the length of the text and nesting depth is not limited by
+# Python's recursion limit. Supported syntax:
+#   value                 a word, anything up to whitespace or one of []<>@*
+#   [a b ...]             sequence played within one cycle
+#   <a b ...>             alternation, one element per cycle
+#   element@n             length (weight) of an element, n an integer or exact decimal
+#   element*n             element repeated n times in its slot
+# Several top level elements are read as a sequence, as if wrapped in [...].
 
-        # Check for duration modifier
-        self.parse_duration_modifier(bracket)
+# Group 1 is a punctuation character, group 2 a word; only whitespace is left unmatched.
+# Token positions are only needed for error messages and are worked out then.
+TOKEN = re.compile(r'([\[\]<>@*])|([^\s\[\]<>@*]+)')
+NUMBER = re.compile(r'\d+\.?\d*|\.\d+')
 
-        # Check for multiplier
-        self.skip_whitespace()
-        if self.peek() == '*':
-            return self.parse_multiplier(bracket)
+OPENERS = {'[': (BracketExpression, ']'), '<': (AngleExpression, '>')}
+MODIFIERS = frozenset('@*')
 
-        return bracket
 
-    def parse_angle(self):
-        """Parse <...>."""
-        self.consume()  # consume '<'
-        elements = self.parse_elements('>')
-        self.consume()  # consume '>'
+class ParseError(ValueError):
+    """Malformed pattern text, with the offset of the offending character"""
 
-        angle = AngleExpression()
-        angle.value = elements if elements else ""
+    def __init__(self, message: str, position: int):
+        super().__init__(f'{message} at position {position}')
+        self.message = message
+        self.position = position
 
-        # Check for duration modifier
-        self.parse_duration_modifier(angle)
 
-        return angle
+class _Frame:
+    """A bracket that is still open"""
+    __slots__ = ('cls', 'close', 'token', 'elements')
 
-    def parse_multiplier(self, pattern):
-        """Parse *n multiplier."""
-        self.consume()  # consume '*'
-        multiplier_value = self.parse_number()
-        #print('mult', pattern)
+    def __init__(self, cls, close, token):
+        self.cls = cls
+        self.close = close
+        # Index of the opening token
+        self.token = token
+        self.elements: List[Expression] = []
 
-        mult = MultiplierExpression()
-        mult.value = [pattern]
-        mult.multiplier = multiplier_value
 
-        return mult
+class BasicParser:
+    """Parse Strudel pattern strings into Expression objects."""
 
-    def parse(self):
-        """Parse the entire expression."""
-        self.skip_whitespace()
-        return self.parse_element()
+    def __init__(self, text):
+        self.text = text
+        self.errors: List[ParseError] = []
+        self._recover = False
+        self._positions: List[int] | None = None
+        # Generated patterns reuse a handful of lengths, each is converted once
+        self._numbers: Dict[str, int | Fraction] = {}
+
+    def tokenize(self) -> List[Tuple[str, str]]:
+        """(punctuation, word) of every token, one of the two is empty"""
+        return TOKEN.findall(self.text)
+
+    def position(self, i: int) -> int:
+        """Offset of token i in the text, only worked out once something needs reporting"""
+        if self._positions is None:
+            self._positions = [match.start() for match in TOKEN.finditer(self.text)]
+        return self._positions[i] if i < len(self._positions) else len(self.text)
+
+    def error(self, message: str, position: int):
+        """Raise, or when recovering record the error and let the caller skip past it"""
+        error = ParseError(message, position)
+        if not self._recover:
+            raise error
+        self.errors.append(error)
+
+    def parse_number(self, tokens, i: int, operator: str):
+        """Read the number after the @ or * at tokens[i], returns (number or None, next index)"""
+        word = tokens[i + 1][1] if i + 1 < len(tokens) else ''
+        number = self._numbers.get(word)
+        if number is not None:
+            return number, i + 2
+
+        if not word:
+            self.error(f"expected a number after '{operator}'", self.position(i) + 1)
+            return None, i + 1
+        if not NUMBER.fullmatch(word):
+            self.error(f"expected a number after '{operator}', got {word!r}", self.position(i + 1))
+            # The word is more likely a value than a mistyped number, keep it
+            return None, i + 1
+        # Decimals are read exactly, 0.1 stays one tenth
+        number = self._numbers[word] = Fraction(word) if '.' in word else int(word)
+        return number, i + 2
+
+    def parse_modifiers(self, expr: Expression, tokens, i: int) -> Tuple[Expression, int]:
+        """Apply the @n and *n suffixes following an element, returns (element, next index)"""
+        has_length = False
+        while i < len(tokens) and tokens[i][0] in MODIFIERS:
+            operator = tokens[i][0]
+            start = i
+            number, i = self.parse_number(tokens, i, operator)
+            if number is None:
+                continue
+
+            if operator == '@':
+                if has_length:
+                    self.error("element already has a length", self.position(start))
+                    continue
+                expr.length = number
+                has_length = True
+            else:
+                if not isinstance(number, int) or number < 1:
+                    self.error("multiplier must be a positive whole number", self.position(start + 1))
+                    continue
+                mult = MultiplierExpression()
+                mult.value = [expr]
+                mult.multiplier = number
+                # A following @ is the length of the repetition as a whole
+                expr = mult
+                has_length = False
+        return expr, i
+
+    def parse(self, recover: bool = False) -> Expression:
+        """Parse the entire expression.
+
+        Raises ParseError on the first mistake, unless recover is set: then every error is kept
+        in self.errors, the offending token is skipped, brackets left open are closed at the end
+        and whatever could be read is returned."""
+        self._recover = recover
+        self.errors = []
+        # The tree is acyclic, collecting while it grows only rescans it over and over
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._parse(self.tokenize())
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _parse(self, tokens) -> Expression:
+        token_count = len(tokens)
+        root = _Frame(BracketExpression, None, 0)
+        stack = [root]
+        leaf = Expression.leaf
+
+        i = 0
+        while i < token_count:
+            punctuation, word = tokens[i]
+            i += 1
+
+            if word:
+                expr = leaf(word)
+            elif punctuation in OPENERS:
+                cls, close = OPENERS[punctuation]
+                stack.append(_Frame(cls, close, i - 1))
+                continue
+            elif punctuation in MODIFIERS:
+                self.error(f"'{punctuation}' must follow an element", self.position(i - 1))
+                continue
+            else:
+                frame = stack[-1]
+                if frame.close != punctuation:
+                    if frame is root:
+                        self.error(f"unexpected '{punctuation}'", self.position(i - 1))
+                    else:
+                        self.error(f"expected '{frame.close}' to close the one at {self.position(frame.token)}, "
+                                   f"got '{punctuation}'", self.position(i - 1))
+                    continue
+                stack.pop()
+                expr = self._close(frame)
+
+            if i < token_count and tokens[i][0] in MODIFIERS:
+                expr, i = self.parse_modifiers(expr, tokens, i)
+            stack[-1].elements.append(expr)
+
+        while len(stack) > 1:
+            frame = stack.pop()
+            self.error(f"'{frame.close}' missing for the bracket opened", self.position(frame.token))
+            stack[-1].elements.append(self._close(frame))
+
+        if len(root.elements) == 1:
+            return root.elements[0]
+        if not root.elements:
+            return Expression()
+        return self._close(root)
+
+    @staticmethod
+    def _close(frame: _Frame) -> Expression:
+        # Built directly like Expression.leaf, a fresh node has nothing cached to invalidate
+        expr = frame.cls.__new__(frame.cls)
+        expr.__dict__.update(value=frame.elements if frame.elements else "", length=1, cycle_idx=0)
+        return expr
 
 
-def parse_pattern(text):
+def parse_pattern(text, recover: bool = False):
     """Parse a Strudel pattern string into Expression objects."""
-    parser = BasicParser(text)
-    return parser.parse()
+    with profiling.stage('parse'):
+        return BasicParser(text).parse(recover)
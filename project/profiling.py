@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Opt-in instrumentation of the conversion pipeline
+#
+# Stages (ingest.read, voices, compress, render, ...) are timed with
+# `with profiling.stage(name):` and work is counted with profiling.count(name, n). Both return
+# at once while profiling is disabled, so they stay in the code at no measurable cost; they are
+# only placed around whole tracks, never inside per-note loops. Once enabled, every stage becomes
+# a trace event and export() writes Chrome trace-event JSON, which chrome://tracing and Perfetto
+# open directly, with the counters, per-stage totals and peak memory alongside. Peak memory is
+# that of this process; work done in worker processes reports the largest worker peak apart.
+
+enabled = False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _recorder.add(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+class Recorder:
+    """Trace events and counters collected while profiling is enabled"""
+
+    def __init__(self):
+        self.events: List[Dict] = []
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.totals: Dict[str, float] = defaultdict(float)
+        # Largest peak_memory() any worker sent along
+        self.worker_memory: Dict[str, int] = {}
+        self.origin = time.perf_counter_ns()
+
+    def add(self, name: str, start: int, duration: int):
+        self.totals[name] += duration / 1e9
+        self.events.append({'name': name, 'ph': 'X', 'ts': (start - self.origin) / 1000, 'dur': duration / 1000,
+                            'pid': os.getpid(), 'tid': threading.get_ident()})
+
+    def merge(self, data: Dict):
+        """Add what drain() returned in another process"""
+        self.events.extend(data['events'])
+        for name, value in data['counters'].items():
+            self.counters[name] += value
+        for name, value in data['totals'].items():
+            self.totals[name] += value
+        for name, value in data['memory'].items():
+            self.worker_memory[name] = max(value, self.worker_memory.get(name, 0))
+
+    def drain(self) -> Dict:
+        """Everything recorded so far and the peak memory, as plain data, leaving the recorder empty"""
+        data = {'events': self.events, 'counters': dict(self.counters), 'totals': dict(self.totals),
+                'memory': peak_memory()}
+        self.events = []
+        self.counters = defaultdict(int)
+        self.totals = defaultdict(float)
+        return data
+
+
+_recorder = Recorder()
+
+
+def enable(memory: bool = False, origin: int | None = None):
+    """Start recording. memory traces Python allocations for an exact peak, which is slow"""
+    global enabled, _recorder
+    enabled = True
+    _recorder = Recorder()
+    if origin is not None:
+        # Workers share the parent's time origin, so their events line up with the parent's
+        _recorder.origin = origin
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global enabled
+    enabled = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def recorder() -> Recorder:
+    return _recorder
+
+
+def stage(name: str):
+    """Context manager timing one pipeline stage, a no-op while disabled"""
+    if not enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def count(name: str, amount: int = 1):
+    if enabled:
+        _recorder.counters[name] += amount
+
+
+def peak_memory() -> Dict[str, int]:
+    """Peak resident set size of this process, and of traced allocations when tracing"""
+    peak = {}
+    if resource is not None:
+        # Kilobytes on Linux
+        peak['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    if tracemalloc.is_tracing():
+        peak['traced_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    return peak
+
+
+def summary() -> Dict:
+    memory = peak_memory()
+    memory.update((f'worker_{name}', value) for name, value in _recorder.worker_memory.items())
+    return {'stages': dict(_recorder.totals), 'counters': dict(_recorder.counters), 'memory': memory}
+
+
+def format_summary() -> str:
+    data = summary()
+    lines = [f'{"stage":>20} {"seconds":>10}']
+    for name, seconds in sorted(data['stages'].items(), key=lambda item: -item[1]):
+        lines.append(f'{name:>20} {seconds:>10.4f}')
+    for name, value in sorted(data['counters'].items()):
+        lines.append(f'{name:>20} {value:>10}')
+    for name, value in data['memory'].items():
+        lines.append(f'{name:>20} {value / 2 ** 20:>9.1f}M')
+    return '\n'.join(lines)
+
+
+def export(path: str):
+    """Write a Chrome trace-event file of everything recorded"""
+    data = summary()
+    events = list(_recorder.events)
+    end = max((event['ts'] + event['dur'] for event in events), default=0)
+    events.append({'name': 'counters', 'ph': 'C', 'ts': end, 'pid': os.getpid(), 'args': data['counters']})
+    with open(path, 'w') as outfile:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': data}, outfile)
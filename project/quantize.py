@@ -0,0 +1,56 @@
+from note import REST
+from track import NoteTrack
+
+
+# Quantization and rests
+#
+# Played MIDI has onsets and lengths a few ticks off the beat, and two notes that are meant to be
+# the same then never compare equal, so the compressor finds no repeats and every length costs
+# its own @ suffix. Snapping onsets and ends to a grid of `steps` per beat turns the lengths into
+# a small alphabet of whole steps. Silence between the notes of a voice is made explicit as REST
+# notes, written ~, so a voice keeps its place in time and stacked voices stay aligned.
+
+def snap(ticks: int, resolution: int, steps: int) -> int:
+    """Nearest grid step of a time in ticks, halves rounded up"""
+    return (2 * ticks * steps + resolution) // (2 * resolution)
+
+
+def quantize(track: NoteTrack, steps: int = 4) -> NoteTrack:
+    """The track on a grid of `steps` per beat, every note at least one step long"""
+    quantized = NoteTrack(resolution=steps)
+    resolution = track.resolution
+    for pitch, start, length, channel, velocity in zip(track.pitch, track.start, track.length,
+                                                      track.channel, track.velocity):
+        begin = snap(start, resolution, steps)
+        end = snap(start + length, resolution, steps)
+        quantized.add_ticks(pitch, begin, max(1, end - begin), channel, velocity)
+    return quantized
+
+
+def fill_rests(voice: NoteTrack, end: int | None = None) -> NoteTrack:
+    """A monophonic voice in start order with its gaps filled by rests, from time 0 up to `end`.
+
+    A note still sounding when the next one starts is cut short, which only happens when
+    quantization moved two notes onto each other."""
+    filled = NoteTrack(resolution=voice.resolution)
+    time = 0
+    count = len(voice)
+    for idx in range(count):
+        start = voice.start[idx]
+        if start > time:
+            filled.add_ticks(REST, time, start - time)
+        note_end = start + voice.length[idx]
+        if idx + 1 < count:
+            note_end = min(note_end, voice.start[idx + 1])
+        if note_end > start:
+            filled.add_ticks(voice.pitch[idx], start, note_end - start, voice.channel[idx], voice.velocity[idx])
+        time = max(time, note_end)
+
+    if end is not None and end > time:
+        filled.add_ticks(REST, time, end - time)
+    return filled
+
+
+def track_end(track: NoteTrack) -> int:
+    """Tick at which the last note of the track stops"""
+    return max((start + length for start, length in zip(track.start, track.length)), default=0)
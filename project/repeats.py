@@ -0,0 +1,197 @@
+from typing import Dict, Hashable, Iterator, List, Sequence, Tuple
+
+
+# Repeat index over a token sequence
+#
+# A suffix array with its LCP array answers "which runs of the sequence occur more than once"
+# for every length at once. The suffix array is built by prefix doubling (O(n log n) sorts that
+# stop as soon as every suffix is distinguished, which for music is after log2 of the longest
+# repeat), the LCP array with Kasai's algorithm in O(n).
+
+# Marks a set of left neighbours that are not all the same token
+_DIVERSE = object()
+
+
+def suffix_array(ranks: Sequence[int]) -> List[int]:
+    """Suffix array of a sequence of small non-negative integers"""
+    n = len(ranks)
+    rank = list(ranks)
+    sa = sorted(range(n), key=rank.__getitem__)
+    k = 1
+    while k < n:
+        # Pack (rank[i], rank[i + k]) into one int key, -1 meaning "past the end"
+        stride = n + 1
+        keys = [rank[i] * stride + (rank[i + k] + 1 if i + k < n else 0) for i in range(n)]
+        sa.sort(key=keys.__getitem__)
+
+        new_rank = [0] * n
+        for idx in range(1, n):
+            new_rank[sa[idx]] = new_rank[sa[idx - 1]] + (keys[sa[idx]] != keys[sa[idx - 1]])
+        rank = new_rank
+        if rank[sa[-1]] == n - 1:
+            break
+        k *= 2
+    return sa
+
+
+def lcp_array(tokens: Sequence, sa: Sequence[int]) -> List[int]:
+    """lcp[i] = longest common prefix of the suffixes sa[i - 1] and sa[i] (Kasai), lcp[0] = 0"""
+    n = len(tokens)
+    rank = [0] * n
+    for idx, pos in enumerate(sa):
+        rank[pos] = idx
+
+    lcp = [0] * n
+    h = 0
+    for pos in range(n):
+        idx = rank[pos]
+        if idx == 0:
+            h = 0
+            continue
+        other = sa[idx - 1]
+        while pos + h < n and other + h < n and tokens[pos + h] == tokens[other + h]:
+            h += 1
+        lcp[idx] = h
+        if h:
+            h -= 1
+    return lcp
+
+
+class Repeat:
+    """A maximal repeat: a run of `length` tokens that occurs at every position in `positions`"""
+    __slots__ = ('length', 'sa', 'lb', 'rb')
+
+    def __init__(self, length: int, sa: List[int], lb: int, rb: int):
+        self.length = length
+        # Occurrences are the suffix array slice sa[lb:rb], only sorted when asked for
+        self.sa = sa
+        self.lb = lb
+        self.rb = rb
+
+    @property
+    def count(self) -> int:
+        return self.rb - self.lb
+
+    @property
+    def first(self) -> int:
+        """One of the positions, without sorting them"""
+        return self.sa[self.lb]
+
+    @property
+    def positions(self) -> List[int]:
+        return sorted(self.sa[self.lb:self.rb])
+
+    def __repr__(self) -> str:
+        return f'Repeat(length={self.length}, positions={self.positions})'
+
+
+class RepeatIndex:
+    """Suffix array + LCP index over a sequence of hashable tokens"""
+
+    def __init__(self, tokens: Sequence[Hashable]):
+        self.tokens = list(tokens)
+        alphabet: Dict[Hashable, int] = {}
+        for token in self.tokens:
+            alphabet.setdefault(token, len(alphabet))
+        self.ids = [alphabet[token] for token in self.tokens]
+
+        self.sa = suffix_array(self.ids)
+        self.lcp = lcp_array(self.ids, self.sa)
+        self.rank = [0] * len(self.sa)
+        for idx, pos in enumerate(self.sa):
+            self.rank[pos] = idx
+        self._sparse: List[List[int]] | None = None
+
+    @classmethod
+    def from_track(cls, track) -> 'RepeatIndex':
+        """Index the (pitch, length) tokens of a NoteTrack"""
+        return cls(list(zip(track.pitch, track.length)))
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def maximal_repeats(self, min_length: int = 1, min_count: int = 2) -> Iterator[Repeat]:
+        """Every repeat that cannot be extended left or right without losing an occurrence.
+
+        Walks the LCP intervals bottom-up with a stack, O(n) overall."""
+        sa = self.sa
+        lcp = self.lcp
+        ids = self.ids
+        n = len(sa)
+        if n == 0:
+            return
+
+        def left(idx):
+            pos = sa[idx]
+            # The start of the sequence counts as a token that differs from every other
+            return _DIVERSE if pos == 0 else ids[pos - 1]
+
+        def merge(a, b):
+            return a if a == b else _DIVERSE
+
+        # [height, left bound, merged left neighbours]
+        stack = [[0, 0, left(0)]]
+        for i in range(1, n + 1):
+            h = lcp[i] if i < n else 0
+            lb = i - 1
+            pending = None
+            while stack[-1][0] > h:
+                height, lb, lefts = stack.pop()
+                if lefts is _DIVERSE and height >= min_length and i - lb >= min_count:
+                    yield Repeat(height, sa, lb, i)
+                if stack[-1][0] >= h:
+                    stack[-1][2] = merge(stack[-1][2], lefts)
+                else:
+                    pending = lefts
+
+            if i == n:
+                break
+            if stack[-1][0] < h:
+                lefts = pending if pending is not None else left(i - 1)
+                stack.append([h, lb, merge(lefts, left(i))])
+            else:
+                stack[-1][2] = merge(stack[-1][2], left(i))
+
+    def longest_common_extension(self, a: int, b: int) -> int:
+        """How many tokens match from positions a and b on, O(1) after the first call"""
+        if a == b:
+            return len(self.tokens) - a
+        ra, rb = self.rank[a], self.rank[b]
+        if ra > rb:
+            ra, rb = rb, ra
+
+        # Range minimum of lcp[ra + 1 .. rb] over a sparse table
+        if self._sparse is None:
+            self._sparse = self._build_sparse_table()
+        level = (rb - ra).bit_length() - 1
+        row = self._sparse[level]
+        return min(row[ra + 1], row[rb - (1 << level) + 1])
+
+    def _build_sparse_table(self) -> List[List[int]]:
+        table = [self.lcp]
+        span = 1
+        while span * 2 <= len(self.lcp):
+            prev = table[-1]
+            table.append(list(map(min, prev[:len(prev) - span], prev[span:])))
+            span *= 2
+        return table
+
+    def tandem_repeats_at(self, i: int, max_period: int | None = None) -> List[Tuple[int, int]]:
+        """(period, count) of every run of count >= 2 back to back copies starting at i.
+
+        Periods that only repeat a shorter period found here are left out."""
+        n = len(self.tokens)
+        if max_period is None:
+            max_period = (n - i) // 2
+        max_period = min(max_period, (n - i) // 2)
+
+        found = []
+        for period in range(1, max_period + 1):
+            count = 1 + self.longest_common_extension(i, i + period) // period
+            if count < 2:
+                continue
+            if any(period % shorter == 0 and shorter_count * shorter >= 2 * period
+                   for shorter, shorter_count in found):
+                continue
+            found.append((period, count))
+        return found
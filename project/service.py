@@ -0,0 +1,397 @@
+import asyncio
+import contextlib
+import errno
+import functools
+import json
+import os
+import signal
+import stat
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Tuple
+
+import expression
+from batch import convert_packed, pack_track, track_voices
+from cache import PatternCache, pattern_key, storable
+from compiled import CompiledExpression, compile_expression
+from compressor import CompressorSettings, flat_pattern
+from expression import Expression, UnwrapLimits
+from ingest import iter_note_tracks
+from parser import parse_pattern
+
+
+# Conversion as a long-running local service
+#
+# Running main.py for every file an editor hands over pays for a fresh interpreter, the imports
+# (mido above all) and a new process pool each time. The service keeps all of that loaded: it
+# listens on a local socket, reads one JSON request per line and answers each with one JSON line
+# carrying the request's id, in whatever order they finish:
+#
+#   {"op": "parse", "pattern": text}              -> {"pattern": normalized text, "cycles": n}
+#   {"op": "unwrap", "pattern": text, "start": 0, "end": n}
+#                                                 -> {"pattern": one note per cycle, "events":
+#                                                     [[value, ticks], ...], "resolution": r}
+#   {"op": "compress", "pitches": [...], "lengths": [ticks, ...], "resolution": r}
+#                                                 -> {"pattern": text}
+#   {"op": "convert", "path": file, "split": true, "grid": null}
+#                                                 -> {"tracks": [pattern of every track]}
+#
+# A failed request is answered with {"id": ..., "error": message}, plus "position" when the
+# pattern text did not parse.
+#
+# The work runs on a process pool. An editor sends many small requests at once (every pattern
+# on screen, every edit), and a round trip to a worker costs more than parsing a short pattern,
+# so requests arriving within `window` seconds of each other go to a worker as one batch, until
+# the batch holds batch_size notes or characters; a request that size or larger goes alone.
+# Workers keep the patterns they parsed and compiled, the service keeps the compressed patterns
+# in memory, and in the PatternCache when given one, and compresses a sequence already in
+# flight only once. The cache is read and written on a thread of its own, since SQLite may wait
+# for another process to release the file.
+
+# Largest request line, a long track sends a few numbers per note
+LINE_LIMIT = 64 * 1024 * 1024
+
+# Peak bytes per event of an unwrap response in the worker: the event lists, the flat pattern
+# tree and its text, measured with tracemalloc
+RESPONSE_EVENT_BYTES = 400
+
+
+class RequestError(Exception):
+    """A request that can't be answered, with the offset in the pattern when it didn't parse"""
+
+    def __init__(self, message: str, position: int | None = None):
+        super().__init__(message)
+        self.message = message
+        self.position = position
+
+
+@functools.lru_cache(maxsize=1024)
+def _expression(text: str) -> Expression:
+    return parse_pattern(text)
+
+
+@functools.lru_cache(maxsize=256)
+def _program(text: str) -> CompiledExpression:
+    return compile_expression(_expression(text))
+
+
+def _parse(text: str) -> Dict:
+    expression = _expression(text)
+    return {'pattern': str(expression), 'cycles': expression.get_cycle_length()}
+
+
+def _unwrap(text: str, start: int, end: int | None) -> Dict:
+    if _expression(text).value == '':
+        # An empty pattern plays nothing
+        return {'pattern': '', 'events': [], 'resolution': 1}
+    # Held to the unwrap limits, a short pattern can play for millions of cycles. The response
+    # takes far more than the arrays, so its size is what the limits are checked against
+    limits = expression.DEFAULT_LIMITS
+    cap = limits.event_cap(RESPONSE_EVENT_BYTES)
+    unwrapped = _program(text).unwrap(start, end, UnwrapLimits(limits.max_cycles, cap, None))
+    values = [unwrapped.values[idx] for idx in unwrapped.ids]
+    return {'pattern': str(flat_pattern(values, unwrapped.ticks, unwrapped.resolution)),
+            'events': [list(event) for event in zip(values, unwrapped.ticks)], 'resolution': unwrapped.resolution}
+
+
+def _read(path: str, split: bool, grid: int | None) -> List[List[Tuple[bytes, bytes, int]]]:
+    return [[pack_track(voice) for voice in track_voices(track, split, grid)] for track in iter_note_tracks(path)]
+
+
+_TASKS = {'parse': _parse, 'unwrap': _unwrap, 'compress': convert_packed, 'read': _read}
+
+
+def run_batch(tasks: List[Tuple[str, tuple]]) -> List[Tuple[bool, Any]]:
+    """Run (op, args) tasks in a worker, (True, result) or (False, (message, position)) for each"""
+    outcomes = []
+    for op, args in tasks:
+        try:
+            outcomes.append((True, _TASKS[op](*args)))
+        except Exception as error:
+            # Sent back as plain data, not every exception pickles
+            outcomes.append((False, (f'{type(error).__name__}: {error}', getattr(error, 'position', None))))
+    return outcomes
+
+
+def _ready():
+    return os.getpid()
+
+
+def _unpack(pitch: bytes, length: bytes) -> Tuple[array, array]:
+    pitches = array('h')
+    pitches.frombytes(pitch)
+    lengths = array('q')
+    lengths.frombytes(length)
+    return pitches, lengths
+
+
+class ConversionService:
+    """Answers parse, unwrap, compress and convert requests, batching small ones for the workers.
+
+    jobs is the number of worker processes, os.cpu_count() by default; with 1 the work runs on
+    a thread of this process instead, still off the event loop."""
+
+    def __init__(self, jobs: int | None = None, settings: CompressorSettings | None = None,
+                 cache: PatternCache | None = None, window: float = 0.002, batch_size: int = 4096,
+                 remembered: int = 4096):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.settings = settings
+        self.cache = cache
+        self.window = window
+        self.batch_size = batch_size
+        self.remembered = remembered
+        # Batches sent to the workers and the requests in them, for monitoring
+        self.batches = 0
+        self.tasks = 0
+
+        self._executor: Executor | None = None
+        # The cache's SQLite calls can wait on another process's write lock, never on the loop
+        self._cache_thread: ThreadPoolExecutor | None = None
+        self._pending: List[Tuple[str, tuple, asyncio.Future]] = []
+        self._pending_size = 0
+        self._timer: asyncio.TimerHandle | None = None
+        # Compressed patterns by pattern_key, least recently used first
+        self._patterns: OrderedDict[str, str] = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        # (path, inode) of the Unix sockets this service bound
+        self._sockets: List[Tuple[str, int]] = []
+
+    def _new_executor(self) -> Executor:
+        return ThreadPoolExecutor(1) if self.jobs == 1 else ProcessPoolExecutor(self.jobs)
+
+    async def start(self):
+        """Start the workers, so the first requests don't wait for them"""
+        loop = asyncio.get_running_loop()
+        self._executor = self._new_executor()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, _ready) for _ in range(self.jobs)))
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        if self._cache_thread is not None:
+            self._cache_thread.shutdown()
+            self._cache_thread = None
+        for path, inode in self._sockets:
+            with contextlib.suppress(OSError):
+                if os.stat(path).st_ino == inode:
+                    os.unlink(path)
+        self._sockets = []
+
+    def _run(self, op: str, args: tuple, size: int) -> asyncio.Future:
+        """Queue a task for the workers, sending the queue once it is full or the window passed"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if size >= self.batch_size:
+            self._dispatch([(op, args, future)])
+            return future
+
+        self._pending.append((op, args, future))
+        self._pending_size += size
+        if self._pending_size >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_size = self._pending, [], 0
+        if batch:
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[str, tuple, asyncio.Future]]):
+        if self._executor is None:
+            self._executor = self._new_executor()
+        self.batches += 1
+        self.tasks += len(batch)
+        executor = self._executor
+        done = asyncio.get_running_loop().run_in_executor(executor, run_batch, [(op, args) for op, args, _ in batch])
+        done.add_done_callback(functools.partial(self._settle, batch, executor))
+
+    def _settle(self, batch: List[Tuple[str, tuple, asyncio.Future]], executor: Executor, done: asyncio.Future):
+        error = done.exception()
+        if isinstance(error, BrokenProcessPool) and executor is self._executor:
+            # A worker died and took the pool with it, later requests get a fresh one
+            executor.shutdown(cancel_futures=True)
+            self._executor = self._new_executor()
+        outcomes = done.result() if error is None else [(False, (f'{type(error).__name__}: {error}', None))] * len(batch)
+        for (_, _, future), (ok, outcome) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(outcome)
+            else:
+                future.set_exception(RequestError(*outcome))
+
+    async def compress(self, pitches: array, lengths: array, resolution: int) -> str:
+        """Pattern text of a sequence of pitches (-1 for rests) with lengths in ticks"""
+        key = pattern_key(pitches, lengths, resolution, self.settings)
+        pattern = self._patterns.get(key)
+        if pattern is not None:
+            self._patterns.move_to_end(key)
+            return pattern
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = self._in_flight[key] = asyncio.ensure_future(self._compress(key, pitches, lengths, resolution))
+        # Shared by every request for the same sequence, one giving up doesn't cancel it for the rest
+        return await asyncio.shield(future)
+
+    def _in_cache_thread(self, method, *args) -> asyncio.Future:
+        if self._cache_thread is None:
+            self._cache_thread = ThreadPoolExecutor(1)
+        return asyncio.get_running_loop().run_in_executor(self._cache_thread, method, *args)
+
+    async def _compress(self, key: str, pitches: array, lengths: array, resolution: int) -> str:
+        try:
+            pattern = await self._in_cache_thread(self.cache.get, key) if self.cache is not None else None
+            if pattern is None:
+                pattern = await self._run('compress', (pitches.tobytes(), lengths.tobytes(), resolution,
+                                                       self.settings), len(pitches))
+                if self.cache is not None and storable(self.settings):
+                    await self._in_cache_thread(self.cache.put, key, pattern)
+        finally:
+            self._in_flight.pop(key, None)
+        self._patterns[key] = pattern
+        if len(self._patterns) > self.remembered:
+            self._patterns.popitem(last=False)
+        return pattern
+
+    async def handle(self, request: Dict) -> Dict:
+        """The response to one decoded request"""
+        response = {'id': request.get('id')}
+        try:
+            response.update(await self._answer(request))
+        except RequestError as error:
+            response['error'] = error.message
+            if error.position is not None:
+                response['position'] = error.position
+        except Exception as error:
+            # Fields that are missing or of the wrong type, or a failure of the cache: the
+            # connection keeps answering its other requests either way
+            response['error'] = f'{type(error).__name__}: {error}'
+        return response
+
+    async def _answer(self, request: Dict) -> Dict:
+        op = request.get('op')
+        if op in ('parse', 'unwrap'):
+            text = request['pattern']
+            if not isinstance(text, str):
+                raise RequestError('pattern must be a string')
+            if op == 'parse':
+                return await self._run('parse', (text,), len(text))
+            end = request.get('end')
+            return await self._run('unwrap', (text, int(request.get('start', 0)), None if end is None else int(end)),
+                                   len(text))
+
+        if op == 'compress':
+            pitches = array('h', request['pitches'])
+            lengths = array('q', request['lengths'])
+            resolution = int(request['resolution'])
+            if len(pitches) != len(lengths):
+                raise RequestError('pitches and lengths differ in length')
+            if resolution < 1 or any(length < 1 for length in lengths):
+                raise RequestError('lengths and resolution must be positive')
+            return {'pattern': await self.compress(pitches, lengths, resolution)}
+
+        if op == 'convert':
+            split = bool(request.get('split', True))
+            grid = request.get('grid')
+            tracks = await self._run('read', (str(request['path']), split, None if grid is None else int(grid)),
+                                     self.batch_size)
+            patterns = await asyncio.gather(*(
+                asyncio.gather(*(self.compress(*_unpack(pitch, length), resolution)
+                                 for pitch, length, resolution in voices))
+                for voices in tracks))
+            return {'tracks': [', '.join(voices) for voices in patterns]}
+
+        raise RequestError(f'unknown op {op!r}')
+
+    async def _reply(self, line: bytes, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(line)
+        except (ValueError, RecursionError) as error:
+            # Nesting too deep for the decoder raises RecursionError rather than ValueError
+            response = {'id': None, 'error': f'invalid JSON: {error}'}
+        else:
+            if isinstance(request, dict):
+                response = await self.handle(request)
+            else:
+                response = {'id': None, 'error': 'a request is a JSON object'}
+        writer.write(json.dumps(response).encode() + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        replies = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write(json.dumps({'id': None, 'error': 'request too long'}).encode() + b'\n')
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    reply = asyncio.create_task(self._reply(line, writer))
+                    replies.add(reply)
+                    reply.add_done_callback(replies.discard)
+            # Requests sent before the client stopped writing are still answered
+            if replies:
+                await asyncio.gather(*replies, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def listen(self, address: str) -> asyncio.AbstractServer:
+        """Accept connections on a Unix socket path, or on a localhost port given as a number"""
+        if address.isdigit():
+            return await asyncio.start_server(self._connection, '127.0.0.1', int(address), limit=LINE_LIMIT)
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            # asyncio replaces a socket found at the path, which is only right when nothing answers
+            try:
+                _, writer = await asyncio.open_unix_connection(address)
+            except OSError:
+                pass
+            else:
+                writer.close()
+                raise OSError(errno.EADDRINUSE, f'a service is already listening on {address}')
+        server = await asyncio.start_unix_server(self._connection, address, limit=LINE_LIMIT)
+        # Removed again by close(), unless something else took the path since
+        self._sockets.append((address, os.stat(address).st_ino))
+        return server
+
+
+def serve(address: str, jobs: int | None = None, settings: CompressorSettings | None = None,
+          cache: PatternCache | None = None):
+    """Run a ConversionService on `address` until interrupted"""
+    async def run():
+        service = ConversionService(jobs, settings, cache)
+        await service.start()
+        server = await service.listen(address)
+        stop = asyncio.Event()
+        with contextlib.suppress(NotImplementedError):
+            # Stopped like any service by SIGTERM, where the platform has it
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            service.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
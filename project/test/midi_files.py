@@ -0,0 +1,18 @@
+import mido
+
+
+def write_midi(path, tracks, ticks_per_beat=480):
+    mid = mido.MidiFile(ticks_per_beat=ticks_per_beat)
+    for messages in tracks:
+        track = mido.MidiTrack()
+        track.extend(messages)
+        mid.tracks.append(track)
+    mid.save(path)
+
+
+def melody(notes, channel=0):
+    messages = [mido.MetaMessage('track_name', name='melody', time=0)]
+    for pitch, ticks in notes:
+        messages.append(mido.Message('note_on', note=pitch, velocity=64, channel=channel, time=0))
+        messages.append(mido.Message('note_off', note=pitch, velocity=0, channel=channel, time=ticks))
+    return messages
@@ -0,0 +1,28 @@
+import os
+
+from batch import convert_file, convert_files, convert_packed, pack_track
+from ingest import read_note_tracks
+from track import StrudelTrack
+
+TEST_MID = os.path.join(os.path.dirname(__file__), '..', 'test.mid')
+
+
+def test_packed_tracks_compress_like_strudel_track():
+    for track in read_note_tracks(TEST_MID):
+        assert convert_packed(*pack_track(track)) == str(StrudelTrack(track))
+
+
+def test_pool_keeps_order_and_reports_failures(tmp_path):
+    broken = tmp_path / 'broken.mid'
+    broken.write_bytes(b'not a midi file')
+    paths = [TEST_MID, str(tmp_path / 'missing.mid'), str(broken), TEST_MID]
+
+    serial = list(convert_files(paths, jobs=1))
+    pooled = list(convert_files(paths, jobs=2))
+
+    expected = [str(StrudelTrack(track)) for track in read_note_tracks(TEST_MID)]
+    assert [r.pattern for r in pooled if r.path == TEST_MID] == expected * 2
+    assert [(r.path, r.track_index, r.pattern, r.error) for r in pooled] == \
+        [(r.path, r.track_index, r.pattern, r.error) for r in serial]
+    assert [r.ok for r in pooled if r.path != TEST_MID] == [False, False]
+    assert [r.pattern for r in convert_file(TEST_MID, jobs=2)] == expected
@@ -0,0 +1,103 @@
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import convert_files
+from cache import PatternCache, pattern_key, track_key
+from compressor import CompressorSettings
+from note import Note
+from track import NoteTrack, StrudelTrack
+
+TEST_MID = os.path.join(os.path.dirname(__file__), '..', 'test.mid')
+
+
+def test_key_depends_on_what_the_pattern_depends_on():
+    key = pattern_key([60, 62], [1, 2], 2)
+
+    assert pattern_key([60, 62], [4, 8], 8) == key
+    assert pattern_key([60, 62], [1, 2], 4) != key
+    assert pattern_key([60, 64], [1, 2], 2) != key
+    assert pattern_key([60, 62], [1, 2], 2, CompressorSettings(max_period=4)) != key
+    assert pattern_key([60, 62], [1, 2], 2, CompressorSettings(max_candidates=100)) != key
+    assert pattern_key([60, 62], [1, 2], 2, CompressorSettings(time_budget=1.0)) == key
+
+
+def test_unchanged_tracks_skip_compression(tmp_path, monkeypatch):
+    cache = PatternCache(str(tmp_path / 'patterns.db'))
+    track = NoteTrack([Note(60, 0.5, 0), Note(62, 0.5, 0)] * 8)
+    first = str(StrudelTrack(track, cache=cache))
+
+    monkeypatch.setattr('track.compress_track', None)
+    moved = NoteTrack([Note(60, 0.5, 3, start=9), Note(62, 0.5, 3)] * 8, resolution=96)
+    assert str(StrudelTrack(moved, cache=cache)) == first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_hits_load_the_stored_tree_without_parsing(tmp_path, monkeypatch):
+    path = str(tmp_path / 'patterns.db')
+    connection = sqlite3.connect(path)
+    # A file from before trees were stored, its entries are still read as text
+    connection.execute('CREATE TABLE patterns (key TEXT PRIMARY KEY, pattern TEXT NOT NULL, '
+                       'size INTEGER NOT NULL, last_used INTEGER NOT NULL)')
+    connection.execute("INSERT INTO patterns VALUES ('old', '<a b>', 5, 0)")
+    connection.commit()
+    connection.close()
+
+    cache = PatternCache(path)
+    assert str(cache.get_expression('old')) == '<a b>'
+
+    track = NoteTrack([Note(60, 0.5, 0), Note(62, 0.25, 0)] * 8)
+    first = str(StrudelTrack(track, cache=cache))
+    monkeypatch.setattr('cache.parse_pattern', None)
+    monkeypatch.setattr('track.compress_track', None)
+    assert str(StrudelTrack(track, cache=cache)) == first
+    assert cache.get(track_key(track)) == first
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = PatternCache(str(tmp_path / 'patterns.db'), max_bytes=10)
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+    assert cache.get('a') == 'aaaa'
+    cache.put('c', 'cccc')
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == ('aaaa', 'cccc')
+    assert (len(cache), cache.size()) == (2, 8)
+
+
+def _fill(path, worker):
+    cache = PatternCache(path, max_bytes=200)
+    for i in range(50):
+        cache.put(f'{worker}-{i}', 'x' * 10)
+    return cache.size()
+
+
+def test_concurrent_writers_keep_the_bound(tmp_path):
+    path = str(tmp_path / 'patterns.db')
+    with ProcessPoolExecutor(4) as pool:
+        list(pool.map(_fill, [path] * 4, range(4)))
+
+    cache = PatternCache(path)
+    assert cache.size() == 10 * len(cache) <= 200
+
+
+def test_batch_conversion_reuses_the_cache(tmp_path):
+    cache = PatternCache(str(tmp_path / 'patterns.db'))
+    first = [r.pattern for r in convert_files([TEST_MID], jobs=2, cache=cache)]
+    misses = cache.misses
+
+    assert [r.pattern for r in convert_files([TEST_MID], jobs=1, cache=cache)] == first
+    assert cache.misses == misses
+
+
+def test_budgeted_results_are_read_but_not_stored(tmp_path):
+    cache = PatternCache(str(tmp_path / 'patterns.db'))
+    budgeted = CompressorSettings(time_budget=0.0)
+    track = NoteTrack([Note(60, 0.5, 0), Note(62, 0.5, 0)] * 8)
+
+    StrudelTrack(track, budgeted, cache=cache)
+    assert len(cache) == 0
+    full = str(StrudelTrack(track, CompressorSettings(), cache=cache))
+    assert str(StrudelTrack(track, budgeted, cache=cache)) == full
+    assert cache.hits == 1
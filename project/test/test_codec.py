@@ -0,0 +1,53 @@
+import pickle
+
+import pytest
+
+from codec import dumps, loads
+from expression import BracketExpression, Expression
+from parser import parse_pattern
+
+
+def test_trees_round_trip_exactly():
+    patterns = ['a', '[]', '<a b@0.5 [c d]*3 <e [f g]@2>@1.5>', '[a [b c d]*3 e@0.1]', '~ 60@300 61@3']
+    for pattern in patterns:
+        expr = parse_pattern(pattern)
+        copy = loads(dumps(expr))
+        assert str(copy) == str(expr)
+        assert copy.freeze() is expr.freeze()
+
+    unwrapped = parse_pattern('[a [b c d]*3 e@0.1]').unwrap()
+    assert [leaf.length for leaf in loads(dumps(unwrapped)).value] == [leaf.length for leaf in unwrapped.value]
+
+
+def test_deep_and_wide_trees_load_without_recursion():
+    deep = parse_pattern('[' * 50_000 + 'a' + ']' * 50_000)
+    assert str(loads(dumps(deep))) == str(deep)
+
+    wide = parse_pattern(' '.join(str(i) for i in range(100_000)))
+    data = dumps(wide)
+    # Besides its text, a leaf takes its code byte and its size in the value table, plus an
+    # index into the table; past 127 the index is a marker byte and 8 bytes in the wide array
+    text_size = sum(len(str(i)) for i in range(100_000))
+    assert len(data) < text_size + 11 * 100_000
+    assert str(loads(data)) == str(wide)
+
+
+def test_length_expressions_are_kept():
+    expr = BracketExpression()
+    expr.value = [Expression.leaf('a'), Expression.leaf('b')]
+    expr.length = [Expression.leaf('x', 2)]
+
+    copy = loads(dumps(expr))
+    assert copy.get_total_length() == 2
+    assert str(copy) == str(expr) == '[a b]@x@2'
+
+
+def test_expressions_pickle_through_the_binary_form():
+    expr = parse_pattern('<[a b]*2 c@0.25>')
+    assert str(pickle.loads(pickle.dumps(expr))) == str(expr)
+
+
+@pytest.mark.parametrize('data', [b'', b'nonsense', dumps(parse_pattern('[a b c]'))[:-2]])
+def test_damaged_data_is_rejected(data):
+    with pytest.raises(ValueError):
+        loads(data)
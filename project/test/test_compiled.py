@@ -0,0 +1,70 @@
+import random
+from fractions import Fraction
+
+import pytest
+
+import expression
+from compiled import compile_expression, unwrap_compact
+from compressor import compress
+from parser import parse_pattern
+
+PATTERNS = [
+    'a',
+    '[a b c]',
+    '<a b c>@2',
+    '[a <b c>@2 [d <e f g>]*2]@3',
+    '<[60 <62 64 65 67>]@8*4 x>',
+    '[a [b c d]*3 e@0.1]',
+    '[a <b [c d]>]',
+    '<[a b]*2 [<c d>]*3 []>',
+]
+
+
+def test_cycles_match_the_tree():
+    for text in PATTERNS:
+        expr = parse_pattern(text)
+        program = compile_expression(expr)
+        for cycle in range(2 * expr.get_cycle_length()):
+            assert list(program.iter_cycle(cycle)) == expr.cycle_events(cycle), (text, cycle)
+
+
+def test_one_period_matches_unwrap():
+    rng = random.Random(3)
+    values = [rng.choice('abc') for _ in range(200)]
+    lengths = [rng.choice([Fraction(1, 2), 1, Fraction(3, 2)]) for _ in range(200)]
+    expr = compress(values, lengths)
+
+    program = compile_expression(expr)
+    ids, ticks = program.run_cycles()
+    assert program.static
+    assert [program.values[idx] for idx in ids] == values
+    assert [Fraction(t, program.resolution) for t in ticks] == lengths
+
+
+def test_nested_lengths_that_vary_fall_back_to_the_tree():
+    expr = parse_pattern('[a <b [c d e]@2>]')
+    program = compile_expression(expr)
+
+    assert not program.static
+    for cycle in range(4):
+        assert list(program.iter_cycle(cycle)) == expr.cycle_events(cycle)
+
+
+def test_compact_unwrap_holds_the_same_events():
+    for text in PATTERNS + ['']:
+        expr = parse_pattern(text)
+        unwrapped = unwrap_compact(expr)
+        assert str(unwrapped.to_expression()) == str(expr.unwrap()), text
+        assert list(unwrapped) == [(leaf.value, leaf.length) for leaf in unwrapped.to_expression().value]
+
+    program = compile_expression(parse_pattern('<a b c>'))
+    assert [value for value, _ in program.unwrap(2, 5)] == ['c', 'a', 'b']
+
+
+def test_replaced_default_limits_apply_to_compact_unwraps(monkeypatch):
+    monkeypatch.setattr(expression, 'DEFAULT_LIMITS', expression.UnwrapLimits(max_events=10))
+    expr = parse_pattern('<<a b c> <d e f g>>')
+
+    for unwrap in (expr.unwrap, lambda: unwrap_compact(expr)):
+        with pytest.raises(expression.UnwrapLimitError):
+            unwrap()
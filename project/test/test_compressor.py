@@ -0,0 +1,123 @@
+import random
+from fractions import Fraction
+
+from compressor import (CompressorSettings, IncrementalCompressor, compress, compress_anytime, compress_progressive,
+                        compress_ticks, flat_pattern)
+from parser import parse_pattern
+from timing import to_time
+
+
+def round_trip(pattern):
+    return [(expr.value, expr.length) for expr in parse_pattern(str(pattern)).unwrap().value]
+
+
+def assert_same_sequence(got, values, lengths):
+    assert got == [(value, to_time(length)) for value, length in zip(values, lengths)]
+
+
+def test_repeats_groups_and_alternations():
+    assert str(compress(['60'] * 4, [0.25] * 4)) == '<[60]*4>'
+    assert str(compress(['60', '62', '64'], [0.5] * 3)) == '<[60 62 64]@1.5>'
+    assert str(compress(list('xabababy'), [1] * 8)) == '<x [a b]@6*3 y>'
+    assert str(compress(list('abacabad'), [1] * 8)) == '<a b a c a b a d>'
+    assert str(compress(['60', '62', '60', '64', '60', '65', '60', '67'], [1] * 8)) == '<[60 <62 64 65 67>]@8*4>'
+
+
+def test_random_sequences_round_trip():
+    rng = random.Random(4)
+    for _ in range(200):
+        motif = [(rng.choice('abcd'), rng.choice([0.25, 0.5, 1.0, 2.0])) for _ in range(rng.randrange(1, 6))]
+        sequence = []
+        while len(sequence) < rng.randrange(1, 60):
+            sequence += motif if rng.random() < 0.5 else [(rng.choice('abcde'), rng.choice([0.5, 1.0]))]
+        values = [value for value, _ in sequence]
+        lengths = [length for _, length in sequence]
+
+        pattern = compress(values, lengths)
+
+        assert_same_sequence(round_trip(pattern), values, lengths)
+        assert len(str(pattern)) <= len(str(compress(values, lengths, CompressorSettings(max_period=0, max_group=0))))
+
+
+def test_triplet_lengths_round_trip_exactly():
+    rng = random.Random(7)
+    for resolution in (3, 6, 480):
+        for _ in range(50):
+            lengths = [rng.choice([resolution // 3, resolution // 3 * 2, resolution]) for _ in range(rng.randrange(1, 40))]
+            lengths.append(-sum(lengths) % resolution or resolution)
+            values = [rng.choice('abc') for _ in lengths]
+
+            for pattern in (compress_ticks(values, lengths, resolution), flat_pattern(values, lengths, resolution)):
+                assert '333' not in str(pattern)
+                assert_same_sequence(round_trip(pattern), values, [Fraction(length, resolution) for length in lengths])
+
+
+def test_time_budget_still_gives_a_valid_pattern():
+    values = [str(60 + i % 7) for i in range(3000)]
+    lengths = [0.5] * 3000
+
+    pattern = compress(values, lengths, CompressorSettings(time_budget=0))
+
+    assert_same_sequence(round_trip(pattern), values, lengths)
+
+
+def test_candidate_budget_is_reproducible():
+    rng = random.Random(3)
+    motifs = [[rng.choice('abcde') for _ in range(rng.randint(3, 9))] for _ in range(6)]
+    values = []
+    while len(values) < 3000:
+        values += rng.choice(motifs)
+    lengths = [2] * len(values)
+    settings = CompressorSettings(max_candidates=20000)
+
+    patterns = {str(compress_anytime(values, lengths, 4, settings)) for _ in range(2)}
+
+    assert len(patterns) == 1
+    pattern = patterns.pop()
+    assert_same_sequence(round_trip(pattern), values, [0.5] * len(values))
+    assert len(str(compress_ticks(values, lengths, 4))) < len(pattern) < len(str(flat_pattern(values, lengths, 4)))
+
+
+def test_progressive_patterns_shrink_down_to_the_optimum():
+    rng = random.Random(2)
+    values = [rng.choice(['60', '62', '64']) for _ in range(40)] * 3 + ['60', '67'] * 20
+    lengths = [rng.choice([1, 2]) for _ in range(40)] * 3 + [1] * 40
+
+    patterns = [str(pattern) for pattern in compress_progressive(values, lengths, 4)]
+
+    assert patterns[0] == str(parse_pattern(patterns[-1]).unwrap())
+    assert patterns[-1] == str(compress_ticks(values, lengths, 4))
+    assert len(patterns) > 2
+    assert all(len(longer) > len(shorter) for longer, shorter in zip(patterns, patterns[1:]))
+    for pattern in patterns:
+        assert_same_sequence(round_trip(pattern), values, [length / 4 for length in lengths])
+
+
+def test_progressive_search_stops_at_the_budget():
+    values = [str(60 + i % 7) for i in range(3000)]
+
+    patterns = list(compress_progressive(values, [2] * 3000, 4, CompressorSettings(time_budget=0)))
+
+    assert [str(pattern) for pattern in patterns] == ['<' + ' '.join(f'{value}@0.5' for value in values) + '>']
+
+
+def test_incremental_edits_match_the_edited_sequence():
+    rng = random.Random(9)
+    values = [rng.choice('abc') for _ in range(300)]
+    lengths = [rng.choice([0.5, 1.0]) for _ in range(300)]
+    compressor = IncrementalCompressor(values, lengths)
+    assert str(compressor.expression) == str(compress(values, lengths))
+
+    for _ in range(50):
+        start = rng.randrange(len(values) + 1)
+        end = min(len(values), start + rng.randrange(4))
+        new_values = [rng.choice('abcd') for _ in range(rng.randrange(4))]
+        new_lengths = [rng.choice([0.25, 1.0]) for _ in new_values]
+        values[start:end] = new_values
+        lengths[start:end] = new_lengths
+
+        pattern = compressor.replace(start, end, new_values, new_lengths)
+
+        assert_same_sequence(round_trip(pattern), values, lengths)
+
+    assert str(compressor.recompress()) == str(compress(values, lengths))
@@ -0,0 +1,139 @@
+import math
+from fractions import Fraction
+
+import pytest
+
+from compiled import unwrap_compact
+from expression import Expression, Node, UnwrapLimitError, UnwrapLimits
+from parser import parse_pattern
+from timing import format_time
+
+
+def test_metrics_are_cached_and_computed_bottom_up():
+    expr = parse_pattern('[a <b c>@2 [d <e f g>]*2]@3')
+
+    metrics = expr.metrics()
+
+    assert metrics.cycle_length == 6
+    assert metrics.total_length == 3.0
+    assert metrics.weight == 4.0
+    assert metrics.node_count == 12
+    assert expr.metrics() is metrics
+
+
+def test_metrics_follow_changes_anywhere_in_the_tree():
+    expr = parse_pattern('[a <b c>]')
+    assert expr.get_cycle_length() == 2
+
+    angle = expr.value[1]
+    angle.value = angle.value + [Expression.leaf('d')]
+    assert expr.get_cycle_length() == 3
+
+    angle.value.append(Expression.leaf('e'))
+    Expression.invalidate()
+    assert expr.get_cycle_length() == 4
+
+
+def test_evaluation_is_exact():
+    unwrapped = parse_pattern('[a [b c d]*3 e@0.1]').unwrap()
+
+    lengths = [expr.length for expr in unwrapped.value]
+    assert lengths[1] == Fraction(10, 189)
+    assert sum(lengths) == 1
+    assert str(parse_pattern('[0 1]*2').unwrap()) == '<0@0.25 1@0.25 0@0.25 1@0.25>'
+
+
+def test_format_time():
+    assert [format_time(t) for t in (Fraction(3), Fraction(1, 8), Fraction(-5, 2), Fraction(1, 3), 2.0)] == \
+        ['3', '0.125', '-2.5', '0.3333333333333333', '2']
+    # Never with an exponent, which the parser doesn't read
+    assert [format_time(t) for t in (1e-07, 1.5e20, Fraction(1, 3 * 10 ** 7))] == \
+        ['0.0000001', '150000000000000000000', '0.000000033333333333333334']
+    assert parse_pattern(f'a@{format_time(1e-07)}').get_total_length() == Fraction(1, 10 ** 7)
+
+
+def test_events_stream_what_unwrap_builds():
+    for pattern in ['[0 <2 3>@2]*2', '<x [a <b c>]@4*2>', '[a <b [c d]*3> e@2]@5', '<a@2 [b <c d@3>]>']:
+        expr = parse_pattern(pattern)
+        unwrapped = [(leaf.value, leaf.length) for leaf in expr.unwrap().value]
+
+        events = list(expr.events())
+
+        assert [(value, duration) for value, _, duration in events] == unwrapped
+        assert [onset for _, onset, _ in events] == [sum(d for _, d in unwrapped[:i]) for i in range(len(unwrapped))]
+
+
+def test_cycle_queries_do_not_unwrap_the_period():
+    sizes = (7, 11, 13, 17, 19, 23)
+    expr = parse_pattern('<' + ' '.join('<%s>' % ' '.join(str(i) for i in range(n)) for n in sizes) + '>')
+    assert expr.get_cycle_length() == 6 * 7 * 11 * 13 * 17 * 19 * 23
+
+    for cycle in (10 ** 9, 10 ** 9 + 1):
+        expected = str(cycle % sizes[cycle % 6])
+        assert expr.cycle_events(cycle) == [(expected, 1)]
+        assert next(expr.events(cycle)) == (expected, 0, 1)
+
+
+def test_frozen_nodes_are_shared_and_compare_by_identity():
+    expr = parse_pattern('[<a b> [c d]*2 <a b>]@3')
+    node = expr.freeze()
+
+    assert node is parse_pattern('[<a b> [c d]*2 <a b>]@3').freeze()
+    assert node.value[0] is node.value[2]
+    assert hash(node) == hash(parse_pattern('[<a b> [c d]*2 <a b>]@3').freeze())
+    assert node is not parse_pattern('[<a b> [c d]*3 <a b>]@3').freeze()
+    assert Node.leaf('a', Fraction(2)) is Node.leaf('a', 2)
+
+    assert str(node) == str(expr)
+    assert node.get_cycle_length() == expr.get_cycle_length()
+    assert list(node.iter_cycle(1)) == expr.cycle_events(1)
+
+
+def test_thawed_nodes_are_independent_copies():
+    node = parse_pattern('[a <b c>]').freeze()
+    expr = node.thaw()
+    expr.value[1].value.append(Expression.leaf('d'))
+    Expression.invalidate()
+
+    assert str(expr) == '[a <b c d>]'
+    assert str(node) == '[a <b c>]'
+    assert expr.freeze() is not node
+
+
+def angles(*sizes):
+    return '<%s>' % ' '.join('<%s>' % ' '.join(str(i) for i in range(size)) for size in sizes)
+
+
+def test_unwrap_cost_is_predicted_from_the_tree():
+    expr = parse_pattern(angles(7, 11, 13)[:-1] + ' [<a b c d e f g h i j k l m n o p q> x*8]>')
+    cost = expr.unwrap_cost()
+
+    assert cost.cycles == math.lcm(4, 7, 11, 13, 17)
+    assert cost.events == len(unwrap_compact(expr)) <= cost.max_events
+    assert cost.object_bytes > 10 * cost.array_bytes
+
+    for text in ('[a <b c>@2 [d <e f g>]*2]@3', '<[a b]*2 [<c d>]*3 []>', '[a [b c d]*3 e@0.1]'):
+        assert parse_pattern(text).unwrap_cost().events == len(parse_pattern(text).unwrap().value), text
+
+
+def test_unwrap_is_refused_past_the_limits():
+    # A period of 3 * 10 ** 9 cycles, refused before anything is built
+    huge = parse_pattern(angles(7, 11, 13, 17, 19, 23, 29, 31))
+    with pytest.raises(UnwrapLimitError) as refused:
+        huge.unwrap()
+    assert refused.value.cost.cycles == huge.get_cycle_length()
+    with pytest.raises(UnwrapLimitError):
+        unwrap_compact(huge)
+
+    # 68068 events: 20MB as objects, 1.3MB as arrays
+    expr = parse_pattern(angles(7, 11, 13, 17))
+    with pytest.raises(UnwrapLimitError):
+        expr.unwrap(UnwrapLimits(max_bytes=4 * 1024 * 1024))
+    assert len(unwrap_compact(expr, UnwrapLimits(max_bytes=4 * 1024 * 1024))) == expr.get_cycle_length()
+
+    # The inner alternation is only ever at its first element, 5 events where 4 are predicted
+    uneven = parse_pattern('<<[x x x x] a> b>')
+    assert uneven.unwrap_cost().events == 4
+    assert len(uneven.unwrap(UnwrapLimits(max_events=5)).value) == 5
+    with pytest.raises(UnwrapLimitError):
+        uneven.unwrap(UnwrapLimits(max_events=4))
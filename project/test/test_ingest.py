@@ -0,0 +1,136 @@
+import os
+import random
+
+import mido
+import pytest
+
+from ingest import iter_note_tracks, iter_track_notes, pair_notes, read_note_tracks
+from midi_files import melody, write_midi
+from note import ActiveNoteIndex, IncompleteNote
+
+TEST_MID = os.path.join(os.path.dirname(__file__), '..', 'test.mid')
+
+
+def test_streams_notes_per_track(tmp_path):
+    path = str(tmp_path / 'song.mid')
+    write_midi(path, [[mido.MetaMessage('set_tempo', tempo=500000)],
+                      melody([(60, 480), (62, 240), (64, 960)]),
+                      melody([(40, 1920)], channel=1)])
+
+    tracks = read_note_tracks(path)
+
+    assert len(tracks) == 3
+    assert len(tracks[0]) == 0
+    assert [(n.note, n.length, n.channel) for n in tracks[1].notes] == [(60, 1.0, 0), (62, 0.5, 0), (64, 2.0, 0)]
+    assert [(n.note, n.length, n.channel) for n in tracks[2].notes] == [(40, 4.0, 1)]
+
+
+def test_first_track_available_before_file_is_parsed(tmp_path):
+    path = str(tmp_path / 'song.mid')
+    write_midi(path, [melody([(60, 480)]), melody([(62, 480)])])
+
+    stream = iter_note_tracks(path)
+    first = next(stream)
+    assert [n.note for n in first.notes] == [60]
+    assert [n.note for n in next(stream).notes] == [62]
+
+
+def test_matches_mido_on_bundled_file():
+    mid = mido.MidiFile(TEST_MID)
+    expected = [(track_idx, msg.note) for track_idx, track in enumerate(mid.tracks)
+                for msg in track if msg.type == 'note_off']
+
+    assert [(track_idx, note.note) for track_idx, note in iter_track_notes(TEST_MID)] == expected
+
+
+def test_velocity_zero_note_on_closes_note_and_retriggers_are_fifo():
+    messages = [
+        mido.Message('note_on', note=60, velocity=90, time=0),
+        mido.Message('note_on', note=60, velocity=90, time=480),
+        mido.Message('note_on', note=60, velocity=0, time=480),
+        mido.Message('note_off', note=60, time=480),
+        mido.Message('note_off', note=61, time=0),
+    ]
+
+    assert [(n.note, n.start, n.length) for n in pair_notes(messages)] == [(60, 0, 960), (60, 480, 960)]
+
+
+def test_active_note_index_is_keyed_by_channel():
+    index = ActiveNoteIndex()
+    index.start(IncompleteNote(60, 0.0, 0))
+    index.start(IncompleteNote(60, 1.0, 1))
+
+    assert index.stop(60, 1, 3.0).length == 2.0
+    assert index.stop(60, 1, 3.0) is None
+    assert len(index) == 1
+
+
+def columns(tracks):
+    return [(track.resolution, {name: list(values) for name, values in track.columns().items()}) for track in tracks]
+
+
+def smf(chunks, ticks_per_beat=96):
+    data = b'MThd' + (6).to_bytes(4, 'big') + bytes([0, 1, 0, len(chunks)]) + ticks_per_beat.to_bytes(2, 'big')
+    for chunk in chunks:
+        data += b'MTrk' + len(chunk).to_bytes(4, 'big') + chunk
+    return data
+
+
+def random_chunk(rng, events):
+    """Raw track data with running status, long deltas, metas, sysex and every channel message"""
+    chunk = bytearray()
+    status = None
+    for _ in range(events):
+        delta = rng.choice([0, 1, 5, 200, 20000])
+        # Big-endian base 128, continuation bit on all but the last byte
+        groups = [delta & 0x7f]
+        while delta >> 7:
+            delta >>= 7
+            groups.insert(0, delta & 0x7f | 0x80)
+        chunk += bytes(groups)
+        kind = rng.random()
+        if kind < 0.05:
+            chunk += bytes([0xff, 0x51, 3, 0x07, 0xa1, 0x20])
+        elif kind < 0.08:
+            chunk += bytes([0xf0, 3, 0x7e, 0x01, 0xf7])
+            status = None
+        else:
+            new = rng.choice([0x80, 0x90, 0x90, 0x90, 0xb0, 0xc0, 0xe0]) | rng.randrange(3)
+            if new != status or rng.random() < 0.3:
+                chunk.append(new)
+            status = new
+            chunk.append(rng.randrange(60, 64))
+            if status & 0xf0 != 0xc0:
+                chunk.append(rng.choice([0, 64, 100]))
+    return bytes(chunk) + bytes([0, 0xff, 0x2f, 0])
+
+
+def test_fast_reader_matches_mido(tmp_path):
+    rng = random.Random(0)
+    path = str(tmp_path / 'song.mid')
+    with open(path, 'wb') as outfile:
+        outfile.write(smf([random_chunk(rng, 3000) for _ in range(3)] + [b'']))
+
+    fast = read_note_tracks(path)
+    assert sum(len(track) for track in fast) > 1000
+    assert columns(fast) == columns(read_note_tracks(path, fast=False))
+    assert columns(read_note_tracks(TEST_MID)) == columns(read_note_tracks(TEST_MID, fast=False))
+
+
+def test_unusual_chunks_are_read_by_mido(tmp_path):
+    path = str(tmp_path / 'song.mid')
+    note = bytes([0, 0x90, 60, 64, 96, 0x80, 60, 0])
+    # Song position pointer, then a chunk whose size runs past the end of the file
+    with open(path, 'wb') as outfile:
+        outfile.write(smf([note + bytes([0, 0xf2, 1, 2]) + note, note]) + b'MTrk' + (100).to_bytes(4, 'big') + note)
+
+    fast, slow = iter_note_tracks(path), iter_note_tracks(path, fast=False)
+    assert columns([next(fast), next(fast)]) == columns([next(slow), next(slow)])
+    with pytest.raises(EOFError):
+        next(fast)
+
+    with open(path, 'wb') as outfile:
+        # Running status before any status byte
+        outfile.write(smf([bytes([0, 60, 64])]))
+    with pytest.raises(OSError, match='running status'):
+        read_note_tracks(path)
@@ -0,0 +1,84 @@
+import json
+import math
+import os
+import random
+import time
+from fractions import Fraction
+
+from batch import convert_files, track_voices
+from cache import PatternCache
+from ingest import read_note_tracks
+from midi_files import melody, write_midi
+from motifs import convert_shared, find_motifs
+from note import Note, pitch_token
+from track import NoteTrack
+from verify import played
+
+TEST_MID = os.path.join(os.path.dirname(__file__), '..', 'test.mid')
+
+
+def events(pattern):
+    values, ticks, resolution = played(pattern)
+    return [(value, Fraction(tick, resolution)) for value, tick in zip(values, ticks)]
+
+
+def test_riffs_shared_by_tracks_are_written_once(tmp_path):
+    rng = random.Random(1)
+    riff = [(rng.choice([60, 62, 64, 65, 67]), rng.choice([240, 480])) for _ in range(24)]
+    path = str(tmp_path / 'song.mid')
+    write_midi(path, [melody([(50, 480)] + riff + [(52, 960)] * 3 + riff + riff),
+                      melody([(rng.choice([40, 43]), 480) for _ in range(10)] + riff, channel=1)])
+
+    shared = convert_shared([path], jobs=1, min_notes=8)
+
+    assert [motif.notes for motif in shared.motifs] == [24]
+    motif = shared.motifs[0]
+    assert len(motif.occurrences) == 4
+    script = shared.script().splitlines()
+    assert script[0] == f'const motif0 = {json.dumps(motif.pattern)}'
+    assert script[1].startswith('arrange([1, "<50>"], [16, motif0], ') and script[1].endswith(', [32, motif0])')
+
+    # Each voice still plays its notes, motifs looping for as long as their section lasts
+    for (_, _, voices), track in zip(shared.tracks, read_note_tracks(path)):
+        for sections, voice in zip(voices, track_voices(track)):
+            played_events = []
+            for section in sections:
+                if section.motif is None:
+                    played_events += events(section.pattern)
+                else:
+                    played_events += events(section.motif.pattern) * int(section.duration / section.motif.duration)
+            assert played_events == [(pitch_token(pitch), Fraction(length, voice.resolution))
+                                      for pitch, length in zip(voice.pitch, voice.length)]
+
+
+def test_without_shared_riffs_tracks_convert_as_usual():
+    shared = convert_shared([TEST_MID], jobs=2)
+
+    assert shared.motifs == []
+    assert [shared.track_code(voices) for _, _, voices in shared.tracks] == \
+        [json.dumps(result.pattern) for result in convert_files([TEST_MID], jobs=1)]
+
+
+def test_shared_conversion_reuses_the_cache(tmp_path):
+    cache = PatternCache(str(tmp_path / 'patterns.db'))
+    first = convert_shared([TEST_MID], jobs=1, cache=cache).script()
+    misses = cache.misses
+
+    assert convert_shared([TEST_MID], jobs=1, cache=cache).script() == first
+    assert cache.misses == misses and cache.hits == misses
+
+
+def test_long_runs_of_one_note_stay_linear():
+    def seconds(notes):
+        voice = NoteTrack([Note(42, 0.25, 9)] * notes)
+        best = math.inf
+        for _ in range(3):
+            start = time.perf_counter()
+            motifs = find_motifs([voice, voice])
+            best = min(best, time.perf_counter() - start)
+        assert [motif.notes for motif in motifs] == [notes]
+        return best
+
+    small, large = seconds(2000), seconds(16000)
+    # Eight times the notes, which used to take about 64 times as long
+    assert large < 20 * small + 0.05
@@ -0,0 +1,49 @@
+from fractions import Fraction
+
+import pytest
+
+from expression import AngleExpression, BracketExpression, MultiplierExpression
+from parser import BasicParser, ParseError, parse_pattern
+
+
+def test_patterns_print_back_unchanged():
+    for text in ['a', '[0 1]*2', '[0 <2 3>@2]*2', '<a b c>@3', '[a [b c d]*3 e@0.1]',
+                 '<[60 <62 64 65 67>]@8*4 x>', '<[a b]*2 <c d>*3 []>', 'a*2@3']:
+        assert str(parse_pattern(text)) == text
+
+
+def test_structure_and_exact_numbers():
+    expr = parse_pattern('  [ a@1.5 <b c>*2 ]@3 ')
+
+    assert isinstance(expr, BracketExpression)
+    assert expr.length == 3
+    assert expr.value[0].length == Fraction(3, 2)
+    assert isinstance(expr.value[1], MultiplierExpression)
+    assert isinstance(expr.value[1].value[0], AngleExpression)
+    assert str(parse_pattern('a b')) == '[a b]'
+
+
+@pytest.mark.parametrize('text, position', [
+    ('[a b', 0), ('a]', 1), ('[a >', 3), ('a@', 2), ('a@ ]', 2), ('a@x', 2),
+    ('a*1.5', 2), ('a*0', 2), ('@2', 0), ('a@2@3', 3),
+])
+def test_errors_report_their_position(text, position):
+    with pytest.raises(ParseError) as error:
+        parse_pattern(text)
+    assert error.value.position == position
+
+
+def test_recovery_keeps_what_it_can():
+    parser = BasicParser('[a <b c] d@ e*x')
+    expr = parser.parse(recover=True)
+
+    assert str(expr) == '[a <b c d e x>]'
+    assert [error.position for error in parser.errors] == [7, 12, 14, 3, 0]
+
+
+def test_deep_nesting_does_not_recurse():
+    depth = 50_000
+    expr = parse_pattern('[' * depth + 'a' + ']' * depth)
+    for _ in range(depth):
+        expr = expr.value[0]
+    assert expr.value == 'a'
@@ -0,0 +1,42 @@
+import json
+import os
+
+import pytest
+
+import profiling
+from batch import convert_files
+
+TEST_MID = os.path.join(os.path.dirname(__file__), '..', 'test.mid')
+
+
+@pytest.fixture
+def profiled():
+    profiling.enable()
+    yield profiling
+    profiling.disable()
+
+
+def test_disabled_stages_record_nothing():
+    assert not profiling.enabled
+    with profiling.stage('compress'):
+        profiling.count('compress.notes', 5)
+    assert profiling.summary()['counters'] == {}
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_pipeline_stages_and_counters_are_traced(profiled, tmp_path, jobs):
+    list(convert_files([TEST_MID], jobs=jobs))
+    path = str(tmp_path / 'trace.json')
+    profiled.export(path)
+
+    with open(path) as infile:
+        trace = json.load(infile)
+    names = {event['name'] for event in trace['traceEvents']}
+    assert {'ingest.read', 'voices', 'compress', 'render'} <= names
+    counters = trace['otherData']['counters']
+    assert counters['compress.notes'] == counters['ingest.notes'] == 32
+    assert counters['compress.candidates'] >= 32
+    memory = trace['otherData']['memory']
+    assert memory
+    # Peaks of the workers are reported apart from the parent's
+    assert any(name.startswith('worker_') for name in memory) == (jobs > 1)
@@ -0,0 +1,41 @@
+from batch import track_voices
+from compressor import compress_track
+from note import REST
+from quantize import fill_rests, quantize
+from track import NoteTrack
+
+
+def played(notes, resolution=480):
+    track = NoteTrack(resolution=resolution)
+    for pitch, start, length in notes:
+        track.add_ticks(pitch, start, length)
+    return track
+
+
+def test_notes_snap_to_the_grid():
+    track = quantize(played([(60, 3, 233), (62, 250, 236), (64, 478, 4)]), steps=4)
+
+    assert track.resolution == 4
+    assert list(track.start) == [0, 2, 4]
+    assert list(track.length) == [2, 2, 1]
+
+
+def test_gaps_become_rests_up_to_the_end():
+    voice = fill_rests(played([(60, 1, 1), (62, 2, 2), (64, 3, 1)], resolution=1), end=6)
+
+    assert list(voice.pitch) == [REST, 60, 62, 64, REST]
+    assert list(voice.start) == [0, 1, 2, 3, 4]
+    assert list(voice.length) == [1, 1, 1, 1, 2]
+
+
+def test_near_identical_notes_compress_as_repeats():
+    notes = []
+    for bar in range(8):
+        jitter = (bar * 7) % 5 - 2
+        notes += [(60, bar * 960 + jitter, 230), (67, bar * 960 + 480 + jitter, 235)]
+
+    [exact] = track_voices(played(notes))
+    [snapped] = track_voices(played(notes), grid=4)
+
+    assert '~' in str(compress_track(snapped))
+    assert len(str(compress_track(snapped))) < len(str(compress_track(exact))) // 2
@@ -0,0 +1,41 @@
+import random
+
+from repeats import RepeatIndex
+
+
+def brute_force_maximal_repeats(tokens):
+    n = len(tokens)
+    found = set()
+    for length in range(1, n):
+        occurrences = {}
+        for pos in range(n - length + 1):
+            occurrences.setdefault(tuple(tokens[pos:pos + length]), []).append(pos)
+        for positions in occurrences.values():
+            if len(positions) < 2:
+                continue
+            lefts = {tokens[p - 1] if p > 0 else None for p in positions}
+            rights = {tokens[p + length] if p + length < n else None for p in positions}
+            if (len(lefts) > 1 or None in lefts) and (len(rights) > 1 or None in rights):
+                found.add((length, tuple(positions)))
+    return found
+
+
+def test_maximal_repeats_match_brute_force():
+    rng = random.Random(7)
+    for _ in range(200):
+        tokens = [rng.choice('ab' if rng.random() < 0.5 else 'abcd') for _ in range(rng.randrange(1, 40))]
+        index = RepeatIndex(tokens)
+
+        got = {(repeat.length, tuple(repeat.positions)) for repeat in index.maximal_repeats()}
+
+        assert got == brute_force_maximal_repeats(tokens)
+
+
+def test_tandem_repeats_at_position():
+    tokens = list('xabababyaaaa')
+    index = RepeatIndex(tokens)
+
+    assert index.tandem_repeats_at(1) == [(2, 3)]
+    assert index.tandem_repeats_at(8) == [(1, 4)]
+    assert index.tandem_repeats_at(0) == []
+    assert index.longest_common_extension(1, 3) == 4
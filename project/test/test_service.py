@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+from array import array
+
+import pytest
+
+from batch import convert_files, convert_packed
+from cache import PatternCache
+from service import ConversionService
+
+TEST_MID = os.path.join(os.path.dirname(__file__), '..', 'test.mid')
+
+
+def run(scenario, jobs=1, cache=None):
+    """Run scenario(service) against a started service, closing it afterwards"""
+    async def main():
+        service = ConversionService(jobs, cache=cache)
+        await service.start()
+        try:
+            return await scenario(service)
+        finally:
+            service.close()
+    return asyncio.run(main())
+
+
+def test_requests_over_a_socket(tmp_path):
+    address = str(tmp_path / 'service.sock')
+    requests = [
+        {'id': 1, 'op': 'parse', 'pattern': '<a  [b c]>'},
+        {'id': 2, 'op': 'unwrap', 'pattern': '<a [b c] <d e>@2>'},
+        {'id': 3, 'op': 'compress', 'pitches': [60, 62, 60, 62, -1], 'lengths': [1, 1, 1, 1, 2], 'resolution': 2},
+        {'id': 4, 'op': 'convert', 'path': TEST_MID},
+        {'id': 5, 'op': 'parse', 'pattern': '<a [b'},
+        {'id': 6, 'op': 'transpose'},
+        {'id': 7, 'op': 'unwrap', 'pattern': '<<0 1> <0 1 2>>', 'end': 10 ** 9},
+        # A million events fit the limits as arrays, not as a response
+        {'id': 8, 'op': 'unwrap', 'pattern': '<<0 1> <0 1 2>>', 'end': 10 ** 6},
+        {'id': 9, 'op': 'parse', 'pattern': '[' * 200_000},
+    ]
+
+    async def scenario(service):
+        server = await service.listen(address)
+        async with server:
+            reader, writer = await asyncio.open_unix_connection(address)
+            # Too deeply nested for the JSON decoder, the other requests are still answered
+            writer.write(b'[' * 200_000 + b'\n')
+            writer.write(''.join(json.dumps(request) + '\n' for request in requests).encode() + b'not json\n')
+            await writer.drain()
+            writer.write_eof()
+            responses = [json.loads(line) async for line in reader]
+            writer.close()
+        return responses
+
+    responses = run(scenario)
+    by_id = {response['id']: response for response in responses}
+    assert len(responses) == len(requests) + 2 and 'invalid JSON' in by_id[None]['error']
+
+    assert by_id[1] == {'id': 1, 'pattern': '<a [b c]>', 'cycles': 2}
+    assert by_id[2]['pattern'] == '<a b@0.5 c@0.5 d a b@0.5 c@0.5 e>'
+    assert by_id[2]['events'][:3] == [['a', 2], ['b', 1], ['c', 1]] and by_id[2]['resolution'] == 2
+    assert by_id[3]['pattern'] == convert_packed(array('h', [60, 62, 60, 62, -1]).tobytes(),
+                                                 array('q', [1, 1, 1, 1, 2]).tobytes(), 2)
+    assert by_id[4]['tracks'] == [result.pattern for result in convert_files([TEST_MID], jobs=1)]
+    assert 'position' in by_id[5] and 'error' in by_id[5]
+    assert by_id[6]['error'] == "unknown op 'transpose'"
+    assert by_id[7]['error'].startswith('UnwrapLimitError')
+    assert by_id[8]['error'].startswith('UnwrapLimitError')
+    assert 'error' in by_id[9]
+
+
+def test_concurrent_requests_are_batched_and_deduplicated():
+    async def scenario(service):
+        parses = [service.handle({'id': idx, 'op': 'parse', 'pattern': f'<{idx} [a b]>'}) for idx in range(50)]
+        compresses = [service.handle({'op': 'compress', 'pitches': [60, 64, 67] * 8, 'lengths': [1] * 24,
+                                      'resolution': 4}) for _ in range(10)]
+        responses = await asyncio.gather(*parses, *compresses)
+        return responses, service.batches, service.tasks
+
+    responses, batches, tasks = run(scenario)
+    assert [response['pattern'] for response in responses[:50]] == [f'<{idx} [a b]>' for idx in range(50)]
+    assert len({response['pattern'] for response in responses[50:]}) == 1
+    # Everything arrived at once: one batch, the repeated sequence compressed once
+    assert (batches, tasks) == (1, 51)
+
+
+def test_process_pool_answers_like_the_thread():
+    request = {'op': 'unwrap', 'pattern': '<<a b c> <d e>>*2'}
+
+    async def scenario(service):
+        return await service.handle(request)
+
+    assert run(scenario, jobs=2) == run(scenario)
+
+
+def test_socket_paths_are_only_taken_over_when_stale(tmp_path):
+    address = str(tmp_path / 'service.sock')
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(address)
+    stale.close()
+    notes = tmp_path / 'notes.txt'
+    notes.write_text('keep')
+
+    async def scenario(service):
+        server = await service.listen(address)
+        with pytest.raises(OSError):
+            await ConversionService(1).listen(address)
+        with pytest.raises(OSError):
+            await ConversionService(1).listen(str(notes))
+        server.close()
+        await server.wait_closed()
+
+    run(scenario)
+    assert notes.read_text() == 'keep'
+    assert not os.path.exists(address)
+
+
+def test_a_locked_cache_does_not_stall_other_requests(tmp_path):
+    path = str(tmp_path / 'patterns.db')
+    compress = {'op': 'compress', 'pitches': [60, 64, 67] * 8, 'lengths': [1] * 24, 'resolution': 4}
+
+    async def store(service):
+        return await service.handle(compress)
+
+    stored = run(store, cache=PatternCache(path))
+    # Another process holding the write lock, which marking a hit as used waits for
+    locker = sqlite3.connect(path, isolation_level=None)
+    locker.execute('BEGIN IMMEDIATE')
+
+    async def scenario(service):
+        hit = asyncio.ensure_future(service.handle(compress))
+        parsed = await asyncio.wait_for(service.handle({'op': 'parse', 'pattern': '<a b>'}), 5)
+        assert not hit.done()
+        locker.execute('COMMIT')
+        return parsed, await hit
+
+    parsed, hit = run(scenario, cache=PatternCache(path))
+    assert parsed['pattern'] == '<a b>' and hit == stored
@@ -0,0 +1,65 @@
+import pickle
+from fractions import Fraction
+
+import pytest
+
+from note import Note
+from track import NoteTrack, StrudelTrack
+
+
+def test_columns_round_trip_through_views():
+    track = NoteTrack([Note(60, 1.0, 0, start=0.0, velocity=90), Note(62, 0.5, 9, start=1.0)])
+
+    assert len(track) == 2
+    assert [(n.note, n.length, n.channel, n.start, n.velocity) for n in track] == \
+        [(60, 1.0, 0, 0.0, 90), (62, 0.5, 9, 1.0, 64)]
+    assert str(track[-1]) == str(Note(62, 0.5, 9))
+
+
+def test_times_are_exact_ticks_on_a_refined_grid():
+    track = NoteTrack([Note(60, 0.5, 0)], resolution=2)
+    track.add(62, Fraction(1, 2), Fraction(1, 3))
+
+    assert track.resolution == 6
+    assert list(track.length) == [3, 2]
+    assert track[1].length == Fraction(1, 3)
+    assert track[1].start + track[1].length == Fraction(5, 6)
+
+
+def test_float_noise_does_not_refine_the_grid():
+    track = NoteTrack([Note(60, 0.1 + 0.2, 0), Note(62, 1 / 3, 0), Note(64, 1e-17 + 0.5, 0)])
+
+    assert track.resolution == 30
+    assert [note.length for note in track] == [Fraction(3, 10), Fraction(1, 3), Fraction(1, 2)]
+
+
+def test_from_columns_copies_the_columns():
+    track = NoteTrack()
+    track.add(64, 2.0, 0.25)
+    assert (track.resolution, list(track.start), list(track.length)) == (4, [8], [1])
+    copy = pickle.loads(pickle.dumps(NoteTrack.from_columns(track.columns(), track.resolution)))
+
+    assert (list(copy.pitch), list(copy.start), list(copy.length)) == ([64], [8], [1])
+
+
+def test_numpy_views_share_the_data():
+    np = pytest.importorskip('numpy')
+    copy = NoteTrack.from_columns(NoteTrack([Note(64, 0.25, 0, start=2.0)]).columns(), 4)
+
+    arrays = copy.as_numpy()
+    assert arrays['length'].dtype == np.int64
+    arrays['pitch'][0] = 65
+    assert copy[0].note == 65
+
+
+def test_incremental_track_follows_edits():
+    notes = [Note(60 + i % 3, 0.5, 0, start=i / 2) for i in range(24)]
+    strudel = StrudelTrack(NoteTrack(notes), incremental=True)
+    expression = strudel.expression
+
+    strudel.edit(3, 4, [Note(72, Fraction(1, 3), 0, start=1.5)])
+
+    assert strudel.expression is expression
+    assert strudel.track.resolution == 6
+    assert strudel.track[3].length == Fraction(1, 3)
+    assert str(strudel) == str(StrudelTrack(strudel.track))
@@ -0,0 +1,54 @@
+import os
+
+from compressor import compress_ticks
+from timing import decimal_step
+from verify import check, corpus_sequences, random_sequences, verify
+
+TEST_MID = os.path.join(os.path.dirname(__file__), '..', 'test.mid')
+
+
+def test_random_and_corpus_sequences_round_trip():
+    for method in ('compiled', 'unwrap'):
+        report = verify(random_sequences(150, seed=5), method=method)
+        assert report.ok, [str(m) for m in report.failures[:3]]
+        assert report.sequences == 150
+
+        # Triplets are exact unless the sequence ends at a time with no decimal
+        triplets = list(random_sequences(60, seed=6, resolutions=(3, 6, 480)))
+        exact = [sequence for sequence in triplets if sum(sequence[1]) % decimal_step(sequence[2]) == 0]
+        report = verify(exact, method=method)
+        assert report.ok, [str(m) for m in report.failures[:3]]
+        assert len(verify(triplets, method=method).failures) == len(triplets) - len(exact) > 0
+
+    assert verify(corpus_sequences([TEST_MID])).ok
+    assert verify(corpus_sequences([TEST_MID], grid=4)).ok
+
+
+def test_mismatches_point_at_the_first_wrong_event():
+    values, lengths = list('abcab'), [1, 1, 2, 1, 1]
+
+    assert check(values, lengths, 2, str(compress_ticks(values, lengths, 2))) is None
+    assert check(values, lengths, 2, '<a@0.5 b@0.5 c a@0.5 b@0.5>') is None
+    assert check(values, lengths, 2, '<a@0.5 b@0.5 c@1.01 a@0.5 b@0.5>').index == 2
+    assert check(values, lengths, 2, '<a@0.5 b@0.5 d a@0.5 b@0.5>').index == 2
+    mismatch = check(values, lengths, 2, '<a@0.5 b@0.5 c>')
+    assert (mismatch.index, mismatch.got) == (3, None)
+
+
+def test_repeated_bodies_keep_exact_weights():
+    # Weights used to be written relative to the 3 quarter beat slots, the 4 as 1.3333333333333333
+    values, lengths = list('abcde' * 2), [3, 3, 3, 4, 3] * 2
+
+    pattern = str(compress_ticks(values, lengths, 4))
+
+    assert pattern == '<[a@3 b@3 c@3 d@4 e@3]@8*2>'
+    assert check(values, lengths, 4, pattern) is None
+
+
+def test_triplets_are_written_exactly():
+    values, lengths = list('abcd'), [160, 480, 320, 480]
+
+    pattern = str(compress_ticks(values, lengths, 480))
+
+    assert pattern == '<[a b@3 c@2]@2 d>'
+    assert check(values, lengths, 480, pattern) is None
@@ -0,0 +1,56 @@
+import mido
+
+from batch import convert_files
+from midi_files import write_midi
+from track import NoteTrack
+from voices import split_voices, voice_assignment
+
+
+def chords():
+    track = NoteTrack()
+    # Two bars of triads over a held bass note on another channel
+    for bar in range(2):
+        for beat in range(4):
+            for pitch in (72, 67, 64):
+                track.add(pitch, bar * 4 + beat, 1)
+        track.add(36, bar * 4, 4, channel=1)
+    return track
+
+
+def test_chords_split_into_monophonic_voices_by_pitch():
+    voices = split_voices(chords())
+
+    assert [len(voice) for voice in voices] == [8, 8, 8, 2]
+    assert [set(voice.pitch) for voice in voices] == [{72}, {67}, {64}, {36}]
+    assert [set(voice.channel) for voice in voices] == [{0}, {0}, {0}, {1}]
+    for voice in voices:
+        ends = [s + l for s, l in zip(voice.start, voice.length)]
+        assert all(end <= start for end, start in zip(ends, voice.start[1:]))
+
+
+def test_voices_are_reused_once_free():
+    track = NoteTrack()
+    track.add(60, 0, 2)
+    track.add(64, 1, 2)
+    track.add(67, 2, 2)
+    track.add(71, 3, 2)
+
+    assert voice_assignment(track) == [0, 1, 0, 1]
+    assert [list(voice.pitch) for voice in split_voices(NoteTrack())] == [[]]
+
+
+def test_voices_stack_in_batch_output(tmp_path):
+    path = str(tmp_path / 'chords.mid')
+    messages = []
+    for low, high in ((60, 64), (62, 65)):
+        messages += [mido.Message('note_on', note=low, velocity=64, time=0),
+                     mido.Message('note_on', note=high, velocity=64, time=0),
+                     mido.Message('note_off', note=low, time=480),
+                     mido.Message('note_off', note=high, time=0)]
+    write_midi(path, [messages])
+
+    [split] = convert_files([path], jobs=1)
+    [joined] = convert_files([path], jobs=1, split=False)
+
+    assert split.pattern == '<64 65>, <60 62>'
+    assert joined.pattern == '<60 64 62 65>'
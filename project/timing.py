@@ -0,0 +1,91 @@
+import math
+from decimal import Decimal
+from fractions import Fraction
+from typing import Iterable, List, Tuple
+
+# Exact musical time
+#
+# Lengths and positions are measured in cycles (beats for MIDI input) and kept exact, as ints or
+# Fractions, so equal durations always compare and hash equal no matter how they were computed.
+# Hot loops avoid Fraction arithmetic by moving everything onto a common integer grid first:
+# with `resolution` ticks per cycle, every time is a plain int.
+
+Time = Fraction
+
+# Finest grid a float is read on. Float arithmetic leaves digits far past any musical meaning
+# (0.1 + 0.2 prints as 0.30000000000000004), whose denominators would overflow the 64-bit tick
+# arrays once times are put on a common grid.
+MAX_FLOAT_DENOMINATOR = 10 ** 6
+
+
+def to_time(value) -> Fraction:
+    """Exact time of an int, Fraction, decimal string or float.
+
+    A float is taken as the nearest fraction with a denominator up to MAX_FLOAT_DENOMINATOR,
+    which is the decimal it prints as unless that has more than six places."""
+    if isinstance(value, Fraction):
+        return value
+    if isinstance(value, float):
+        return Fraction(repr(value)).limit_denominator(MAX_FLOAT_DENOMINATOR)
+    return Fraction(value)
+
+
+def is_decimal(value) -> bool:
+    """Whether a time has a finite decimal expansion, so format_time writes it exactly"""
+    # Finite decimal iff the denominator only has factors 2 and 5
+    return decimal_step(to_time(value).denominator) == 1
+
+
+def decimal_step(resolution: int) -> int:
+    """Ticks of `resolution` per cycle whose multiples are exactly the times with a decimal"""
+    step = resolution
+    for factor in (2, 5):
+        while step % factor == 0:
+            step //= factor
+    return step
+
+
+def format_time(value) -> str:
+    """Shortest decimal text for a time, exact whenever the time has a finite decimal expansion"""
+    if isinstance(value, float):
+        return _fixed_point(value)
+
+    value = Fraction(value)
+    if value.denominator == 1:
+        return str(value.numerator)
+
+    denominator = value.denominator
+    twos = fives = 0
+    while denominator % 2 == 0:
+        denominator //= 2
+        twos += 1
+    while denominator % 5 == 0:
+        denominator //= 5
+        fives += 1
+    if denominator != 1:
+        # Mini-notation has no fractions, the closest float is the best we can write
+        return _fixed_point(float(value))
+
+    places = max(twos, fives)
+    digits = str(abs(value.numerator) * 10 ** places // value.denominator).rjust(places + 1, '0')
+    sign = '-' if value < 0 else ''
+    return f'{sign}{digits[:-places]}.{digits[-places:]}'
+
+
+def _fixed_point(value: float) -> str:
+    """Shortest digits of a float without an exponent, which mini-notation numbers can't have"""
+    if value.is_integer():
+        return str(int(value))
+    return format(Decimal(repr(value)), 'f')
+
+
+def common_denominator(values: Iterable) -> int:
+    """Smallest resolution on which every value is a whole number of ticks"""
+    return math.lcm(1, *(to_time(value).denominator for value in values))
+
+
+def to_ticks(values: Iterable) -> Tuple[int, List[int]]:
+    """Move exact times onto their common integer grid, returns (resolution, ticks)"""
+    times = [to_time(value) for value in values]
+    resolution = common_denominator(times)
+    return resolution, [time.numerator * (resolution // time.denominator) for time in times]
@@ -1,13 +1,201 @@
-from typing import List
+import math
+from array import array
+from fractions import Fraction
+from typing import Dict, Iterable, Iterator
+
+import profiling
+from cache import PatternCache, storable, track_key
+from compressor import CompressorSettings, IncrementalCompressor, compress_track
+from expression import AngleExpression
+from note import Note, pitch_token
+from timing import Time, format_time, to_time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-from note import Note
 
 # Tracks of midi + notes
 class NoteTrack:
-    def __init__(self, notes: List[Note]):
-        self.notes: List[Note] = notes
+    """Notes of one track, stored column-wise in typed arrays instead of one object per note.
+
+    Five compact columns (pitch, start, length, channel, velocity) cost 22 bytes per note, where a
+    Note object costs several times that. Times are integer ticks, `resolution` of them per beat,
+    so they stay exact; the grid is refined whenever a note does not fit on it. Indexing or
+    iterating gives lightweight NoteView objects that read straight from the columns."""
+
+    def __init__(self, notes: Iterable[Note] = (), resolution: int = 1):
+        self.resolution = resolution
+        self.pitch = array('h')
+        self.start = array('q')
+        self.length = array('q')
+        self.channel = array('B')
+        self.velocity = array('B')
+
+        for note in notes:
+            self.append(note)
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Iterable], resolution: int) -> 'NoteTrack':
+        """Build a track from a dict of columns as returned by columns()"""
+        track = cls(resolution=resolution)
+        for name, values in columns.items():
+            getattr(track, name).extend(values)
+        return track
+
+    def append(self, note: Note):
+        self.add(note.note, note.start, note.length, note.channel, note.velocity)
+
+    def add(self, pitch: int, start: Time, length: Time, channel: int = 0, velocity: int = 64):
+        """Append a note without going through a Note object, times in beats"""
+        start = to_time(start)
+        length = to_time(length)
+        self.refine(math.lcm(start.denominator, length.denominator))
+        self.add_ticks(pitch, start.numerator * (self.resolution // start.denominator),
+                       length.numerator * (self.resolution // length.denominator), channel, velocity)
+
+    def add_ticks(self, pitch: int, start: int, length: int, channel: int = 0, velocity: int = 64):
+        """Append a note with times already in ticks of this track"""
+        self.pitch.append(pitch)
+        self.start.append(start)
+        self.length.append(length)
+        self.channel.append(channel)
+        self.velocity.append(velocity)
+
+    def replace(self, start: int, end: int, notes: Iterable[Note]):
+        """Replace notes start..end (exclusive) with `notes`, times in beats"""
+        notes = list(notes)
+        times = [(to_time(note.start), to_time(note.length)) for note in notes]
+        for note_start, note_length in times:
+            self.refine(math.lcm(note_start.denominator, note_length.denominator))
+
+        resolution = self.resolution
+        self.pitch[start:end] = array('h', [note.note for note in notes])
+        self.start[start:end] = array('q', [int(note_start * resolution) for note_start, _ in times])
+        self.length[start:end] = array('q', [int(note_length * resolution) for _, note_length in times])
+        self.channel[start:end] = array('B', [note.channel for note in notes])
+        self.velocity[start:end] = array('B', [note.velocity for note in notes])
+
+    def refine(self, denominator: int):
+        """Make the tick grid fine enough for times with this denominator"""
+        resolution = math.lcm(self.resolution, denominator)
+        if resolution == self.resolution:
+            return
+        factor = resolution // self.resolution
+        self.start = array('q', [ticks * factor for ticks in self.start])
+        self.length = array('q', [ticks * factor for ticks in self.length])
+        self.resolution = resolution
+
+    def columns(self) -> Dict[str, array]:
+        return {
+            'pitch': self.pitch,
+            'start': self.start,
+            'length': self.length,
+            'channel': self.channel,
+            'velocity': self.velocity,
+        }
+
+    def as_numpy(self) -> Dict[str, 'np.ndarray']:
+        """Zero-copy NumPy views of the columns"""
+        if np is None:
+            raise ImportError('NoteTrack.as_numpy requires numpy')
+        return {name: np.frombuffer(column, dtype=column.typecode) for name, column in self.columns().items()}
+
+    @property
+    def notes(self) -> 'NoteTrack':
+        """The track itself, kept for callers of the old list of notes"""
+        return self
+
+    def __len__(self) -> int:
+        return len(self.pitch)
+
+    def __getitem__(self, idx: int) -> 'NoteView':
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('note index out of range')
+        return NoteView(self, idx)
+
+    def __iter__(self) -> Iterator['NoteView']:
+        for idx in range(len(self)):
+            yield NoteView(self, idx)
+
+
+class NoteView:
+    """Read-only view of one note of a NoteTrack, with the same attributes as Note"""
+    __slots__ = ('track', 'idx')
+
+    def __init__(self, track: NoteTrack, idx: int):
+        self.track = track
+        self.idx = idx
+
+    @property
+    def note(self) -> int:
+        return self.track.pitch[self.idx]
+
+    @property
+    def start(self) -> Fraction:
+        return Fraction(self.track.start[self.idx], self.track.resolution)
+
+    @property
+    def length(self) -> Fraction:
+        return Fraction(self.track.length[self.idx], self.track.resolution)
+
+    @property
+    def channel(self) -> int:
+        return self.track.channel[self.idx]
+
+    @property
+    def velocity(self) -> int:
+        return self.track.velocity[self.idx]
+
+    def to_note(self) -> Note:
+        return Note(self.note, self.length, self.channel, self.start, self.velocity)
+
+    def __str__(self) -> str:
+        return f'Note: {self.note}, {format_time(self.length)}'
+
 
-# TODO:
 class StrudelTrack:
-    def __init__(self):
-        pass
\ No newline at end of file
+    """A NoteTrack compressed into its shortest Strudel pattern.
+
+    With a PatternCache, a track whose notes were compressed before is loaded back from the
+    stored pattern instead of being compressed again. An incremental track keeps the compressor
+    state instead, so edit() only recompresses the part of the pattern an edit touches."""
+
+    def __init__(self, track: NoteTrack, settings: CompressorSettings | None = None,
+                 cache: PatternCache | None = None, incremental: bool = False):
+        self.track = track
+        self.compressor: IncrementalCompressor | None = None
+        if incremental:
+            self.compressor = IncrementalCompressor(
+                [pitch_token(pitch) for pitch in track.pitch],
+                [Fraction(length, track.resolution) for length in track.length], settings)
+            self.expression = self.compressor.expression
+            return
+        if cache is None:
+            self.expression: AngleExpression = compress_track(track, settings)
+            return
+
+        key = track_key(track, settings)
+        expression = cache.get_expression(key)
+        if expression is None:
+            self.expression = compress_track(track, settings)
+            if storable(settings):
+                cache.put_expression(key, self.expression)
+        else:
+            self.expression = expression
+
+    def edit(self, start: int, end: int, notes: Iterable[Note]) -> AngleExpression:
+        """Replace notes start..end (exclusive) of the track and update the pattern in place"""
+        if self.compressor is None:
+            raise ValueError('StrudelTrack.edit needs a track built with incremental=True')
+        notes = list(notes)
+        self.track.replace(start, end, notes)
+        return self.compressor.replace(start, end, [pitch_token(note.note) for note in notes],
+                                       [note.length for note in notes])
+
+    def __str__(self) -> str:
+        with profiling.stage('render'):
+            return self.expression.__str__()
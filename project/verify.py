@@ -0,0 +1,198 @@
+"""Round-trip verification of the compressor.
+
+Every sequence is compressed, the pattern text is parsed back and played for one period, and the
+result is compared with the input: same values, same lengths, exactly. Playing uses the compiled
+evaluator and the comparison is done on integer arrays (NumPy when available), values as ids and
+lengths as ticks on a grid both sides fit on, so checking costs little next to compressing.
+
+Usage: python verify.py [--random N] [--seed S] [song.mid ...]
+"""
+import argparse
+import math
+import random
+import time
+from fractions import Fraction
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from compiled import compile_expression
+from compressor import CompressorSettings, compress_ticks
+from note import pitch_token
+from parser import parse_pattern
+from timing import to_ticks
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Mismatch:
+    """Where a pattern stops playing the sequence it was compressed from"""
+
+    def __init__(self, index: int, expected: Tuple | None, got: Tuple | None, pattern: str):
+        self.index = index
+        self.expected = expected
+        self.got = got
+        self.pattern = pattern
+
+    def __str__(self):
+        return f'event {self.index}: expected {self.expected}, got {self.got} in {self.pattern[:200]}'
+
+
+class VerifyReport:
+    """Outcome of verifying many sequences"""
+
+    def __init__(self):
+        self.sequences = 0
+        self.notes = 0
+        self.compress_seconds = 0.0
+        self.verify_seconds = 0.0
+        self.failures: List[Mismatch] = []
+
+    @property
+    def ok(self) -> bool:
+        return not self.failures
+
+    def __str__(self):
+        compress_rate = self.notes / self.compress_seconds if self.compress_seconds else math.inf
+        verify_rate = self.notes / self.verify_seconds if self.verify_seconds else math.inf
+        return (f'{self.sequences} sequences, {self.notes} notes, {len(self.failures)} failures; '
+                f'compress {compress_rate:,.0f} notes/s, verify {verify_rate:,.0f} notes/s')
+
+
+def played(pattern: str, method: str = 'compiled') -> Tuple[List[str], List[int], int]:
+    """(values, lengths in ticks, resolution) of one period of a pattern, read from its text"""
+    expr = parse_pattern(pattern)
+    if expr.value == '':
+        # An empty pattern plays nothing
+        return [], [], 1
+
+    if method == 'unwrap':
+        leaves = expr.unwrap().value
+        resolution, ticks = to_ticks(leaf.length for leaf in leaves)
+        return [leaf.value for leaf in leaves], ticks, resolution
+
+    program = compile_expression(expr)
+    ids, ticks = program.run_cycles()
+    return [program.values[idx] for idx in ids], list(ticks), program.resolution
+
+
+def check(values: Sequence[str], lengths: Sequence[int], resolution: int, pattern: str,
+          method: str = 'compiled') -> Mismatch | None:
+    """Compare what a pattern plays with the sequence, lengths in ticks of `resolution`"""
+    got_values, got_ticks, got_resolution = played(pattern, method)
+
+    # Both sides on one grid, so equal lengths are equal ints
+    grid = math.lcm(resolution, got_resolution)
+    scale, got_scale = grid // resolution, grid // got_resolution
+    ids = {value: idx for idx, value in enumerate(dict.fromkeys(got_values))}
+
+    count = min(len(values), len(got_values))
+    if np is not None:
+        expected_ids = np.fromiter((ids.get(value, -1) for value in values[:count]), dtype=np.int64, count=count)
+        got_ids = np.fromiter((ids[value] for value in got_values[:count]), dtype=np.int64, count=count)
+        expected_ticks = np.asarray(lengths[:count], dtype=np.int64) * scale
+        actual_ticks = np.asarray(got_ticks[:count], dtype=np.int64) * got_scale
+        wrong = np.flatnonzero((expected_ids != got_ids) | (expected_ticks != actual_ticks))
+        first = int(wrong[0]) if len(wrong) else None
+    else:
+        first = next((i for i in range(count) if values[i] != got_values[i]
+                      or lengths[i] * scale != got_ticks[i] * got_scale), None)
+
+    if first is None and len(values) == len(got_values):
+        return None
+    if first is None:
+        first = count
+
+    def event(events, ticks, res, idx):
+        return (events[idx], str(Fraction(ticks[idx], res))) if idx < len(events) else None
+
+    return Mismatch(first, event(values, lengths, resolution, first),
+                    event(got_values, got_ticks, got_resolution, first), pattern)
+
+
+def verify(sequences: Iterable[Tuple[Sequence[str], Sequence[int], int]],
+           settings: CompressorSettings | None = None, method: str = 'compiled') -> VerifyReport:
+    """Compress and check every (values, lengths in ticks, resolution) sequence"""
+    report = VerifyReport()
+    for values, lengths, resolution in sequences:
+        start = time.perf_counter()
+        pattern = str(compress_ticks(values, lengths, resolution, settings))
+        checked = time.perf_counter()
+        mismatch = check(values, lengths, resolution, pattern, method)
+        done = time.perf_counter()
+
+        report.sequences += 1
+        report.notes += len(values)
+        report.compress_seconds += checked - start
+        report.verify_seconds += done - checked
+        if mismatch is not None:
+            report.failures.append(mismatch)
+    return report
+
+
+# Note lengths in ticks at each resolution random_sequences() writes, the second tuple for notes
+# outside motifs. 3, 6 and 480 ticks per beat give triplets, which have no decimal length
+LENGTHS = {
+    4: ((1, 2, 3, 4, 6, 8), (1, 2, 3, 5)),
+    3: ((1, 2, 3, 4, 6), (1, 2, 3)),
+    6: ((1, 2, 3, 4, 6, 9, 12), (1, 2, 4, 5)),
+    480: ((120, 160, 240, 320, 480, 960), (160, 240, 480)),
+}
+
+
+def random_sequences(count: int, seed: int = 0, max_notes: int = 200,
+                     resolutions: Sequence[int] = (4,)) -> Iterator[Tuple[List[str], List[int], int]]:
+    """Melodies built from repeated motifs, random notes and rests, with lengths in ticks of one of
+    `resolutions` (keys of LENGTHS), quarter beats by default.
+
+    Triplet sequences are not padded, so some end at a time with no decimal. No pattern plays
+    those exactly and verify() reports them as mismatches."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        resolution = rng.choice(resolutions) if len(resolutions) > 1 else resolutions[0]
+        motif_lengths, note_lengths = LENGTHS[resolution]
+        motifs = [[(rng.choice('~abcdefg'), rng.choice(motif_lengths)) for _ in range(rng.randint(1, 8))]
+                  for _ in range(rng.randint(1, 3))]
+        size = rng.randint(0, max_notes)
+        sequence = []
+        while len(sequence) < size:
+            if rng.random() < 0.7:
+                sequence += rng.choice(motifs)
+            else:
+                sequence.append((rng.choice('abcdefgh'), rng.choice(note_lengths)))
+        yield [value for value, _ in sequence], [length for _, length in sequence], resolution
+
+
+def corpus_sequences(paths: Iterable[str], grid: int | None = None) -> Iterator[Tuple[List[str], List[int], int]]:
+    """Every voice of every track of some MIDI files, as batch conversion compresses them"""
+    from batch import track_voices
+    from ingest import iter_note_tracks
+
+    for path in paths:
+        for track in iter_note_tracks(path):
+            for voice in track_voices(track, grid=grid):
+                yield [pitch_token(pitch) for pitch in voice.pitch], list(voice.length), voice.resolution
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that compressed patterns play back their input exactly')
+    parser.add_argument('paths', nargs='*', help='MIDI files to verify on')
+    parser.add_argument('--random', type=int, default=1000, help='random sequences to verify on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resolutions', type=int, nargs='+', default=sorted(LENGTHS),
+                        help='ticks per beat of the random sequences, triplets need 3, 6 or 480')
+    parser.add_argument('--unwrap', action='store_true', help='play patterns with unwrap() instead')
+    args = parser.parse_args()
+    method = 'unwrap' if args.unwrap else 'compiled'
+
+    for label, sequences in (('random', random_sequences(args.random, args.seed, resolutions=args.resolutions)),
+                             ('corpus', corpus_sequences(args.paths))):
+        report = verify(sequences, method=method)
+        print(f'{label}: {report}')
+        for mismatch in report.failures[:10]:
+            print(f'  {mismatch}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import heapq
+from typing import List
+
+from track import NoteTrack
+
+
+# Voice separation
+#
+# The compressor reads a track as one sequence of notes, which only means something when no two
+# notes sound at once. Chords and overlapping lines are split into monophonic voices first:
+# notes are grouped by channel, then assigned to voices by greedy interval partitioning, which
+# uses as few voices as the densest chord needs. Notes are visited by start time and, within a
+# chord, from the highest pitch down, and always take the lowest numbered free voice, so voice 0
+# follows the top line. Two heaps (voices still sounding by end time, free voices by number)
+# make the whole pass O(n log n).
+
+def voice_assignment(track: NoteTrack) -> List[int]:
+    """Voice of every note of the track, voices numbered across channels in channel order"""
+    pitch, start, length, channel = track.pitch, track.start, track.length, track.channel
+    order = sorted(range(len(track)), key=lambda idx: (channel[idx], start[idx], -pitch[idx]))
+
+    voices = [0] * len(track)
+    first_voice = 0
+    voice_count = 0
+    current_channel = None
+    sounding: List = []
+    free: List[int] = []
+
+    for idx in order:
+        if channel[idx] != current_channel:
+            # Voices are never shared between channels
+            current_channel = channel[idx]
+            first_voice = voice_count
+            sounding = []
+            free = []
+
+        note_start = start[idx]
+        while sounding and sounding[0][0] <= note_start:
+            heapq.heappush(free, heapq.heappop(sounding)[1])
+
+        if free:
+            voice = heapq.heappop(free)
+        else:
+            voice = voice_count
+            voice_count += 1
+        voices[idx] = voice
+        heapq.heappush(sounding, (note_start + length[idx], voice))
+
+    return voices
+
+
+def split_voices(track: NoteTrack) -> List[NoteTrack]:
+    """Monophonic tracks that together hold the notes of `track`, each in start order.
+
+    A track without notes gives one empty voice, so every track has something to compress."""
+    if not len(track):
+        return [NoteTrack(resolution=track.resolution)]
+
+    voices = voice_assignment(track)
+    split = [NoteTrack(resolution=track.resolution) for _ in range(max(voices) + 1)]
+    start = track.start
+    for idx in sorted(range(len(track)), key=lambda idx: start[idx]):
+        split[voices[idx]].add_ticks(track.pitch[idx], start[idx], track.length[idx],
+                                     track.channel[idx], track.velocity[idx])
+    return split